@@ -0,0 +1,8 @@
+"""
+benchmarks
+==========
+
+Synthetic data and benchmarks for measuring the performance of validate.
+These are not installed with the package.
+
+"""
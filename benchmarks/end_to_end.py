@@ -0,0 +1,375 @@
+"""
+end_to_end
+===============
+
+This module times complete runs of validate on synthetic data. It
+builds a model run tree (<data_root>/<experiment>-<run>), an
+observations root with a directory for every dataset named in
+'comp_obs' or 'extra_obs' of the configurations, a cmip5 root
+with a few models and a directory of cmip5 means, all with the
+variables used by the configurations being run. Each configuration is
+then run with control.execute in its own process and the wall time of
+every stage, taken from the profiler, and the size of the output are
+appended to a history file.
+
+The results can be checked against a baseline, a previous record of
+the history file, and any stage which became slower than the tolerance
+allows is reported as a regression. The scaling test runs a
+configuration with thousands of small plots to stress
+plot_iterator.loop and pdf_organizer.arrange.
+
+Usage:
+    python -m benchmarks.end_to_end --configs conf_atmos.yaml conf_ocean.yaml
+    python -m benchmarks.end_to_end --scaling 2000 --baseline baseline.json
+
+.. moduleauthor:: David Fallis
+"""
+import os
+import sys
+import json
+import shutil
+import platform
+import argparse
+import datetime
+import resource
+import multiprocessing
+import yaml
+from benchmarks import synthetic
+
+CONFIGS = ['conf_atmos.yaml',
+           'conf_ocean.yaml',
+           'conf_land.yaml',
+           'conf_seaice.yaml',
+           'conf_ocnbgchem.yaml',
+           ]
+
+# realm of the variables of each configuration
+CONFIG_REALMS = {'conf_atmos.yaml': 'atmos',
+                 'conf_ocean.yaml': 'ocean',
+                 'conf_land.yaml': 'land',
+                 'conf_seaice.yaml': 'seaIce',
+                 'conf_ocnbgchem.yaml': 'ocnBgchem',
+                 }
+
+# variables which are not in the realm of their configuration
+VARIABLE_REALMS = {'pr': 'atmos',
+                   'prsn': 'atmos',
+                   'tas': 'atmos',
+                   }
+
+LEVELS = [5, 50, 100, 250, 500, 1000, 2000, 3000, 4000, 5000]
+
+RUN = 'bench'
+EXPERIMENT = 'historical'
+OBSERVATIONS = 'observations'
+
+
+def _configure_dir():
+    import validate
+    return os.path.join(os.path.dirname(validate.__file__), 'configure')
+
+
+def load_config(name):
+    """ Returns the settings of a configuration in validate/configure
+        or of a file
+    """
+    if not os.path.isfile(name):
+        name = os.path.join(_configure_dir(), name)
+    with open(name, 'r') as f:
+        return yaml.load(f)
+
+
+def variables(settings, config=''):
+    """ Returns a dictionary mapping each variable of the plots
+        to its realm and whether it needs levels
+    """
+    found = {}
+    for p in settings['plots']:
+        names = [p['variable']] + p.get('extra_variables', [])
+        for var in names:
+            realm = VARIABLE_REALMS.get(var, CONFIG_REALMS.get(os.path.basename(config), 'atmos'))
+            levels = bool([d for d in p.get('depths', []) if d != ""])
+            levels = levels or p.get('plot_projection') == 'section'
+            old = found.get(var, (realm, False))
+            found[var] = (realm, old[1] or levels)
+    return found
+
+
+def observations(settings):
+    """ Returns a dictionary mapping each observations dataset named in
+        'comp_obs' or 'extra_obs' of the plots to the variables it needs
+    """
+    found = {}
+    default = settings.get('defaults', {}) or {}
+    for p in settings['plots']:
+        for o in p.get('comp_obs', default.get('comp_obs')) or []:
+            found.setdefault(o, set()).add(p['variable'])
+        extra = p.get('extra_variables', default.get('extra_variables')) or []
+        for o, var in zip(p.get('extra_obs', default.get('extra_obs')) or [], extra):
+            found.setdefault(o, set()).add(var)
+    return found
+
+
+def build_tree(root, found, args, obs=None):
+    """ Writes the synthetic files for the variables under root and
+        returns the options pointing control.execute to them
+
+    Parameters
+    ----------
+    root : string
+    found : dictionary
+            as returned by variables()
+    args : argparse.Namespace
+    obs : dictionary
+          as returned by observations(), by default one dataset with
+          every variable
+    """
+    nlon, nlat = [int(n) for n in args.grid.split('x')]
+    data_root = os.path.join(root, 'data') + '/'
+    run_dir = os.path.join(data_root, EXPERIMENT + '-' + RUN)
+    obs_root = os.path.join(root, 'obs')
+    if obs is None:
+        obs = {OBSERVATIONS: set(found)}
+    cmip_root = os.path.join(root, 'cmip5')
+    means = os.path.join(root, 'cmip5_means')
+    for d in [run_dir, cmip_root, means] + [os.path.join(obs_root, o) for o in obs]:
+        if not os.path.isdir(d):
+            os.makedirs(d)
+    synthetic.make_mask(os.path.join(run_dir, 'sftof_fx_SYN_historical_r0i0p0.nc'),
+                        'sftof', nlon, nlat, 'ocean')
+    synthetic.make_mask(os.path.join(run_dir, 'sftlf_fx_SYN_historical_r0i0p0.nc'),
+                        'sftlf', nlon, nlat, 'atmos')
+
+    # the run is split into time slices to be merged like real output
+    years = args.years // args.slices
+    for var, (realm, needs_levels) in sorted(found.items()):
+        levels = LEVELS if needs_levels else None
+        common = {'var': var, 'levels': levels, 'realm': realm, 'experiment': EXPERIMENT}
+        for i in xrange(args.slices):
+            synthetic.make_file(run_dir, nlon=nlon, nlat=nlat, years=years,
+                                start_year=args.start_year + i * years, **common)
+        # observations on a coarser grid so that they are remapped
+        for k, dataset in enumerate(sorted(o for o in obs if var in obs[o])):
+            obs_dir = os.path.join(obs_root, dataset)
+            name = synthetic.make_file(obs_dir, nlon=nlon // 2, nlat=nlat // 2, years=args.years,
+                                       start_year=args.start_year, model='OBS', seed=1 + k, **common)
+            os.rename(name, os.path.join(obs_dir, var + '_' + dataset + '.nc'))
+        var_dir = os.path.join(cmip_root, var)
+        if not os.path.isdir(var_dir):
+            os.makedirs(var_dir)
+        for j, model in enumerate(args.models):
+            synthetic.make_file(var_dir, nlon=nlon, nlat=nlat, years=args.years,
+                                start_year=args.start_year, model=model, seed=2 + j, **common)
+        synthetic.make_file(means, nlon=nlon, nlat=nlat, years=args.years,
+                            start_year=args.start_year, model='ENS-MEAN', seed=99, **common)
+    return {'run': RUN,
+            'experiment': EXPERIMENT,
+            'direct_data_root': '',
+            'data_root': data_root,
+            'observations_root': obs_root + '/',
+            'cmip5_root': cmip_root,
+            'cmip5_means': means,
+            'output_root': None,
+            }
+
+
+def scaling_config(count, found):
+    """ Returns the settings of a configuration with count cheap plots """
+    seasons = [['DJF'], ['MAM'], ['JJA'], ['SON'], ['DJF', 'MAM', 'JJA', 'SON']]
+    names = sorted(found)
+    plots = []
+    for i in xrange(count):
+        plots.append({'variable': names[i % len(names)],
+                      'plot_projection': 'global_map',
+                      'data_type': 'climatology',
+                      'seasons': seasons[(i // len(names)) % len(seasons)],
+                      'plot_name': 'scaling_' + str(i),
+                      })
+    return {'defaults': {'png': True}, 'plots': plots}
+
+
+def _directory_size(name):
+    total = 0
+    count = 0
+    for dirname, _, files in os.walk(name):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(dirname, f))
+            except OSError:
+                continue
+            count += 1
+    return total, count
+
+
+def run_config(job):
+    """ Runs one configuration in a new directory and returns its timings.
+        This is run in a new process.
+    """
+    name, settings, options, workdir, jobs = job
+    if os.path.isdir(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
+    os.chdir(workdir)
+    with open('conf.yaml', 'w') as outfile:
+        yaml.safe_dump(settings, outfile, default_flow_style=False)
+    import validate.control as control
+    import validate.profiler as profiler
+    options = dict(options)
+    options.update({'cache_root': os.path.join(workdir, 'cache'),
+                    'jobs': jobs,
+                    'profile': True,
+                    })
+    control.execute(options)
+    summary = profiler.summary()
+    stages = dict((k, v['wall']) for k, v in summary.items() if v['category'] == 'control')
+    categories = {}
+    for v in summary.values():
+        if v['category'] != 'control':
+            categories[v['category']] = categories.get(v['category'], 0) + v['wall']
+    plot_bytes, plot_files = _directory_size('plots')
+    product_bytes, product_files = _directory_size(options['cache_root'])
+    return name, {'stages': stages,
+                  'categories': categories,
+                  'wall': sum(stages.values()),
+                  'plots': len(settings['plots']),
+                  'plot_files': plot_files,
+                  'plot_bytes': plot_bytes,
+                  'product_files': product_files,
+                  'product_bytes': product_bytes,
+                  'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                  }
+
+
+def regressions(record, baseline, tolerance=0.2, floor=1.0):
+    """ Returns a list of messages for each stage of each configuration which
+        took more than (1 + tolerance) times as long as in the baseline.
+        Stages which took less than floor seconds in the baseline are not
+        compared, as their time is mostly noise.
+    """
+    messages = []
+    for config, result in sorted(record['configs'].items()):
+        if config not in baseline['configs']:
+            continue
+        base = baseline['configs'][config]
+        times = dict(result['stages'], total=result['wall'])
+        basetimes = dict(base['stages'], total=base['wall'])
+        for stage in sorted(times):
+            if stage not in basetimes or basetimes[stage] < floor:
+                continue
+            if times[stage] > basetimes[stage] * (1 + tolerance):
+                messages.append(config + ': ' + stage + ' took ' + str(round(times[stage], 2)) +
+                                ' s, ' + str(round(basetimes[stage], 2)) + ' s in the baseline')
+    return messages
+
+
+def read_history(name):
+    try:
+        with open(name, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return []
+
+
+def run(args):
+    root = os.path.abspath(args.work)
+    jobs = []
+    for config in args.configs:
+        settings = load_config(config)
+        jobs.append((os.path.basename(config), settings, variables(settings, config)))
+    if args.scaling:
+        found = variables(load_config('conf_atmos.yaml'), 'conf_atmos.yaml')
+        found = dict((k, v) for k, v in found.items() if not v[1])
+        jobs.append(('scaling_' + str(args.scaling), scaling_config(args.scaling, found), found))
+
+    found = {}
+    obs = {}
+    for _, settings, f in jobs:
+        found.update(f)
+        for o, names in observations(settings).items():
+            obs.setdefault(o, set()).update(names)
+    print 'building the synthetic data...'
+    options = build_tree(os.path.join(root, 'tree'), found, args, obs)
+
+    record = {'date': datetime.datetime.now().isoformat(),
+              'host': platform.node(),
+              'python': platform.python_version(),
+              'label': args.label,
+              'grid': args.grid,
+              'years': args.years,
+              'models': args.models,
+              'jobs': args.jobs,
+              'configs': {},
+              }
+    for name, settings, _ in jobs:
+        print 'running ' + name + '...'
+        # a new process for each run so that no state is shared between runs
+        pool = multiprocessing.Pool(1)
+        try:
+            config, result = pool.apply(run_config, ((name, settings, options,
+                                                      os.path.join(root, name), args.jobs),))
+        finally:
+            pool.close()
+            pool.join()
+        record['configs'][config] = result
+        print '    ' + str(round(result['wall'], 1)) + ' s, ' + str(result['plot_files']) + ' plot files'
+    if not args.keep:
+        shutil.rmtree(root, ignore_errors=True)
+    return record
+
+
+def parser():
+    description = 'Times complete runs of validate on synthetic data'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-c', '--configs', nargs='*', default=CONFIGS,
+                        help="configurations in validate/configure or files to run")
+    parser.add_argument('-g', '--grid', default='72x36',
+                        help="grid of the synthetic data as NLONxNLAT")
+    parser.add_argument('-y', '--years', type=int, default=40,
+                        help="years of monthly data")
+    parser.add_argument('--start-year', type=int, default=1970)
+    parser.add_argument('--slices', type=int, default=2,
+                        help="number of files each variable of the run is split into")
+    parser.add_argument('-m', '--models', nargs='*', default=['CanESM2', 'CanAM4'],
+                        help="cmip5 models to make files for")
+    parser.add_argument('-s', '--scaling', type=int, default=0,
+                        help="number of plots of the scaling test, 0 to skip it")
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('-w', '--work', default='benchmark_work',
+                        help="directory to build the data and run in")
+    parser.add_argument('-k', '--keep', action='store_true',
+                        help="keep the work directory")
+    parser.add_argument('-l', '--label', default='',
+                        help="label stored with the record, such as a commit")
+    parser.add_argument('--history', default='benchmark_history.json',
+                        help="file the record of every benchmark run is appended to")
+    parser.add_argument('-b', '--baseline',
+                        help="file with the record to compare to")
+    parser.add_argument('--save-baseline',
+                        help="file to store this record in as a baseline")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+                        help="fraction a stage can slow down by before it is flagged")
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    record = run(args)
+    history = read_history(args.history)
+    history.append(record)
+    with open(args.history, 'w') as outfile:
+        json.dump(history, outfile, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as outfile:
+            json.dump(record, outfile, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            messages = regressions(record, json.load(f), args.tolerance)
+        for message in messages:
+            print 'REGRESSION: ' + message
+        if messages:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,277 @@
+"""
+kernels
+===============
+
+This module times the numerical kernels of validate on synthetic data
+over a range of grid sizes, so that changes to them can be compared.
+Each benchmark is run in its own process, which reports the time of
+every repeat and the peak memory used while it ran. The results are
+written as JSON together with a scaling exponent for each benchmark,
+the slope of log(time) against log(number of grid points).
+
+Usage:
+    python -m benchmarks.kernels --sizes 90x45 180x90 360x180 -o kernels.json
+
+.. moduleauthor:: David Fallis
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import platform
+import argparse
+import datetime
+import resource
+import multiprocessing
+import numpy as np
+import matplotlib as mpl
+mpl.use('AGG')
+import matplotlib.pyplot as plt
+from benchmarks import synthetic
+
+SIZES = ['90x45', '180x90', '360x180']
+
+
+def _size(text):
+    nlon, nlat = text.split('x')
+    return int(nlon), int(nlat)
+
+
+def _field(nlon, nlat, ntimes=None, seed=0):
+    rng = np.random.RandomState(seed)
+    shape = (nlat, nlon) if ntimes is None else (ntimes, nlat, nlon)
+    data = np.ma.masked_array(rng.standard_normal(shape))
+    # mask a block of points like a continent
+    data[..., :nlat // 4, :nlon // 4] = np.ma.masked
+    return data
+
+
+def _weights(nlon, nlat):
+    _, lat = synthetic.grid(nlon, nlat)
+    weights = np.cos(np.radians(lat))[:, None] * np.ones((1, nlon))
+    return weights / weights.sum()
+
+
+def _dataload(options):
+    """ Returns a function which loads a synthetic file with dataload """
+    def setup(nlon, nlat, args):
+        import validate.data_loader as pl
+        import validate.field_cache as fc
+        import validate.product_cache as pc
+        import validate.constants as constants
+        constants.engine = args.engine
+        for name in ['netcdf', 'mask', 'logs']:
+            os.makedirs(name)
+        levels = range(0, 50 * args.levels, 50) if args.levels else None
+        ifile = synthetic.make_file('.', var='thetao' if levels else 'tas', nlon=nlon, nlat=nlat,
+                                    levels=levels, years=args.years)
+        dates = {'start_date': '1980-01-01', 'end_date': str(1979 + args.years) + '-12-31'}
+
+        # the data is not remapped unless another grid is given
+        kwargs = dict({'remapgrid': 'r' + str(nlon) + 'x' + str(nlat)}, **options)
+
+        def run():
+            # start from nothing so that every repeat runs the stages
+            fc.clear()
+            pc.set_root(tempfile.mkdtemp(dir='netcdf'))
+            pl.dataload(ifile, 'thetao' if levels else 'tas', dates, **kwargs)
+        return run
+    return setup
+
+
+def _trend_significance(nlon, nlat, args):
+    import validate.plot_cases as pc
+    residuals = _field(nlon, nlat, 12 * args.years)
+    return lambda: pc.trend_significance(residuals, 0.05)
+
+
+def _weighted_correlation(nlon, nlat, args):
+    import validate.plot_cases as pc
+    obs = _field(nlon, nlat)
+    data = _field(nlon, nlat, seed=1)
+    weights = _weights(nlon, nlat)
+    return lambda: pc.weighted_correlation(obs, data, weights)
+
+
+def _stats(nlon, nlat, args):
+    import validate.plot_cases as pc
+    data = _field(nlon, nlat)
+    weights = _weights(nlon, nlat)
+    return lambda: pc.stats({}, data, weights)
+
+
+def _default_pcolor_args(nlon, nlat, args):
+    import validate.projections as pr
+    data = _field(nlon, nlat)
+    return lambda: pr.default_pcolor_args(data, anom=True)
+
+
+def _draw_stipple(nlon, nlat, args):
+    import validate.projections as pr
+    from mpl_toolkits.basemap import Basemap
+    lon, lat = synthetic.grid(nlon, nlat)
+    pvalues = np.abs(_field(nlon, nlat)) / 4
+    fig, ax = plt.subplots(1, 1)
+    m = Basemap(projection='kav7', lon_0=-180, resolution='c', ax=ax)
+    return lambda: pr.draw_stipple(pvalues, lon, lat, m, 0.05)
+
+
+def _worldmap(nlon, nlat, args):
+    import validate.projections as pr
+    lon, lat = synthetic.grid(nlon, nlat)
+    data = _field(nlon, nlat)
+
+    def run():
+        pr.worldmap('global_map', lon, lat, data)
+        plt.gcf().canvas.draw()
+        plt.close('all')
+    return run
+
+
+BENCHMARKS = {'dataload_climatology': _dataload({'datatype': 'climatology'}),
+              'dataload_trends': _dataload({'datatype': 'trends'}),
+              'dataload_remap': _dataload({'datatype': 'climatology', 'remapgrid': 'r72x36'}),
+              'dataload_section': _dataload({'datatype': 'climatology', 'section': True}),
+              'dataload_timeseries': _dataload({'fieldmean': True, 'yearmean': True}),
+              'trend_significance': _trend_significance,
+              'weighted_correlation': _weighted_correlation,
+              'stats': _stats,
+              'default_pcolor_args': _default_pcolor_args,
+              'draw_stipple': _draw_stipple,
+              'worldmap': _worldmap,
+              }
+
+
+def _rss():
+    """ Returns the resident memory of this process in bytes """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def _reset_peak():
+    """ Starts the peak memory of this process again from the current use,
+        where the system allows it
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+
+
+def measure(job):
+    """ Runs one benchmark for one grid size and returns its result.
+        This is run in a new process.
+    """
+    name, size, args = job
+    nlon, nlat = _size(size)
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    try:
+        run = BENCHMARKS[name](nlon, nlat, args)
+        # the first call loads modules and fills caches
+        run()
+        base = _rss()
+        _reset_peak()
+        times = []
+        for _ in xrange(args.repeat):
+            start = time.time()
+            run()
+            times.append(time.time() - start)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {'benchmark': name,
+            'size': size,
+            'points': nlon * nlat,
+            'times': times,
+            'best': min(times),
+            'mean': sum(times) / len(times),
+            'peak_memory': max(peak - base, 0),
+            }
+
+
+def scaling(results):
+    """ Returns the slope of log(best time) against log(points) of each
+        benchmark run with more than one size
+    """
+    exponents = {}
+    for name in set(r['benchmark'] for r in results):
+        found = [r for r in results if r['benchmark'] == name and r['best'] > 0]
+        if len(set(r['points'] for r in found)) < 2:
+            continue
+        x = np.log([r['points'] for r in found])
+        y = np.log([r['best'] for r in found])
+        exponents[name] = float(np.polyfit(x, y, 1)[0])
+    return exponents
+
+
+def metadata(args):
+    return {'date': datetime.datetime.now().isoformat(),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'engine': args.engine,
+            'years': args.years,
+            'levels': args.levels,
+            'repeat': args.repeat,
+            }
+
+
+def run(args):
+    names = args.only or sorted(BENCHMARKS)
+    jobs = [(name, size, args) for name in names for size in args.sizes]
+    results = []
+    for job in jobs:
+        # a new process for each job so that the memory used is its own
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply(measure, (job,))
+        except Exception as e:
+            print 'failed: ' + job[0] + ' ' + job[1] + ': ' + str(e)
+            continue
+        finally:
+            pool.close()
+            pool.join()
+        print (result['benchmark'].ljust(24) + result['size'].rjust(10) +
+               str(round(result['best'], 4)).rjust(10) + ' s' +
+               str(result['peak_memory'] // (1024 * 1024)).rjust(8) + ' MB')
+        results.append(result)
+    return {'suite': 'kernels',
+            'meta': metadata(args),
+            'results': results,
+            'scaling': scaling(results),
+            }
+
+
+def parser():
+    description = 'Times the numerical kernels of validate on synthetic data'
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-s', '--sizes', nargs='+', default=SIZES,
+                        help="grid sizes as NLONxNLAT")
+    parser.add_argument('-y', '--years', type=int, default=10,
+                        help="years of monthly data")
+    parser.add_argument('-l', '--levels', type=int, default=0,
+                        help="number of levels of the dataload files, 0 for 2D data")
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help="number of times to run each benchmark")
+    parser.add_argument('-e', '--engine', default='cdo',
+                        help="data_loader engine, 'cdo' or 'numpy'")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS),
+                        help="benchmarks to run")
+    parser.add_argument('-o', '--output', default='kernels.json',
+                        help="JSON file to write the results to")
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    results = run(args)
+    with open(args.output, 'w') as outfile:
+        json.dump(results, outfile, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
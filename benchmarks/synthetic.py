@@ -0,0 +1,200 @@
+"""
+synthetic
+===============
+
+This module writes synthetic netCDF files which follow the CMIP
+conventions used by validate, so that the package can be benchmarked
+without real model output. The files carry the 'frequency',
+'realization', 'modeling_realm' and 'experiment' attributes read by
+directory_tools and are named in the CMIP style
+<variable>_<table>_<model>_<experiment>_r<n>i1p1_<start>-<end>.nc
+
+The data is a smooth field with a trend, a seasonal cycle and noise
+drawn from a seeded generator, so that the same arguments always
+give the same file.
+
+.. moduleauthor:: David Fallis
+"""
+import os
+import numpy as np
+from netCDF4 import Dataset, date2num
+import datetime
+
+# CMIP table of each realm for monthly data
+TABLES = {'atmos': 'Amon',
+          'ocean': 'Omon',
+          'land': 'Lmon',
+          'landIce': 'LImon',
+          'seaIce': 'OImon',
+          'ocnBgchem': 'Omon',
+          }
+
+UNITS = 'days since 1850-01-01 00:00:00'
+
+
+def grid(nlon, nlat):
+    """ Returns the longitudes and latitudes of the centres of a
+        regular grid, which match the cdo grid rNLONxNLAT
+    """
+    lon = np.arange(nlon) * 360. / nlon
+    lat = -90 + (np.arange(nlat) + 0.5) * 180. / nlat
+    return lon, lat
+
+
+def _times(years, start_year, frequency, calendar):
+    """ Returns the start and end of each timestep as datetimes
+    """
+    bounds = []
+    for year in xrange(start_year, start_year + years):
+        if frequency == 'yr':
+            bounds.append((datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)))
+        elif frequency == 'day':
+            # every calendar has at least 28 days in a month
+            for month in xrange(1, 13):
+                for day in xrange(1, 29):
+                    start = datetime.datetime(year, month, day)
+                    bounds.append((start, start + datetime.timedelta(days=1)))
+        else:
+            for month in xrange(1, 13):
+                end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+                bounds.append((datetime.datetime(year, month, 1), end))
+    return bounds
+
+
+def filename(var, frequency='mon', realm='atmos', model='SYN', experiment='historical',
+             realization=1, start_year=1980, years=10):
+    """ Returns the CMIP style name of a synthetic file
+    """
+    table = TABLES.get(realm, 'Amon') if frequency == 'mon' else frequency
+    if frequency == 'yr':
+        dates = str(start_year) + '-' + str(start_year + years - 1)
+    else:
+        dates = str(start_year) + '01-' + str(start_year + years - 1) + '12'
+    return '_'.join([var, table, model, experiment, 'r' + str(realization) + 'i1p1', dates]) + '.nc'
+
+
+def make_file(name, var='tas', nlon=360, nlat=180, levels=None, years=10, start_year=1980,
+              calendar='standard', frequency='mon', realization=1, realm='atmos',
+              experiment='historical', model='SYN', units='K', seed=0,
+              format='NETCDF4_CLASSIC'):
+    """ Writes a synthetic netCDF file
+
+    Parameters
+    ----------
+    name : string
+           name of the file, or of the directory to write it to with
+           the name given by filename()
+    var : string
+          name of the variable
+    nlon, nlat : ints
+                 size of the regular grid
+    levels : list of floats
+             depths of the levels in metres, None for a 2D variable
+    years : int
+            number of years of data
+    start_year : int
+    calendar : string
+               calendar of the time axis, for example 'standard',
+               'noleap' or '360_day'
+    frequency : string
+                'mon', 'day' or 'yr'
+    realization : int
+    realm : string
+            modeling realm, for example 'atmos' or 'ocean'
+    format : string
+             netCDF format of the file. MFDataset can not read 'NETCDF4'.
+
+    Returns
+    -------
+    string of the name of the file written
+    """
+    if os.path.isdir(name):
+        name = os.path.join(name, filename(var, frequency, realm, model, experiment,
+                                           realization, start_year, years))
+    lon, lat = grid(nlon, nlat)
+    bounds = _times(years, start_year, frequency, calendar)
+    starts = date2num([b[0] for b in bounds], UNITS, calendar)
+    ends = date2num([b[1] for b in bounds], UNITS, calendar)
+
+    nc = Dataset(name, 'w', format=format)
+    nc.Conventions = 'CF-1.4'
+    nc.frequency = frequency
+    nc.realization = realization
+    nc.modeling_realm = realm
+    nc.experiment = experiment
+    nc.experiment_id = experiment
+    nc.model_id = model
+    nc.createDimension('time', None)
+    nc.createDimension('bnds', 2)
+    nc.createDimension('lat', nlat)
+    nc.createDimension('lon', nlon)
+    time = nc.createVariable('time', 'f8', ('time',))
+    time.units = UNITS
+    time.calendar = calendar
+    time.axis = 'T'
+    time.bounds = 'time_bnds'
+    time.standard_name = 'time'
+    time[:] = (starts + ends) / 2.
+    time_bnds = nc.createVariable('time_bnds', 'f8', ('time', 'bnds'))
+    time_bnds[:] = np.column_stack([starts, ends])
+    latitude = nc.createVariable('lat', 'f8', ('lat',))
+    latitude.units = 'degrees_north'
+    latitude.axis = 'Y'
+    latitude.standard_name = 'latitude'
+    latitude[:] = lat
+    longitude = nc.createVariable('lon', 'f8', ('lon',))
+    longitude.units = 'degrees_east'
+    longitude.axis = 'X'
+    longitude.standard_name = 'longitude'
+    longitude[:] = lon
+    dimensions = ('time', 'lat', 'lon')
+    if levels is not None:
+        nc.createDimension('lev', len(levels))
+        lev = nc.createVariable('lev', 'f8', ('lev',))
+        lev.units = 'm'
+        lev.axis = 'Z'
+        lev.positive = 'down'
+        lev.standard_name = 'depth'
+        lev[:] = levels
+        dimensions = ('time', 'lev', 'lat', 'lon')
+    ncvar = nc.createVariable(var, 'f4', dimensions, fill_value=1e20)
+    ncvar.units = units
+    ncvar.long_name = 'synthetic ' + var
+
+    # one timestep at a time to keep the memory used small
+    rng = np.random.RandomState(seed)
+    field = 280 + 30 * np.cos(np.radians(lat))[:, None] * np.ones((1, nlon))
+    nz = 1 if levels is None else len(levels)
+    profile = np.exp(-np.arange(nz) / 10.)[:, None, None]
+    for i, b in enumerate(bounds):
+        t = i / float(len(bounds))
+        season = 5 * np.sin(2 * np.pi * (b[0].month - 1) / 12.) * np.sign(lat)[:, None]
+        value = (field + season + t) * profile + rng.standard_normal((nz, nlat, nlon))
+        ncvar[i] = value[0].astype('f4') if levels is None else value.astype('f4')
+    nc.close()
+    return name
+
+
+def make_mask(name, var='sftof', nlon=360, nlat=180, realm='ocean'):
+    """ Writes a land or ocean fraction file with the ocean south of
+        the equator and the land to the north
+    """
+    lon, lat = grid(nlon, nlat)
+    nc = Dataset(name, 'w', format=format)
+    nc.frequency = 'fx'
+    nc.realization = 0
+    nc.modeling_realm = realm
+    nc.createDimension('lat', nlat)
+    nc.createDimension('lon', nlon)
+    nc.createVariable('lat', 'f8', ('lat',))[:] = lat
+    nc.createVariable('lon', 'f8', ('lon',))[:] = lon
+    ncvar = nc.createVariable(var, 'f4', ('lat', 'lon'))
+    ncvar.units = '%'
+    ocean = (lat < 0)[:, None] * np.ones((1, nlon))
+    ncvar[:] = 100 * (ocean if var == 'sftof' else 1 - ocean)
+    nc.close()
+    return name
+
+
+if __name__ == "__main__":
+    pass
@@ -135,6 +135,17 @@ class Test_check_plot_args:
         assert ch.check_plot_args({'fill_continents': True}) == None       
         assert ch.check_plot_args({'draw_parallels': True}) == None
         assert ch.check_plot_args({'draw_meridians': True}) == None
+        assert ch.check_plot_args({'stipple_density': [1, 4]}) == None
+    def test_stipple_density_is_wrong_type(self):
+        with pytest.raises(TypeError):
+            ch.check_plot_args({'stipple_density': 'string'})
+        with pytest.raises(TypeError):
+            ch.check_plot_args({'stipple_density': [1.5, 4]})
+        with pytest.raises(TypeError):
+            ch.check_plot_args({'stipple_density': [1, 4, 2]})
+    def test_stipple_density_is_wrong_value(self):
+        with pytest.raises(ValueError):
+            ch.check_plot_args({'stipple_density': [0, 4]})
 
 class Test_check_dict:
     def test_dargs_is_wrong_type(self):
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+import validate.data_loader as pl
+import validate.product_cache as pc
+from benchmarks import synthetic
+
+
+def netcdf4_slices(directory):
+    # MFDataset can not aggregate files in the NETCDF4 format
+    return [synthetic.make_file(directory, nlon=4, nlat=2, years=1, start_year=year,
+                                format='NETCDF4') for year in [1980, 1981]]
+
+
+class Test_legacy_names:
+    def test_names_of_a_chain(self):
+        stages = [('sel', ('tas',)),
+                  ('remap', ('remapdis', 'r360x180', 'tas')),
+                  ('seldate', ('1980-01', '2005-01')),
+                  ('climate', ())]
+        names = pl._legacy_names('data/tas_Amon_CanESM2.nc', stages)
+        assert names == ['sel_tas_Amon_CanESM2.nc',
+                         'remapdis-r360x180_sel_tas_Amon_CanESM2.nc',
+                         'seldate_1980-01_2005-01_remapdis-r360x180_sel_tas_Amon_CanESM2.nc',
+                         'climate_seldate_1980-01_2005-01_remapdis-r360x180_sel_tas_Amon_CanESM2.nc']
+
+    def test_names_follow_the_requested_order(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.mkdir('logs')
+        name = synthetic.make_file(str(tmpdir), var='tas', nlon=8, nlat=4, years=2,
+                                   start_year=1980)
+        dates = {'start_date': '1980-01', 'end_date': '1981-01'}
+        requested = pl._stages('tas', dates, 'atmos', 'remapdis', 'r360x180', None,
+                               'climatology', None, False, False, None, False, None, {}, False)
+        planned = pl._plan(name, 'tas', requested)
+        # the dates are selected before remapping
+        assert [stage[0] for stage in planned] == ['sel', 'seldate', 'remap', 'climate']
+        names = pl._legacy_names(name, planned, requested)
+        base = os.path.basename(name)
+        assert names == ['sel_' + base,
+                         None,
+                         'seldate_1980-01_1981-01_remapdis-r360x180_sel_' + base,
+                         'climate_seldate_1980-01_1981-01_remapdis-r360x180_sel_' + base]
+
+    def test_found_in_processed_root(self, tmpdir, monkeypatch):
+        tmpdir.join('sel_tas_Amon_CanESM2.nc').write('')
+        monkeypatch.setattr(pl.constants, 'processed_cmip5_root', str(tmpdir), raising=False)
+        found = pl._precalculated(pl._legacy_names('data/tas_Amon_CanESM2.nc',
+                                                   [('sel', ('tas',))])[0])
+        assert found == str(tmpdir.join('sel_tas_Amon_CanESM2.nc'))
+
+
+class Test_segments:
+    stages = [('sel', ('tas',)),
+              ('remap', ('remapdis', 'r360x180', 'tas')),
+              ('seldate', ('1980-01', '2005-01')),
+              ('climate', ())]
+    keys = ['sel', 'remap', 'seldate', 'climate']
+
+    def test_unshared_climatology_is_one_command(self):
+        assert pl._segments(self.stages, self.keys) == [[0, 1, 2, 3]]
+
+    def test_shared_time_series_is_written(self, monkeypatch):
+        monkeypatch.setattr(pl, 'SHARED', set(['seldate']))
+        assert pl._segments(self.stages, self.keys) == [[0, 1, 2], [3]]
+
+
+class Test_open:
+    def test_netcdf4_slices_are_merged(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(pc, 'ROOT', str(tmpdir))
+        slices = netcdf4_slices(str(tmpdir))
+        nc = pl._open(slices)
+        try:
+            assert len(nc.variables['time']) == 24
+        finally:
+            nc.close()
+
+    def test_time_axis_is_read_without_merging(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(pc, 'ROOT', str(tmpdir))
+        merged = []
+        monkeypatch.setattr(pl, 'merge_time', merged.append)
+        time, units, calendar = pl._time_axis(netcdf4_slices(str(tmpdir)))
+        assert len(time) == 24 and (np.diff(time) > 0).all()
+        assert not pl._check_averaged(netcdf4_slices(str(tmpdir)))
+        assert merged == []
@@ -0,0 +1,54 @@
+import os
+import validate.dry_run as dr
+import validate.data_loader as pl
+import validate.product_cache as pc
+import validate.scheduler as scheduler
+from benchmarks import synthetic
+
+times = [(y, m, 16, 0, 0, 0) for y in range(1990, 2000) for m in range(1, 13)]
+shape = {'times': times, 'nz': 40, 'ny': 300, 'nx': 360, 'itemsize': 4, 'files': 1}
+
+
+class Test_apply:
+    def test_remap_sets_grid(self):
+        out = dr.apply(shape, ('remap', ('remapdis', 'r180x90')))
+        assert (out['ny'], out['nx']) == (90, 180)
+
+    def test_seldate_and_yearmean(self):
+        out = dr.apply(shape, ('seldate', ('1991-01-01', '1995-12-31')))
+        assert len(out['times']) == 60
+        assert len(dr.apply(out, ('yearmean', ()))['times']) == 5
+
+    def test_trend_writes_two_files(self):
+        out = dr.apply(shape, ('slope', ()))
+        assert dr.nbytes(out) == 2 * 40 * 300 * 360 * 4
+
+
+class Calls(object):
+    """ Stands in for cdo and records every operator used """
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __getattr__(self, name):
+        self.calls.append(name)
+        return lambda *args, **kwargs: self.calls.append(name)
+
+
+class Test_plan:
+    def test_netcdf4_slices_run_no_cdo(self, tmpdir, monkeypatch):
+        monkeypatch.chdir(tmpdir)
+        tmpdir.mkdir('logs')
+        monkeypatch.setattr(pc, 'ROOT', str(tmpdir.join('netcdf')))
+        calls = []
+        monkeypatch.setattr(pl, 'cdo', Calls(calls))
+        monkeypatch.setattr(os, 'system', lambda command: calls.append(command) or 1)
+        # MFDataset can not read NETCDF4 slices
+        slices = [synthetic.make_file(str(tmpdir), nlon=8, nlat=4, years=1, start_year=year,
+                                      format='NETCDF4') for year in [1980, 1981]]
+        request = {'ifile': slices, 'var': 'tas', 'realm': 'atmos',
+                   'dates': {'start_date': '1980-01', 'end_date': '1981-12'},
+                   'remapf': 'remapdis', 'remapgrid': 'r4x2', 'datatype': 'climatology'}
+        nodes = scheduler.graph([request])
+        assert [n['stages'][-1][0] for n in nodes.values() if n['final']] == ['climate']
+        assert len(dr._shape(slices, 'tas')['times']) == 24
+        assert calls == []
@@ -0,0 +1,58 @@
+import os
+from benchmarks import end_to_end
+
+
+def record(stages):
+    return {'configs': {'conf_atmos.yaml': {'stages': stages, 'wall': sum(stages.values())}}}
+
+
+class Test_regressions:
+    def test_slower_stage_is_flagged(self):
+        baseline = record({'creating plots': 10., 'merging plots': 2.})
+        current = record({'creating plots': 13., 'merging plots': 2.})
+        messages = end_to_end.regressions(current, baseline, tolerance=0.2)
+        assert len(messages) == 2
+        assert messages[0].startswith('conf_atmos.yaml: creating plots')
+
+    def test_short_stages_are_not_compared(self):
+        baseline = record({'cleaning up': 0.1, 'creating plots': 10.})
+        current = record({'cleaning up': 0.5, 'creating plots': 10.})
+        assert end_to_end.regressions(current, baseline) == []
+
+class Test_variables:
+    def test_sections_need_levels(self):
+        settings = {'plots': [{'variable': 'thetao', 'plot_projection': 'section'},
+                              {'variable': 'tos', 'plot_projection': 'global_map'},
+                              {'variable': 'pr', 'plot_projection': 'global_map'}]}
+        found = end_to_end.variables(settings, 'conf_ocean.yaml')
+        assert found == {'thetao': ('ocean', True), 'tos': ('ocean', False), 'pr': ('atmos', False)}
+
+
+class Test_observations:
+    def test_every_dataset_is_found(self):
+        settings = {'plots': [{'variable': 'tas', 'comp_obs': ['20CR', 'ERA']},
+                              {'variable': 'pr', 'comp_obs': ['GPCP'],
+                               'extra_variables': ['tas'], 'extra_obs': ['ERA']}]}
+        assert end_to_end.observations(settings) == {'20CR': set(['tas']),
+                                                     'ERA': set(['tas']),
+                                                     'GPCP': set(['pr'])}
+
+
+class Test_run_config:
+    def test_stock_config_runs(self, tmpdir):
+        settings = end_to_end.load_config('conf_ocean.yaml')
+        settings['plots'] = [p for p in settings['plots']
+                             if p.get('plot_projection') == 'global_map'][:2]
+        args = end_to_end.parser().parse_args(['--grid', '12x6', '--years', '26',
+                                               '--start-year', '1980', '--slices', '1'])
+        options = end_to_end.build_tree(str(tmpdir.join('tree')),
+                                        end_to_end.variables(settings, 'conf_ocean.yaml'),
+                                        args, end_to_end.observations(settings))
+        cwd = os.getcwd()
+        try:
+            name, result = end_to_end.run_config(('conf_ocean.yaml', settings, options,
+                                                  str(tmpdir.join('run')), 1))
+        finally:
+            os.chdir(cwd)
+        assert name == 'conf_ocean.yaml'
+        assert result['plot_files'] > 0
@@ -0,0 +1,43 @@
+import numpy as np
+import validate.ensemble as en
+
+
+def members():
+    rng = np.random.RandomState(0)
+    data = rng.standard_normal((5, 3, 4))
+    mask = np.zeros(data.shape, dtype=bool)
+    mask[0, 1, 2] = True
+    return np.ma.masked_array(data, mask=mask)
+
+
+class Test_add:
+    def test_statistics_match_numpy(self):
+        data = members()
+        sums = None
+        for member in data:
+            sums = en.add(sums, member)
+        found = en.statistics(sums)
+        assert np.allclose(found['mean'], data.mean(axis=0))
+        assert np.allclose(found['std'], data.std(axis=0))
+        assert np.allclose(found['min'], data.min(axis=0))
+        assert np.allclose(found['max'], data.max(axis=0))
+
+    def test_points_without_data_are_masked(self):
+        data = np.ma.masked_array(np.ones((2, 2)), mask=[[True, False], [True, True]])
+        sums = en.add(en.add(None, data[0]), data[1])
+        assert en.statistics(sums)['mean'].mask.tolist() == [True, False]
+
+class Test_merge:
+    def test_merged_parts_match_one_part(self):
+        data = members()
+        whole = None
+        for member in data:
+            whole = en.add(whole, member)
+        first = en.add(en.add(None, data[0]), data[1])
+        second = None
+        for member in data[2:]:
+            second = en.add(second, member)
+        merged = en.statistics(en.merge(first, second))
+        found = en.statistics(whole)
+        for k in ['mean', 'std', 'min', 'max']:
+            assert np.allclose(merged[k], found[k])
@@ -0,0 +1,33 @@
+import numpy as np
+import validate.field_cache as fc
+import validate.constants as constants
+import validate.yamllog as yamllog
+
+
+class Test_put:
+    def setup_method(self, method):
+        fc.clear()
+        constants.field_cache_size = 1
+
+    def test_stored_value_is_returned(self):
+        key = fc.make_key('tas', {'start_date': '1990-01'}, [10, 20])
+        fc.put(key, (np.zeros(10), None))
+        assert fc.get(fc.make_key('tas', {'start_date': '1990-01'}, [10, 20])) is not None
+
+    def test_least_recently_used_is_dropped(self):
+        fc.put('a', np.zeros(65536))
+        fc.put('b', np.zeros(65536))
+        fc.get('a')
+        fc.put('c', np.zeros(65536))
+        assert fc.get('a') is not None
+        assert fc.get('b') is None
+
+class Test_log:
+    def test_summary_is_buffered_with_the_log(self):
+        fc.clear()
+        yamllog.buffer()
+        try:
+            fc.log()
+        finally:
+            records = yamllog.unbuffer()
+        assert records == [(yamllog.LOGFILE, fc.report())]
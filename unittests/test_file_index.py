@@ -0,0 +1,67 @@
+import os
+import validate.file_index as fi
+from benchmarks import synthetic
+
+
+class Test_lookup:
+    def test_file_is_read_once(self, tmpdir):
+        name = synthetic.make_file(str(tmpdir), nlon=4, nlat=2, years=2, realm='ocean')
+        fi.set_file(str(tmpdir.join('index.json')))
+        read = fi.stats['read']
+        entry = fi.lookup(name)
+        assert fi.lookup(name) is entry
+        assert fi.stats['read'] == read + 1
+        assert entry['realm'] == 'ocean'
+        assert entry['start'] == [1980, 1, 16]
+        assert entry['end'][0] == 1981
+
+    def test_changed_file_is_read_again(self, tmpdir):
+        name = synthetic.make_file(str(tmpdir), nlon=4, nlat=2, years=1)
+        fi.set_file(None)
+        fi.lookup(name)
+        os.utime(name, (0, 0))
+        read = fi.stats['read']
+        fi.lookup(name)
+        assert fi.stats['read'] == read + 1
+
+    def test_index_is_kept_between_runs(self, tmpdir):
+        name = synthetic.make_file(str(tmpdir), nlon=4, nlat=2, years=1)
+        fi.set_file(str(tmpdir.join('index.json')))
+        fi.lookup(name)
+        fi.save()
+        fi._loaded = False
+        read = fi.stats['read']
+        assert fi.lookup(name)['frequency'] == 'mon'
+        assert fi.stats['read'] == read
+
+    def test_index_file_keeps_str(self, tmpdir):
+        name = synthetic.make_file(str(tmpdir), nlon=4, nlat=2, years=1)
+        fi.set_file(str(tmpdir.join('index.json')))
+        fi.lookup(name)
+        fi.save()
+        fi._loaded = False
+        fi.load()
+        path, entry = fi._entries.items()[0]
+        assert type(path) is str
+        assert type(entry['frequency']) is str
+        assert type(entry['grid']) is str
+
+class Test_scan:
+    def test_only_new_files_are_read(self, tmpdir):
+        names = [synthetic.make_file(str(tmpdir), nlon=4, nlat=2, years=1, realization=r)
+                 for r in [1, 2, 3]]
+        fi.set_file(str(tmpdir.join('index.json')))
+        assert fi.scan(names, jobs=2) == 3
+        assert fi.scan(names, jobs=2) == 0
+        assert [fi.lookup(n)['realization'] for n in names] == ['1', '2', '3']
+
+class Test_span:
+    def test_dates_are_taken_from_the_name(self):
+        assert fi.span('/data/tas_Amon_M_historical_r1i1p1_185001-200512.nc') == ((1850, 1, 1), (2005, 12, 31))
+        assert fi.name_dates('/data/tas_yr_M_historical_r1i1p1_1850-2005.nc') == ((1850, 1, 1), (2005, 12, 31))
+
+    def test_file_is_read_without_dates_in_the_name(self, tmpdir):
+        name = synthetic.make_file(str(tmpdir.join('tas.nc')), nlon=4, nlat=2, years=1)
+        fi.set_file(None)
+        assert fi.name_dates(name) is None
+        assert fi.span(name) == ((1980, 1, 16), (1980, 12, 16))
@@ -0,0 +1,65 @@
+import pytest
+import numpy as np
+import validate.numpy_engine as ne
+
+times = [(1990, m, 16, 0, 0, 0) for m in range(1, 13)] * 2
+
+
+class Test_season_months:
+    def test_standard_season(self):
+        assert ne.season_months('DJF') == [12, 1, 2]
+        assert ne.season_months('JJA') == [6, 7, 8]
+
+    def test_not_a_season(self):
+        with pytest.raises(ValueError):
+            ne.season_months('DFJ')
+
+class Test_season_index:
+    def test_selects_months(self):
+        index = ne.season_index(times[:12], ['MAM'])
+        assert list(np.where(index)[0]) == [2, 3, 4]
+
+class Test_date_index:
+    def test_end_date_is_inclusive(self):
+        index = ne.date_index(times[:12], (1990, 3, 1), (1990, 5, 16))
+        assert list(np.where(index)[0]) == [2, 3, 4]
+
+class Test_trend:
+    def test_slope_of_line(self):
+        data = np.arange(10, dtype=float)[:, None, None] * np.ones((10, 2, 3)) * 2 + 1
+        assert np.allclose(ne.trend(data), 2)
+
+    def test_detrend_removes_line(self):
+        data = np.arange(10, dtype=float)[:, None, None] * np.ones((10, 2, 3)) * 2 + 1
+        assert np.allclose(ne.detrend(data), 0)
+
+    def test_masked_values_are_ignored(self):
+        data = np.ma.masked_array(np.arange(10, dtype=float) * 3)
+        data[4] = np.ma.masked
+        assert np.allclose(ne.trend(data[:, None]), 3)
+
+    def test_fit_returns_residuals(self):
+        data = np.arange(10, dtype=float)[:, None] * 2 + 1 + np.array([1., -1.] * 5)[:, None]
+        slope, intercept, residuals = ne.trend_fit(data)
+        assert np.allclose(intercept + slope * np.arange(10)[:, None] + residuals, data)
+
+class Test_intlevel:
+    def test_interpolates_between_levels(self):
+        data = np.ma.array([[0., 10.], [10., 30.]])
+        out = ne.intlevel(data[None, ...], [0, 10], 1, [5])
+        assert np.allclose(out, [[[5., 20.]]])
+
+    def test_extrapolates_with_nearest_level(self):
+        data = np.ma.array([[0.], [10.]])
+        out = ne.intlevel(data[None, ...], [0, 10], 1, [20])
+        assert np.allclose(out, 10)
+
+class Test_field_mean:
+    def test_weights_sum_to_one(self):
+        weights = ne.grid_weights(np.arange(4) * 90., np.array([-45., 45.]))
+        assert np.isclose(weights.sum(), 1)
+
+    def test_constant_field(self):
+        weights = ne.grid_weights(np.arange(4) * 90., np.array([-45., 45.]))
+        data = np.ma.ones((3, 2, 4)) * 7
+        assert np.allclose(ne.field_mean(data, weights), 7)
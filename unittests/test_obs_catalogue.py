@@ -0,0 +1,43 @@
+import os
+import validate.obs_catalogue as oc
+
+
+def touch(name):
+    open(name, 'w').close()
+
+
+class Test_dataset:
+    def test_unchanged_dataset_is_not_listed_again(self, tmpdir):
+        tmpdir.mkdir('GPCP').mkdir('mon')
+        touch(str(tmpdir.join('GPCP', 'mon', 'pr_GPCP_197901-201012.nc')))
+        oc.set_file(str(tmpdir.join('catalogue.json')))
+        root = str(tmpdir.join('GPCP'))
+        assert oc.files(root, 'pr') == [root + '/mon/pr_GPCP_197901-201012.nc']
+        oc.save()
+        oc._loaded = False
+        listed = oc.stats['listed']
+        assert oc.files(root, 'pr') == [root + '/mon/pr_GPCP_197901-201012.nc']
+        assert oc.stats['listed'] == listed
+
+    def test_catalogue_file_keeps_str(self, tmpdir):
+        tmpdir.mkdir('GPCP')
+        touch(str(tmpdir.join('GPCP', 'pr_GPCP_197901-201012.nc')))
+        oc.set_file(str(tmpdir.join('catalogue.json')))
+        root = str(tmpdir.join('GPCP'))
+        oc.files(root, 'pr')
+        oc.save()
+        oc._loaded = False
+        names = oc.files(root, 'pr')
+        assert names == [root + '/pr_GPCP_197901-201012.nc']
+        assert type(names[0]) is str
+        assert all(type(name) is str for name in oc._datasets[root]['directories'])
+
+    def test_new_file_is_found(self, tmpdir):
+        tmpdir.mkdir('GPCP')
+        oc.set_file(None)
+        root = str(tmpdir.join('GPCP'))
+        assert oc.files(root, 'pr') == []
+        touch(root + '/pr_GPCP_197901-201012.nc')
+        # the directory may have the same time after a quick change
+        os.utime(root, (0, 0))
+        assert oc.files(root, 'pr') == [root + '/pr_GPCP_197901-201012.nc']
@@ -0,0 +1,46 @@
+import numpy as np
+import scipy.stats
+import validate.plot_cases as plc
+
+
+def looped_significance(residuals, sigma=0.05):
+    nt = len(residuals)
+    cs = np.empty(residuals.shape[1:])
+    for (i, j), _ in np.ndenumerate(cs):
+        r, _ = scipy.stats.pearsonr(residuals[:-1, i, j], residuals[1:, i, j])
+        r = max(r, 0)
+        neff = nt * (1 - r) / (1 + r)
+        se = np.sqrt(np.sum(residuals[:, i, j] ** 2) / (neff - 2))
+        sb = se / np.sqrt(np.sum((np.arange(nt) - np.mean(np.arange(nt))) ** 2))
+        cs[i, j] = scipy.stats.t.isf(sigma / 2.0, nt - 2) * sb
+    return cs
+
+
+class Test_trend_significance:
+    residuals = np.random.RandomState(0).randn(30, 4, 5)
+
+    def test_matches_cell_by_cell(self):
+        assert np.allclose(plc.trend_significance(self.residuals), looped_significance(self.residuals))
+
+    def test_chunks_match_whole_grid(self):
+        assert np.allclose(plc.trend_significance(self.residuals, chunk=3),
+                           plc.trend_significance(self.residuals))
+
+    def test_chunks_match_cell_by_cell(self):
+        result = plc.trend_significance(self.residuals, chunk=3)
+        assert result.shape == (4, 5)
+        assert np.allclose(result, looped_significance(self.residuals))
+
+    def test_chunks_keep_the_mask(self):
+        residuals = self.residuals.copy()
+        residuals[:, 3, 4] = np.nan
+        result = plc.trend_significance(residuals, chunk=3)
+        assert result.mask[3, 4]
+        assert not result.mask[0, 0]
+
+    def test_nan_cells_are_masked(self):
+        residuals = self.residuals.copy()
+        residuals[:, 0, 0] = np.nan
+        result = plc.trend_significance(residuals)
+        assert result.mask[0, 0]
+        assert not result.mask[1, 1]
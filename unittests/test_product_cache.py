@@ -0,0 +1,74 @@
+import os
+import pytest
+import validate.product_cache as pc
+
+
+@pytest.fixture
+def root(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    # the manifest read in an earlier test was in another directory
+    monkeypatch.setattr(pc, '_entries', {})
+    monkeypatch.setattr(pc, '_files', {})
+    monkeypatch.setattr(pc, '_offset', 0)
+    os.makedirs(pc.ROOT)
+    tmpdir.join('input.nc').write('data')
+    return tmpdir
+
+class Test_key:
+    def test_params_change_key(self, root):
+        assert pc.key('input.nc', 'seldate', '1990', '2000') != pc.key('input.nc', 'seldate', '1990', '2001')
+
+    def test_modified_input_changes_key(self, root):
+        before = pc.key('input.nc', 'sel', 'tas')
+        os.utime('input.nc', (0, 0))
+        assert pc.key('input.nc', 'sel', 'tas') != before
+
+    def test_time_slices_are_identified_by_every_slice(self, root):
+        root.join('slice.nc').write('data')
+        before = pc.key(['input.nc', 'slice.nc'], 'sel', 'tas')
+        assert before != pc.key('input.nc', 'sel', 'tas')
+        os.utime('slice.nc', (0, 0))
+        assert pc.key(['input.nc', 'slice.nc'], 'sel', 'tas') != before
+
+class Test_register:
+    def test_product_is_found_after_register(self, root):
+        key, out = pc.product('input.nc', 'sel', 'tas')
+        assert pc.lookup(key) is None
+        open(out, 'w').close()
+        pc.register(key)
+        assert pc.lookup(key) == out
+
+    def test_product_is_identified_by_its_key(self, root):
+        key, out = pc.product('input.nc', 'sel', 'tas')
+        open(out, 'w').close()
+        pc.register(key)
+        assert pc.identity(out) == key
+
+class Test_prune:
+    def test_least_recently_used_is_removed(self, root):
+        old, oldout = pc.product('input.nc', 'sel', 'tas')
+        new, newout = pc.product('input.nc', 'sel', 'pr')
+        for k, out in [(old, oldout), (new, newout)]:
+            with open(out, 'w') as f:
+                f.write('x' * 10)
+            pc.register(k)
+        os.utime(oldout, (0, 0))
+        assert pc.prune(size=15) == (1, 10)
+        assert pc.lookup(old) is None
+        assert pc.lookup(new) == newout
+
+class Test_claim:
+    def test_register_releases_the_claim(self, root):
+        key, out = pc.product('input.nc', 'sel', 'tas')
+        assert pc.claim(key)
+        assert os.path.isfile(pc._lock_name(key))
+        open(out, 'w').close()
+        pc.register(key)
+        assert not os.path.isfile(pc._lock_name(key))
+
+    def test_lock_of_stopped_process_is_taken(self, root):
+        key, out = pc.product('input.nc', 'sel', 'tas')
+        with open(pc._lock_name(key), 'w') as f:
+            f.write('999999999')
+        assert pc.claim(key)
+        pc.release(key)
@@ -0,0 +1,33 @@
+import json
+import validate.profiler as profiler
+
+
+class Test_timed:
+    def test_record_is_added(self):
+        profiler.take()
+        with profiler.timed('step', 'control', file='input.nc'):
+            sum(range(1000))
+        records = profiler.take()
+        assert len(records) == 1
+        assert records[0]['name'] == 'step'
+        assert records[0]['args'] == {'file': 'input.nc'}
+        assert records[0]['wall'] >= 0
+
+    def test_decorated_function_is_recorded(self):
+        @profiler.profile('cdo')
+        def double(name):
+            return name * 2
+        profiler.take()
+        assert double('a') == 'aa'
+        assert profiler.summary()['double']['calls'] == 1
+        profiler.take()
+
+class Test_trace:
+    def test_events_are_complete_events(self, tmpdir):
+        profiler.take()
+        with profiler.timed('step'):
+            pass
+        profiler.write(str(tmpdir.join('profile.yml')), str(tmpdir.join('profile.json')))
+        profiler.take()
+        events = json.load(tmpdir.join('profile.json').open())['traceEvents']
+        assert [e['ph'] for e in events if e['name'] == 'step'] == ['X']
@@ -0,0 +1,46 @@
+import numpy as np
+from netCDF4 import Dataset
+import validate.regrid as rg
+
+
+def weight_file(name):
+    """ Weights which average pairs of the 4 points of a 1x4 grid
+        on to a 1x2 grid
+    """
+    nc = Dataset(name, 'w')
+    nc.createDimension('src_grid_size', 4)
+    nc.createDimension('dst_grid_size', 2)
+    nc.createDimension('src_grid_rank', 2)
+    nc.createDimension('dst_grid_rank', 2)
+    nc.createDimension('num_links', 4)
+    nc.createDimension('num_wgts', 1)
+    nc.createVariable('src_grid_dims', 'i4', ('src_grid_rank',))[:] = [4, 1]
+    nc.createVariable('dst_grid_dims', 'i4', ('dst_grid_rank',))[:] = [2, 1]
+    lon = nc.createVariable('dst_grid_center_lon', 'f8', ('dst_grid_size',))
+    lon.units = 'degrees'
+    lon[:] = [90, 270]
+    lat = nc.createVariable('dst_grid_center_lat', 'f8', ('dst_grid_size',))
+    lat.units = 'degrees'
+    lat[:] = [0, 0]
+    nc.createVariable('src_address', 'i4', ('num_links',))[:] = [1, 2, 3, 4]
+    nc.createVariable('dst_address', 'i4', ('num_links',))[:] = [1, 1, 2, 2]
+    nc.createVariable('remap_matrix', 'f8', ('num_links', 'num_wgts'))[:] = [[.5]] * 4
+    nc.close()
+    return name
+
+
+class Test_apply:
+    def test_every_timestep_is_remapped(self, tmpdir):
+        weights = rg.read(weight_file(str(tmpdir.join('weights.nc'))))
+        data = np.arange(8.).reshape(2, 1, 4)
+        remapped = rg.apply(weights, data)
+        assert remapped.shape == (2, 1, 2)
+        assert np.allclose(remapped[1], [[4.5, 6.5]])
+        assert list(weights['lon']) == [90, 270]
+
+    def test_masked_points_are_left_out(self, tmpdir):
+        weights = rg.read(weight_file(str(tmpdir.join('weights.nc'))))
+        data = np.ma.masked_array([[1., 3., 5., 7.]], mask=[[True, False, True, True]])
+        remapped = rg.apply(weights, data)
+        assert remapped[0, 0] == 3.
+        assert remapped.mask[0, 1]
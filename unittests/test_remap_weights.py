@@ -0,0 +1,35 @@
+import numpy as np
+from netCDF4 import Dataset
+import validate.remap_weights as rw
+from benchmarks import synthetic
+
+
+class Test_key:
+    def test_files_on_the_same_grid_share_weights(self, tmpdir):
+        tas = synthetic.make_file(str(tmpdir), var='tas', nlon=8, nlat=4, years=1)
+        pr = synthetic.make_file(str(tmpdir), var='pr', nlon=8, nlat=4, years=2)
+        assert rw.key(tas, 'remapcon', 'r4x2') == rw.key(pr, 'remapcon', 'r4x2')
+        assert rw.key(tas, 'remapcon', 'r4x2') != rw.key(tas, 'remapbil', 'r4x2')
+
+    def test_other_grid_has_other_weights(self, tmpdir):
+        small = synthetic.make_file(str(tmpdir), var='tas', nlon=8, nlat=4, years=1)
+        large = synthetic.make_file(str(tmpdir), var='pr', nlon=16, nlat=8, years=1)
+        assert rw.key(small, 'remapcon', 'r4x2') != rw.key(large, 'remapcon', 'r4x2')
+
+    def test_variables_on_other_grids_have_other_weights(self, tmpdir):
+        name = str(tmpdir.join('two_grids.nc'))
+        nc = Dataset(name, 'w')
+        for dim, n in [('lon', 8), ('lat', 4), ('x', 6), ('y', 3)]:
+            nc.createDimension(dim, n)
+            nc.createVariable(dim, 'f8', (dim,))[:] = np.arange(n)
+        nc.variables['x'].standard_name = 'longitude'
+        nc.variables['y'].standard_name = 'latitude'
+        nc.createVariable('tas', 'f4', ('lat', 'lon'))[:] = 1
+        nc.createVariable('tos', 'f4', ('y', 'x'))[:] = 1
+        nc.close()
+        assert rw.key(name, 'remapcon', 'r4x2', 'tas') != rw.key(name, 'remapcon', 'r4x2', 'tos')
+
+class Test_generator:
+    def test_generator_of_method(self):
+        assert rw._generator('remapcon') == 'gencon'
+        assert rw._generator('remaplaf') == 'genlaf'
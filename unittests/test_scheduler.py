@@ -0,0 +1,22 @@
+import validate.scheduler as scheduler
+
+
+def node(parent, final=False):
+    return {'file': 'f.nc', 'stages': [], 'parent': parent, 'children': set(), 'final': final}
+
+
+class Test_targets:
+    nodes = {'sel': node(None),
+             'remap': node('sel'),
+             'climate': node('remap', True),
+             'slope': node('remap', True),
+             }
+    nodes['sel']['children'] = set(['remap'])
+    nodes['remap']['children'] = set(['climate', 'slope'])
+
+    def test_shared_and_final_products(self):
+        assert scheduler.targets(self.nodes) == set(['remap', 'climate', 'slope'])
+
+    def test_waves_follow_dependencies(self):
+        keys = scheduler.targets(self.nodes)
+        assert scheduler.waves(self.nodes, keys) == [['remap'], ['climate', 'slope']]
@@ -0,0 +1,22 @@
+import numpy as np
+from netCDF4 import Dataset
+from benchmarks import synthetic
+
+
+class Test_make_file:
+    def test_cmip_attributes_and_name(self, tmpdir):
+        name = synthetic.make_file(str(tmpdir), var='thetao', nlon=8, nlat=4, levels=[0, 10, 50],
+                                   years=2, realm='ocean', realization=2)
+        assert name.endswith('thetao_Omon_SYN_historical_r2i1p1_198001-198112.nc')
+        nc = Dataset(name, 'r')
+        assert nc.frequency == 'mon'
+        assert nc.modeling_realm == 'ocean'
+        assert str(nc.realization) == '2'
+        assert nc.variables['thetao'].shape == (24, 3, 4, 8)
+        assert nc.variables['lev'].axis == 'Z'
+
+    def test_calendar(self, tmpdir):
+        name = synthetic.make_file(str(tmpdir.join('tas.nc')), nlon=4, nlat=2, years=1,
+                                   calendar='360_day')
+        bounds = Dataset(name, 'r').variables['time_bnds'][:]
+        assert np.allclose(bounds[:, 1] - bounds[:, 0], 30)
@@ -17,6 +17,17 @@ from plot_iterator import loop
 from pdf_organizer import arrange
 from defaults import fill
 from syntax_check import check_inputs
+import directory_tools
+import dry_run
+import ensemble
+import field_cache
+import file_index
+import obs_catalogue
+import scheduler
+import product_cache
+import profiler
+import remap_weights
+import yamllog
 import constants
           
 def execute(options, **kwargs):
@@ -25,7 +36,7 @@ def execute(options, **kwargs):
         process the data, and output the plots and figures.
 
     """
-    def plot(run=None, experiment='historical', direct_data_root= "", data_root="", observations_root="", cmip5_root="", processed_cmip5_root="", output_root=None, cmip5_means='', ignorecheck=False, debugging=False, plots=[], defaults={}, delete={}, obs={}, **kwargs):
+    def plot(run=None, experiment='historical', direct_data_root= "", data_root="", observations_root="", cmip5_root="", processed_cmip5_root="", output_root=None, cmip5_means='', ignorecheck=False, debugging=False, engine='cdo', chain_cdo=True, field_cache_size=1024, cache_root='', cache_size=0, index_file='', catalogue_file='', scan_jobs=8, cache_weights=True, make_cmip_mean=False, jobs=1, prepare=True, plan=False, profile=True, plots=[], defaults={}, delete={}, obs={}, **kwargs):
         """Calls modules required to find the data,
            process the data, and output the plots and figures
         """
@@ -39,6 +50,24 @@ def execute(options, **kwargs):
         constants.output_root = output_root
         constants.cmip5_means = cmip5_means
         constants.debugging = debugging
+        constants.engine = engine
+        constants.chain_cdo = chain_cdo
+        constants.field_cache_size = field_cache_size
+        if cache_root:
+            product_cache.set_root(cache_root)
+        if index_file:
+            file_index.set_file(index_file)
+        elif cache_root:
+            file_index.set_file(os.path.join(cache_root, 'file_index.json'))
+        if catalogue_file:
+            obs_catalogue.set_file(catalogue_file)
+        elif cache_root:
+            obs_catalogue.set_file(os.path.join(cache_root, 'obs_catalogue.json'))
+        remap_weights.enabled = cache_weights
+        ensemble.jobs = jobs
+        directory_tools.MAKE_CMIP_MEAN = make_cmip_mean
+        directory_tools.DRY_RUN = plan
+        profiler.enabled = profile
 
 #        check_inputs() needs to be updated to match the latest changes to the configuration
 #        if not ignorecheck:
@@ -47,35 +76,69 @@ def execute(options, **kwargs):
 
         # fill options not specified using the defaults
         print 'applying default values...'
-        fill(plots, run, experiment, defaults)
+        with profiler.timed('applying default values', 'control'):
+            fill(plots, run, experiment, defaults)
+
+        # read the headers of the files in all of the directories at once
+        print 'scanning files...'
+        with profiler.timed('scanning files', 'control'):
+            directory_tools.scan(plots, direct_data_root, data_root, run, experiment,
+                                 cmip5_means, scan_jobs)
         
         # find and modify if necessary the files for the model and experiment
         print 'finding model files...'
-        getfiles(plots, direct_data_root, data_root, run, experiment)
+        with profiler.timed('finding model files', 'control'):
+            getfiles(plots, direct_data_root, data_root, run, experiment)
         
         # find the observations files
         print 'finding observed files...'
-        getobsfiles(plots, observations_root)
+        with profiler.timed('finding observed files', 'control'):
+            getobsfiles(plots, observations_root)
         
         # find the cmip5 files
         print 'finding cmip5 files...'
-        cmip(plots, cmip5_root, cmip5_means, experiment)
+        with profiler.timed('finding cmip5 files', 'control'):
+            cmip(plots, cmip5_root, cmip5_means, experiment, scan_jobs)
         
         # find the files from other runIds for comparison
         print 'finding other model files...'
-        getidfiles(plots, data_root, experiment)
+        with profiler.timed('finding other model files', 'control'):
+            getidfiles(plots, data_root, experiment)
+        file_index.save()
+        yamllog.write(file_index.report())
+        yamllog.write(obs_catalogue.report())
+
+        # list the products that would be made without making them
+        if plan:
+            print 'planning...'
+            dry_run.report(plots)
+            return
+
+        # make the processed files shared by the plots
+        if prepare:
+            print 'preparing data...'
+            with profiler.timed('preparing data', 'control'):
+                scheduler.run(plots, jobs)
         
         # THIS IS WHERE THE PLOTS ARE CREATED
         print 'creating plots...'
-        plotnames = loop(plots, debugging)
+        with profiler.timed('creating plots', 'control'):
+            plotnames = loop(plots, debugging, jobs)
+        field_cache.log()
+        product_cache.save_stats()
+        if cache_root and cache_size:
+            product_cache.prune(size=int(cache_size * 1024 ** 3))
         
         # cleanup files and directories created during processing
         print 'cleaning up...'
-        remfiles(**delete)
+        with profiler.timed('cleaning up', 'control'):
+            remfiles(**delete)
         
         # organize plots in joined.pdf file
         print 'merging plots...'
-        arrange(plotnames)
+        with profiler.timed('merging plots', 'control'):
+            arrange(plotnames)
+        profiler.write()
         
         #create tarfile and move to output
         move_tarfile(output_root)
@@ -11,16 +11,47 @@ processed before the data is extracted.
 """
 
 import os
-from netCDF4 import Dataset, num2date, date2num
+import re
+from netCDF4 import Dataset, MFDataset, num2date, date2num
 import numpy as np
 import datetime
 from .functions import external
+import numpy_engine as ne
+import product_cache as pc
+import field_cache as fc
+import file_index
+import remap_weights
+import regrid
+import yamllog
+import profiler
 import constants
 import cdo
 cdo = cdo.Cdo()
 
 preprocessed_data_root = ''
 
+# cdo operators for the remap options which are not named the same
+REMAP_OPERATORS = {'remapplaf': 'remaplaf'}
+
+# stages which reduce the time axis
+TIME_REDUCTIONS = ['yearmean', 'climate', 'slope', 'detrend']
+
+# stages which only select timesteps
+TIME_SELECTIONS = ['selseason', 'seldate']
+
+# stages which work on each timestep and level separately
+SPATIAL = ['masked', 'setc', 'remap']
+
+# keys of products which are known to be needed by more than one request
+SHARED = set()
+
+# plans which have already been written to the log
+_logged_plans = set()
+
+# products mapped to the name they would have had before products were
+# named by their key, used to find them in processed_cmip5_root
+_legacy = {}
+
 def silent_remove(name):
     """ Removes a file if it exists and does nothing if it doesn't exist    
     """    
@@ -29,15 +60,115 @@ def silent_remove(name):
     except OSError:
         pass
 
+
+def _open(ifile):
+    """ Opens a file, or the time slices in a list of files as a single
+        read only dataset aggregated along the time axis, so that the
+        slices never have to be merged into a new file. MFDataset can
+        not read NETCDF4 files, so their slices are merged by cdo. This is
+        only used to read the data, _time_axis() reads the time axis alone
+        without merging the slices.
+    """
+    if isinstance(ifile, (list, tuple)):
+        try:
+            return MFDataset(ifile, aggdim='time')
+        except Exception:
+            return Dataset(merge_time(ifile), 'r')
+    return Dataset(ifile, 'r')
+
+
+def _first(ifile):
+    """ Returns the file, or the first of a list of time slices, which
+        holds the same grid and levels as the others
+    """
+    if isinstance(ifile, (list, tuple)):
+        return ifile[0]
+    return ifile
+
+
+def file_name(ifile):
+    """ Returns the name of a file, or the names of a list of time slices,
+        to be written in logs
+    """
+    if isinstance(ifile, (list, tuple)):
+        return ','.join(ifile)
+    return ifile
+
+
+def _cdo_input(name):
+    """ Returns the input of a cdo command reading the file. The time
+        slices in a list of files are merged by cdo as they are read.
+    """
+    if isinstance(name, (list, tuple)):
+        return '-mergetime ' + ' '.join(name)
+    return name
+
+
+def time_slices(ifile, dates):
+    """ Returns the time slices of a list of files which overlap the dates,
+        using the date ranges in their names or kept in the file index. A single
+        slice is returned as its name. All of the slices are kept if none
+        of them overlap, so that the warnings about the dates are the same.
+    """
+    if not isinstance(ifile, (list, tuple)):
+        return ifile
+    try:
+        start = year_mon_day(dates['start_date'])
+        end = year_mon_day(dates['end_date'])
+    except (KeyError, TypeError, ValueError):
+        return list(ifile)
+    files = []
+    for f in ifile:
+        first, last = file_index.span(f)
+        if first is None or (first <= end and last >= start):
+            files.append(f)
+    files = files or list(ifile)
+    if len(files) == 1:
+        return files[0]
+    return files
+
+
+def _time_axis(ifile):
+    """ Returns the values, units and calendar of the time axis of a file.
+        The time slices in a list of files are read one at a time and
+        their values are given in the units of the first slice.
+        The values are None if there is no time axis.
+    """
+    values = []
+    units = None
+    calendar = 'standard'
+    for name in _slices(ifile):
+        nc = Dataset(name, 'r')
+        try:
+            if 'time' not in nc.variables:
+                return None, None, calendar
+            nc_time = nc.variables['time']
+            times = np.atleast_1d(nc_time[:])
+            if not values:
+                units = getattr(nc_time, 'units', None)
+                calendar = getattr(nc_time, 'calendar', 'standard')
+            elif nc_time.units != units:
+                times = date2num(num2date(times, nc_time.units, calendar=calendar),
+                                 units, calendar=calendar)
+            values.extend(times)
+        finally:
+            nc.close()
+    return np.array(values), units, calendar
+
+
+def _slices(ifile):
+    """ Returns the time slices of a file, or a list of the file itself
+    """
+    if isinstance(ifile, (list, tuple)):
+        return list(ifile)
+    return [ifile]
+
+
 def _check_averaged(ifile):
     """ Returns True if there is only one timestep in the netcdf file
     """
-    nc = Dataset(ifile, 'r')
-    try:
-        time = nc.variables['time'][:].squeeze()
-    except:
-        return True
-    return time.size == 1
+    time, _, _ = _time_axis(ifile)
+    return time is None or time.size == 1
 
 
 def year_mon_day(datestring):
@@ -63,32 +194,25 @@ def _check_dates_outside(ifile, start_date, end_date):
         Returns False if the dates overlap at all, but prints a warning if 
         it is only a subset.
     """
-    # Load data from file into Dataset object
-    nc = Dataset(ifile, 'r')
-    
-    nc_time = nc.variables['time']
-    try:
-        cal = nc_time.calendar
-    except:
-        cal = 'standard'
+    # read the time axis of every slice without merging them
+    time, units, cal = _time_axis(ifile)
     
     # convert dates to datetime object
     start = datetime.datetime(*year_mon_day(start_date))
     end = datetime.datetime(*year_mon_day(end_date))
     # convert datetime objects to integers
-    start = date2num(start, nc_time.units, calendar=cal)
-    end = date2num(end, nc_time.units, calendar=cal)
+    start = date2num(start, units, calendar=cal)
+    end = date2num(end, units, calendar=cal)
     
     # get start and end dates of file
-    compstart = nc_time[:][0]
-    compend = nc_time[:][-1]
+    compstart = time[0]
+    compend = time[-1]
     
     # make comparison
     if compstart > end or compend < start:
         return True
     elif compstart > start or compend < end:
-        with open('logs/log.txt', 'a') as outfile:
-            outfile.write('WARNING: Comparison data does not cover entire time period... Used subset\n')
+        yamllog.write('WARNING: Comparison data does not cover entire time period... Used subset\n')
     return False
 
 
@@ -98,17 +222,14 @@ def _check_dates(ifile, dates):
     """
     try:
         if _check_averaged(ifile):
-            with open('logs/log.txt', 'a') as outfile:
-                outfile.write('WARNING: Comparison data is time averaged\n')
+            yamllog.write('WARNING: Comparison data is time averaged\n')
             return True
         elif _check_dates_outside(ifile, **dates):
-            with open('logs/log.txt', 'a') as outfile:
-                outfile.write('WARNING: Comparison data is not from time period\n')
+            yamllog.write('WARNING: Comparison data is not from time period\n')
             raise Exception
         return False
     except:
-        with open('logs/log.txt', 'a') as outfile:
-            outfile.write('WARNING: Comparison data time period could not be checked\n') 
+        yamllog.write('WARNING: Comparison data time period could not be checked\n')
         return False       
 
 
@@ -182,6 +303,70 @@ def _time(ds, time_averaged):
     x = np.array(x)
     return x
 
+def _timetuples(ds):
+    """ Returns a list of (year, month, day, hour, minute, second) tuples
+        for each timestep, or None if there is no time axis
+    """
+    try:
+        nc_time = ds.variables['time']
+    except:
+        return None
+    try:
+        cal = nc_time.calendar
+    except:
+        cal = 'standard'
+    x = num2date(np.atleast_1d(nc_time[:]), nc_time.units, cal)
+    return [tuple(item.timetuple()[:6]) for item in x]
+
+def _axes(ds, ncvar):
+    """ Returns the index of the time axis and the z axis of a
+        netCDF variable. None is returned for an axis that does not exist.
+    """
+    taxis = None
+    zaxis = None
+    for i, dimension in enumerate(ncvar.dimensions):
+        try:
+            axis = ds.variables[dimension].axis
+        except:
+            axis = None
+        if dimension == 'time' or axis == 'T':
+            taxis = i
+        elif axis == 'Z':
+            zaxis = i
+    return taxis, zaxis
+
+def _same_grid(ifile, remapgrid):
+    """ Returns True if the horizontal grid of the file is already
+        the grid that it would be remapped to.
+        Only regular grids of the form 'rNxM' or grids given by
+        a netCDF file can be recognized.
+    """
+    try:
+        ds = Dataset(_first(ifile), 'r')
+        try:
+            lon, lat = _lon_lat(ds)
+        finally:
+            ds.close()
+        if lon is None or lat is None or lon.ndim != 1 or lat.ndim != 1:
+            return False
+        match = re.match(r'^r(\d+)x(\d+)$', remapgrid)
+        if match:
+            nx = int(match.group(1))
+            ny = int(match.group(2))
+            gridlon = np.arange(nx) * 360. / nx
+            gridlat = -90 + (np.arange(ny) + 0.5) * 180. / ny
+        else:
+            ds = Dataset(remapgrid, 'r')
+            try:
+                gridlon, gridlat = _lon_lat(ds)
+            finally:
+                ds.close()
+        if lon.shape != gridlon.shape or lat.shape != gridlat.shape:
+            return False
+        return np.allclose(lon % 360, gridlon % 360) and np.allclose(lat, gridlat)
+    except:
+        return False
+
 def get_external_function(name):
     """ Returns a function from the external module based on the function name.
     """
@@ -191,17 +376,20 @@ def get_external_function(name):
                }[function_name]
     return external_functions(name)
     
+@profiler.profile('dataload')
 def dataload(ifile, var, dates, realm='atmos', scale=1, shift=0, 
              remapf='remapdis', remapgrid='r360x180', seasons=None,
              datatype='full', depthneeded=None, section=False, fieldmean=False, gridweights=False,
-             cdostring=None, yearmean=False, external_function=None, external_function_args={}):
+             cdostring=None, yearmean=False, external_function=None, external_function_args={},
+             levels=None, cache=True):
     """ Manipulates a file used a series of cdo commands which produce intermediate files,
         and returns data about the the final file produced based on the specified parameters.
         
     Parameters
     ----------
-    ifile : string
-            the name of the original input file
+    ifile : string or list of strings
+            the name of the original input file, or the names of
+            its time slices
     var : string 
           variable name
     dates : dictionary of the date range as strings of the form 'yyyy-mm'
@@ -252,6 +440,14 @@ def dataload(ifile, var, dates, realm='atmos', scale=1, shift=0,
                         default : None
     external_function_args : dictionary
                              keyword arguments to pass to the external function
+    levels : list of floats
+             only read the levels of the z-axis nearest to these depths.
+             The z-axis is kept in the data even if it has one level.
+             default : None (all levels are read)
+    cache : boolean
+            set to False to load the data without keeping it in the
+            field cache, for data which is only used once
+            default : True
     
     Returns
     -------
@@ -263,47 +459,45 @@ def dataload(ifile, var, dates, realm='atmos', scale=1, shift=0,
     numpy array of the time axis
     numpy area of the area weights of the grid cells 
     """
-    time_averaged_bool = _check_dates(ifile, dates)
+    ifile = time_slices(ifile, dates)
+    if not cache:
+        return _dataload(ifile, var, dates, realm, scale, shift, remapf, remapgrid, seasons,
+                         datatype, depthneeded, section, fieldmean, gridweights, cdostring,
+                         yearmean, external_function, external_function_args, levels)
+    key = fc.make_key('dataload', ifile, var, dates, realm, scale, shift, remapf, remapgrid,
+                      seasons, datatype, depthneeded, section, fieldmean, gridweights,
+                      cdostring, yearmean, external_function, external_function_args, levels)
+    return fc.memoize(key, _dataload, ifile, var, dates, realm, scale, shift, remapf,
+                      remapgrid, seasons, datatype, depthneeded, section, fieldmean,
+                      gridweights, cdostring, yearmean, external_function,
+                      external_function_args, levels)
 
-    sel_var_file = sel_var(ifile, var)
-    masked_file = mask(sel_var_file, realm)
-    c_file = setc(masked_file, realm)
-    
-    if cdostring is not None:
-        c_file = cdos(c_file, cdostring)
 
-    remapped_file = remap(c_file, remapf, remapgrid)
-    seasonal_file = season(remapped_file, seasons)
-    ofile = sel_date(seasonal_file, dates['start_date'], dates['end_date'], time_averaged_bool)
+def _dataload(ifile, var, dates, realm, scale, shift, remapf, remapgrid, seasons,
+              datatype, depthneeded, section, fieldmean, gridweights, cdostring,
+              yearmean, external_function, external_function_args, levels):
+    """ Loads the data as described in dataload() without using the field cache
+    """
+    time_averaged_bool = _check_dates(ifile, dates)
 
-    if external_function is not None:
-        ofile = get_external_function(external_function)(ofile, **external_function_args)        
-    
-    if yearmean:
-        ofile = year_mean(ofile)
-    
-    if datatype == 'climatology':
-        ofile = time_mean(ofile, time_averaged_bool)
-    elif datatype == 'trends':
-        ofile = trend(ofile)
-    elif datatype == 'detrend':
-        ofile = detrend(ofile)
-    
-    if depthneeded:
-        ofile = intlevel(ofile, depthneeded)
-    
-    if section:
-        ofile = zonal_mean(ofile)
+    if getattr(constants, 'engine', 'cdo') == 'numpy' and external_function is None:
+        return _numpy_dataload(ifile, var, dates, realm, scale, shift, remapf, remapgrid,
+                               seasons, datatype, depthneeded, section, fieldmean,
+                               gridweights, cdostring, yearmean, time_averaged_bool, levels)
+
+    stages = _stages(var, dates, realm, remapf, remapgrid, seasons, datatype,
+                     depthneeded, section, fieldmean, cdostring, yearmean,
+                     external_function, external_function_args, time_averaged_bool)
+    ofile = execute(ifile, _plan(ifile, var, stages), stages)
 
-    if fieldmean:
-        ofile = field_mean(ofile)
-    
     dataset = Dataset(ofile, 'r')
     ncvar = _ncvar(dataset, var)
-    rawdata = ncvar[:].squeeze()
+    rawdata, index = _read(dataset, ncvar, levels)
     data = (rawdata + shift) * scale
     units = _units(ncvar, scale, shift)
     depth = _depth(dataset, ncvar)
+    if index is not None:
+        depth = depth[index]
     lon, lat = _lon_lat(dataset)
     time = _time(dataset, time_averaged_bool)
 
@@ -317,98 +511,789 @@ def dataload(ifile, var, dates, realm='atmos', scale=1, shift=0,
     return data, lon, lat, depth, units, time, weights
 
 
+def _level_index(depth, levels):
+    """ Returns the sorted indices of the depths nearest to each of the levels
+    """
+    depth = np.asarray(depth, dtype=float)
+    return sorted(set(int(np.abs(depth - float(l)).argmin()) for l in levels))
+
+
+def _squeeze(data, keep=None):
+    """ Removes the axes of length one except for the axis keep
+    """
+    shape = [n for i, n in enumerate(data.shape) if n != 1 or i == keep]
+    return data.reshape(shape)
+
+
+def _read_levels(ncvar, zaxis, index):
+    """ Reads the levels of a netCDF variable in the list of indices,
+        one contiguous block of levels at a time
+    """
+    pieces = []
+    start = 0
+    while start < len(index):
+        stop = start + 1
+        while stop < len(index) and index[stop] == index[stop - 1] + 1:
+            stop += 1
+        hyperslab = [slice(None)] * ncvar.ndim
+        hyperslab[zaxis] = slice(index[start], index[stop - 1] + 1)
+        pieces.append(np.ma.asarray(ncvar[tuple(hyperslab)]))
+        start = stop
+    return np.ma.concatenate(pieces, axis=zaxis)
+
+
+def _read(dataset, ncvar, levels=None):
+    """ Reads the data of a netCDF variable with the axes of length one
+        removed. If levels is given only the levels of the z axis nearest
+        to them are read and the z axis is kept.
+
+    Returns
+    -------
+    numpy array of the data
+    list of the indices of the levels read, or None if all of them were read
+    """
+    _, zaxis = _axes(dataset, ncvar)
+    levels = _depth_list(levels)
+    if levels is None or zaxis is None:
+        return ncvar[:].squeeze(), None
+    index = _level_index(_depth(dataset, ncvar), levels)
+    data = _read_levels(ncvar, zaxis, index)
+    return _squeeze(data, zaxis), index
+
+
+def _depth_list(depthneeded):
+    """ Returns the list of depths to interpolate to, or None if
+        no interpolation is needed
+    """
+    if depthneeded is None:
+        return None
+    if not isinstance(depthneeded, (list, tuple, np.ndarray)):
+        depthneeded = [depthneeded]
+    depthneeded = list(depthneeded)
+    if depthneeded == [] or depthneeded == [""] or None in depthneeded:
+        return None
+    return depthneeded
+
+
+def _stages(var, dates, realm, remapf, remapgrid, seasons, datatype,
+            depthneeded, section, fieldmean, cdostring, yearmean,
+            external_function, external_function_args, time_averaged):
+    """ Returns the list of operations needed to produce the file the data
+        is loaded from. Each operation is a tuple of its name and the
+        arguments passed to the function of the same stage.
+        Operations which would not change the file are left out.
+    """
+    stages = [('sel', (var,))]
+    if realm in ['ocean', 'land']:
+        stages.append(('masked', (realm,)))
+    if realm != 'atmos':
+        stages.append(('setc', (realm,)))
+    if cdostring is not None:
+        stages.append(('cdo', (cdostring,)))
+    stages.append(('remap', (remapf, remapgrid, var)))
+    if seasons is not None and seasons != ['DJF', 'MAM', 'JJA', 'SON']:
+        stages.append(('selseason', (seasons,)))
+    if not time_averaged:
+        stages.append(('seldate', (dates['start_date'], dates['end_date'])))
+    if external_function is not None:
+        stages.append(('external', (external_function, external_function_args)))
+    if yearmean:
+        stages.append(('yearmean', ()))
+    if datatype == 'climatology' and not time_averaged:
+        stages.append(('climate', ()))
+    elif datatype == 'trends':
+        stages.append(('slope', ()))
+    elif datatype == 'detrend':
+        stages.append(('detrend', ()))
+    depthneeded = _depth_list(depthneeded)
+    if depthneeded:
+        stages.append(('level', (depthneeded,)))
+    if section:
+        stages.append(('zonmean', ()))
+    if fieldmean:
+        stages.append(('fldmean', ()))
+    return stages
+
+
+def _has_levels(ifile, var):
+    """ Returns False if the variable in the file does not have a z axis
+    """
+    try:
+        dataset = Dataset(_first(ifile), 'r')
+    except:
+        return True
+    try:
+        _, zaxis = _axes(dataset, _ncvar(dataset, var))
+    except:
+        return True
+    finally:
+        dataset.close()
+    return zaxis is not None
+
+
+def _noop(ifile, var, stage):
+    """ Returns True if running the stage on the file would not change the data
+    """
+    operation, args = stage
+    if operation == 'remap':
+        return _same_grid(ifile, args[1])
+    if operation == 'level':
+        return not _has_levels(ifile, var)
+    if operation == 'climate':
+        return _check_averaged(ifile)
+    return False
+
+
+def _move_forward(stages, movable, passes):
+    """ Moves each of the movable stages in front of the stages
+        directly before it which it can be swapped with
+    """
+    stages = list(stages)
+    for i in xrange(len(stages)):
+        if stages[i][0] in movable:
+            j = i
+            while j > 0 and stages[j - 1][0] in passes:
+                stages[j - 1], stages[j] = stages[j], stages[j - 1]
+                j -= 1
+    return stages
+
+
+def _plan(ifile, var, stages):
+    """ Returns the stages reordered so that the data is reduced as early
+        as possible, without the stages that would not change the data.
+        The selection of dates and seasons is done before masking and
+        remapping, and the levels are interpolated before remapping and
+        any operation on the time axis. The plan is written to the log.
+        The requested stages should be passed to execute() with the plan,
+        as the legacy names of the products follow the requested order.
+    """
+    planned = [stage for stage in stages if not _noop(ifile, var, stage)]
+    planned = _move_forward(planned, TIME_SELECTIONS, SPATIAL)
+    planned = _move_forward(planned, ['level'], SPATIAL[-1:] + TIME_REDUCTIONS)
+    _log_plan(ifile, var, stages, planned)
+    return planned
+
+
+def _log_plan(ifile, var, stages, planned):
+    def describe(stagelist):
+        return ' -> '.join([_stage_operator(stage) or stage[0] for stage in stagelist])
+    text = describe(planned)
+    if (file_name(ifile), text) in _logged_plans:
+        return
+    _logged_plans.add((file_name(ifile), text))
+    yamllog.write('Plan for ' + var + ' from ' + file_name(ifile) + ':\n' +
+                  '    requested: ' + describe(stages) + '\n' +
+                  '    planned:   ' + text + '\n\n')
+
+
+def _stage_function(operation):
+    """ Returns the function which runs a single stage
+    """
+    return {'sel': sel_var,
+            'masked': mask,
+            'setc': setc,
+            'cdo': cdos,
+            'remap': remap,
+            'selseason': season,
+            'seldate': sel_date,
+            'yearmean': year_mean,
+            'climate': time_mean,
+            'slope': trend,
+            'detrend': detrend,
+            'level': intlevel,
+            'zonmean': zonal_mean,
+            'fldmean': field_mean,
+            }[operation]
+
+
+def _run_stage(name, stage, legacy=None):
+    """ Runs a single stage on a file and returns the name of the new file.
+        The product is taken from processed_cmip5_root if it is there
+        under its legacy name.
+    """
+    operation, args = stage
+    found = _precalculated(legacy)
+    if found is not None:
+        _legacy[found] = legacy
+        return found
+    if operation == 'external':
+        return get_external_function(args[0])(name, **args[1])
+    out = _stage_function(operation)(name, *args)
+    if legacy is not None and out != name:
+        _legacy[out] = legacy
+    return out
+
+
+def _legacy_prefix(stage):
+    """ Returns the prefix the product of a stage was named with before
+        products were named by their key, or None if it had none
+    """
+    operation, args = stage
+    if operation == 'remap':
+        return args[0] + '-' + args[1] + '_'
+    if operation == 'selseason':
+        return 'selseason-' + ''.join(args[0]) + '_'
+    if operation == 'seldate':
+        return 'seldate_' + args[0] + '_' + args[1] + '_'
+    if operation == 'level':
+        return 'level-' + depthstring(args[0]).replace(' ', '')[:99] + '_'
+    if operation == 'external':
+        return None
+    return operation + '_'
+
+
+def _legacy_names(name, stages, requested=None):
+    """ Returns the names the products of the planned stages run one after
+        the other on the file would have had before products were named by
+        their key. These are the names used in processed_cmip5_root.
+
+        The legacy names follow the order the stages were requested in,
+        before _plan() reordered them and left out the ones which would
+        not change the data. A planned product has the legacy name of the
+        longest requested product made by the same stages, apart from
+        the ones left out, and None if there is no such product.
+    """
+    if requested is None:
+        requested = stages
+    if isinstance(name, (list, tuple)):
+        legacy = split(name[0])
+    else:
+        legacy = _legacy.get(name, split(name))
+    requested_names = []
+    for stage in requested:
+        prefix = _legacy_prefix(stage)
+        legacy = None if legacy is None or prefix is None else prefix + legacy
+        requested_names.append(legacy)
+    names = []
+    for i in xrange(len(stages)):
+        done = stages[:i + 1]
+        found = None
+        for j in xrange(len(requested)):
+            head = requested[:j + 1]
+            if (all(stage in head for stage in done) and
+                    all(stage in done or stage not in stages for stage in head)):
+                found = requested_names[j]
+        names.append(found)
+    return names
+
+
+def _precalculated(legacy):
+    """ Returns the file with the legacy name in processed_cmip5_root,
+        or None if there is none
+    """
+    processed_root = getattr(constants, 'processed_cmip5_root', None)
+    if not processed_root or legacy is None:
+        return None
+    precalc = os.path.join(processed_root, legacy)
+    if os.path.isfile(precalc):
+        return precalc
+    return None
+
+
+def _stage_product(stage):
+    """ Returns the operation name and parameters used to name
+        the product of a stage. These match the names used by
+        the function of the stage.
+    """
+    operation, args = stage
+    if operation == 'sel':
+        return 'sel', [args[0]]
+    if operation == 'masked':
+        return 'masked', [args[0], _mask_identity(_mask_name(args[0]))]
+    if operation == 'setc':
+        return 'setc', [0]
+    if operation == 'cdo':
+        return 'cdo', [args[0]]
+    if operation == 'remap':
+        return args[0], [_grid_identity(args[1])]
+    if operation == 'selseason':
+        return 'selseason', [','.join(args[0])]
+    if operation == 'seldate':
+        return 'seldate', [args[0], args[1]]
+    if operation == 'level':
+        return 'level', [depthstring(args[0])]
+    return operation, []
+
+
+def _stage_operator(stage):
+    """ Returns the cdo operator of a stage as used in a chained
+        cdo command, or None if the stage can not be chained
+    """
+    operation, args = stage
+    if operation == 'sel':
+        return 'selvar,' + args[0]
+    if operation == 'masked':
+        return 'ifthen ' + _mask_name(args[0])
+    if operation == 'setc':
+        return 'setctomiss,0'
+    if operation == 'remap':
+        return REMAP_OPERATORS.get(args[0], args[0]) + ',' + args[1]
+    if operation == 'selseason':
+        return 'selseas,' + ','.join(args[0])
+    if operation == 'seldate':
+        return 'seldate,' + args[0] + ',' + args[1]
+    if operation == 'level':
+        return 'intlevelx,' + depthstring(args[0])
+    return {'yearmean': 'yearmean',
+            'climate': 'timmean',
+            'slope': 'trend',
+            'detrend': 'detrend',
+            'zonmean': 'zonmean',
+            'fldmean': 'fldmean',
+            }.get(operation)
+
+
+def _chain_operator(stage, name):
+    """ Same as _stage_operator(), but a remap uses the cached weights
+        for the grid of the file the chain starts from where they can
+        be made. The stages before it in a chain do not change the grid.
+    """
+    operation, args = stage
+    if operation == 'remap':
+        weights = remap_weights.find(_first(name), REMAP_OPERATORS.get(args[0], args[0]),
+                                     args[1], _grid_identity(args[1]), *args[2:])
+        if weights is not None:
+            return 'remap,' + args[1] + ',' + weights
+    return _stage_operator(stage)
+
+
+def share(key):
+    """ Marks the product with this key as needed by more than one
+        request so that chained cdo commands will write it to disk.
+    """
+    SHARED.add(key)
+
+
+def _segments(stages, keys):
+    """ Splits the stages into the groups that will each be run
+        as one chained cdo command. A group ends at a stage that can not
+        be chained, at a trend (which writes two files), and at any
+        product marked as shared, such as the time series shared by
+        the climatology, trend and significance requests.
+    """
+    segments = []
+    current = []
+    for i, stage in enumerate(stages):
+        if _stage_operator(stage) is None:
+            if current:
+                segments.append(current)
+            segments.append([i])
+            current = []
+            continue
+        current.append(i)
+        if stage[0] == 'slope' or keys[i] in SHARED:
+            segments.append(current)
+            current = []
+    if current:
+        segments.append(current)
+    return segments
+
+
+def chain_keys(name, stages):
+    """ Returns the keys of the products of each of the stages
+        run one after the other on the file
+    """
+    keys = []
+    parent = pc.identity(name)
+    for stage in stages:
+        operation, params = _stage_product(stage)
+        parent = pc.chain(parent, operation, *params)
+        keys.append(parent)
+    return keys
+
+
+@profiler.profile('cdo')
+def _run_chain(name, stages):
+    """ Runs several stages as a single chained cdo command writing only
+        the final product. Returns the name of the product, or None if
+        the command failed.
+    """
+    parent = pc.identity(name)
+    for stage in stages[:-1]:
+        operation, params = _stage_product(stage)
+        parent = pc.chain(parent, operation, *params)
+    operation, params = _stage_product(stages[-1])
+    key, out = pc.derive(parent, name, operation, *params)
+    if not pc.claim(key):
+        return pc.lookup(key)
+    expression = _cdo_input(name)
+    for stage in stages[:-1]:
+        expression = '-' + _chain_operator(stage, name) + ' ' + expression
+    if stages[-1][0] == 'slope':
+        command = 'cdo -L trend ' + expression + ' ' + pc.path(key, 'intercept') + ' ' + out
+    else:
+        command = 'cdo -L ' + _chain_operator(stages[-1], name) + ' ' + expression + ' ' + out
+    if os.system(command) != 0:
+        silent_remove(out)
+        pc.release(key)
+        return None
+    pc.register(key)
+    return out
+
+
+def execute(ifile, stages, requested=None):
+    """ Runs the stages on the input file and returns the name of the
+        file holding the final product. Unless chain_cdo is switched off,
+        the stages are run as chained cdo commands which only write the
+        final product and the products shared with other requests.
+        Products which already exist are reused.
+
+    Parameters
+    ----------
+    ifile : string or list of strings
+    stages : list
+             as returned by _plan()
+    requested : list
+                the stages before they were planned, which give the legacy
+                names the products are looked for in processed_cmip5_root.
+                default : None (the planned stages)
+    """
+    legacy = _legacy_names(ifile, stages, requested)
+    if not getattr(constants, 'chain_cdo', True):
+        for i, stage in enumerate(stages):
+            ifile = _run_stage(ifile, stage, legacy[i])
+        return ifile
+
+    keys = chain_keys(ifile, stages)
+    for segment in _segments(stages, keys):
+        # start from the last product of the segment which already exists
+        start = 0
+        for j in range(len(segment) - 1, -1, -1):
+            operation, _ = _stage_product(stages[segment[j]])
+            found = already_calculated(pc.path(keys[segment[j]], operation), keys[segment[j]],
+                                       claim=False)
+            if found is None:
+                found = _precalculated(legacy[segment[j]])
+            if found is not None:
+                ifile = found
+                start = j + 1
+                break
+        todo = [stages[i] for i in segment[start:]]
+        if not todo:
+            continue
+        ofile = None
+        if len(todo) > 1:
+            ofile = _run_chain(ifile, todo)
+        if ofile is None:
+            # run the stages one at a time to use their fallbacks
+            for i in segment[start:]:
+                ifile = _run_stage(ifile, stages[i], legacy[i])
+        else:
+            ifile = ofile
+        if legacy[segment[-1]] is not None:
+            _legacy[ifile] = legacy[segment[-1]]
+        keys = keys[:segment[-1] + 1] + chain_keys(ifile, stages[segment[-1] + 1:])
+    return ifile
+
+
+def _numpy_mask(data, realm):
+    """ Masks the land or ocean points of the data in memory
+        using the masks linked in the mask directory
+    """
+    if realm == 'ocean':
+        name, var = 'mask/ocean', 'sftof'
+        warning = 'WARNING: Land data was not masked\n'
+    elif realm == 'land':
+        name, var = 'mask/land', 'sftlf'
+        warning = 'WARNING: Ocean data was not masked\n'
+    else:
+        return data
+    try:
+        maskvar = Dataset(name, 'r').variables[var][:].squeeze()
+        landsea = np.ma.filled(maskvar, 0) == 0
+        data = np.ma.masked_where(np.broadcast_to(landsea, data.shape), data)
+    except:
+        yamllog.write(warning)
+    return data
+
+
+def _numpy_stages(ifile, var, dates, realm, remapf, remapgrid, cdostring):
+    """ Returns the stages run with cdo before the numpy engine processes
+        the data in memory, or None if the file can be used as it is.
+        cdo is only used when a cdostring is given, or to remap the data
+        when it is not already on the grid it should be remapped to and
+        the remap weights are not cached, so it can not be remapped in memory.
+    """
+    if cdostring is None and (_same_grid(ifile, remapgrid) or remap_weights.enabled):
+        return None
+    return _remap_stages(var, dates, realm, remapf, remapgrid, cdostring)
+
+
+def _remap_stages(var, dates, realm, remapf, remapgrid, cdostring):
+    return _stages(var, dates, realm, remapf, remapgrid, None, 'full', None,
+                   False, False, cdostring, False, None, {}, True)
+
+
+def _regrid_weights(ifile, var, remapf, remapgrid):
+    """ Returns the weights to remap the variable in the file with
+        in memory, or None if they can not be made
+    """
+    name = remap_weights.find(_first(ifile), REMAP_OPERATORS.get(remapf, remapf),
+                              remapgrid, _grid_identity(remapgrid), var)
+    if name is None:
+        return None
+    try:
+        return regrid.load(name)
+    except Exception:
+        return None
+
+
+def plan(ifile, var, dates, realm='atmos', remapf='remapdis', remapgrid='r360x180',
+         seasons=None, datatype='full', depthneeded=None, section=False, fieldmean=False,
+         cdostring=None, yearmean=False, external_function=None, external_function_args={}):
+    """ Returns the stages that dataload runs with cdo for the same arguments,
+        in the order they will be run. An empty list is returned if no
+        stages are run with cdo.
+    """
+    stages = requested_stages(ifile, var, dates, realm, remapf, remapgrid, seasons,
+                              datatype, depthneeded, section, fieldmean, cdostring,
+                              yearmean, external_function, external_function_args)
+    return _plan(time_slices(ifile, dates), var, stages)
+
+
+def requested_stages(ifile, var, dates, realm='atmos', remapf='remapdis', remapgrid='r360x180',
+                     seasons=None, datatype='full', depthneeded=None, section=False,
+                     fieldmean=False, cdostring=None, yearmean=False, external_function=None,
+                     external_function_args={}):
+    """ Returns the stages that dataload runs with cdo for the same arguments,
+        in the order they are requested, before they are planned.
+    """
+    ifile = time_slices(ifile, dates)
+    time_averaged_bool = _check_dates(ifile, dates)
+    if getattr(constants, 'engine', 'cdo') == 'numpy' and external_function is None:
+        stages = _numpy_stages(ifile, var, dates, realm, remapf, remapgrid, cdostring)
+        if stages is None:
+            return []
+        return stages
+    return _stages(var, dates, realm, remapf, remapgrid, seasons, datatype,
+                   depthneeded, section, fieldmean, cdostring, yearmean,
+                   external_function, external_function_args, time_averaged_bool)
+
+
+def _numpy_dataload(ifile, var, dates, realm, scale, shift, remapf, remapgrid,
+                    seasons, datatype, depthneeded, section, fieldmean, gridweights,
+                    cdostring, yearmean, time_averaged, levels=None):
+    """ Returns the same values as dataload, but does the operations on the
+        time and vertical axes in memory with numpy_engine. The data is
+        remapped in memory with the cached remap weights where they can
+        be made.
+    """
+    stages = _numpy_stages(ifile, var, dates, realm, remapf, remapgrid, cdostring)
+    weights = None
+    if stages is None and not _same_grid(ifile, remapgrid):
+        weights = _regrid_weights(ifile, var, remapf, remapgrid)
+        if weights is None:
+            stages = _remap_stages(var, dates, realm, remapf, remapgrid, cdostring)
+    premasked = stages is not None
+    if premasked:
+        ifile = execute(ifile, _plan(ifile, var, stages), stages)
+
+    dataset = _open(ifile)
+    ncvar = _ncvar(dataset, var)
+    taxis, zaxis = _axes(dataset, ncvar)
+    lon, lat = _lon_lat(dataset)
+    depth = _depth(dataset, ncvar)
+    timetuples = _timetuples(dataset)
+    depthneeded = _depth_list(depthneeded)
+    levels = _depth_list(levels)
+    # levels can only be read on their own if there is no interpolation
+    partial = levels is not None and zaxis is not None and depthneeded is None
+    if partial:
+        index = _level_index(depth, levels)
+        data = _read_levels(ncvar, zaxis, index)
+        depth = depth[index]
+    else:
+        data = np.ma.asarray(ncvar[:])
+    if zaxis is not None:
+        zlevels = dataset.variables[ncvar.dimensions[zaxis]][:]
+
+    # put the time axis first so that all of the operations can assume it
+    if taxis is None:
+        data = data[np.newaxis, ...]
+        if zaxis is not None:
+            zaxis += 1
+    elif taxis != 0:
+        data = np.ma.array(np.rollaxis(data, taxis))
+        if zaxis is not None and zaxis < taxis:
+            zaxis += 1
+    if timetuples is None or taxis is None:
+        time_averaged = True
+
+    if not premasked:
+        data = _numpy_mask(data, realm)
+        if realm != 'atmos':
+            data = np.ma.masked_equal(data, 0)
+
+    if not time_averaged:
+        if seasons is not None and seasons != ['DJF', 'MAM', 'JJA', 'SON']:
+            index = ne.season_index(timetuples, seasons)
+            data = data[index]
+            timetuples = [t for t, i in zip(timetuples, index) if i]
+        index = ne.date_index(timetuples, year_mon_day(dates['start_date']),
+                              year_mon_day(dates['end_date']))
+        data = data[index]
+        timetuples = [t for t, i in zip(timetuples, index) if i]
+
+        if yearmean:
+            data, timetuples = ne.year_mean(data, timetuples)
+
+        if datatype == 'climatology':
+            data = ne.time_mean(data)
+            timetuples = [timetuples[len(timetuples) // 2]]
+        elif datatype == 'trends':
+            data = ne.trend(data)
+            timetuples = [timetuples[len(timetuples) // 2]]
+        elif datatype == 'detrend':
+            data = ne.detrend(data)
+
+    if depthneeded is not None and zaxis is not None:
+        data = ne.intlevel(data, zlevels, zaxis, [float(d) for d in depthneeded])
+        depth = np.round(np.array(depthneeded, dtype=float))
+
+    if weights is not None:
+        # after the time and level operations so that there is less to remap
+        data = regrid.apply(weights, data)
+        lon, lat = weights['lon'], weights['lat']
+
+    if section:
+        data = ne.zonal_mean(data)
+        lon = np.mean(lon)
+
+    if fieldmean:
+        data = ne.field_mean(data, ne.grid_weights(lon, lat))
+        lon = np.mean(lon)
+        lat = np.mean(lat)
+
+    if gridweights:
+        weights = ne.grid_weights(lon, lat).squeeze()
+    else:
+        weights = None
+
+    if partial:
+        rawdata = _squeeze(data, zaxis)
+    else:
+        rawdata = data.squeeze()
+    data = (rawdata + shift) * scale
+    units = _units(ncvar, scale, shift)
+    if time_averaged:
+        time = None
+    else:
+        time = ne.to_datetimes(timetuples)
+    return data, lon, lat, depth, units, time, weights
+
+
 def split(name):
     """ Returns the name of a file without the directory path
     """
     path, filename = os.path.split(name)
     return filename
 
+@profiler.profile('cdo')
 def sel_date(name, start_date, end_date, time_average=False):
     if time_average:     
         return name
-    out = 'netcdf/seldate_' + start_date + '_' + end_date + '_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'seldate', start_date, end_date)
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         datestring = start_date + ',' + end_date
         cdo.seldate(datestring, input=name, output=out)
+        pc.register(key)
     return out
     
+@profiler.profile('cdo')
 def sel_var(name, variable):
-    out = 'netcdf/sel_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'sel', variable)
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
-        cdo.selvar(variable, input=name, output=out) 
+        cdo.selvar(variable, input=_cdo_input(name), output=out) 
+        pc.register(key)
     return out
 
+def _mask_name(realm):
+    return {'ocean': 'mask/ocean',
+            'land': 'mask/land',
+            }[realm]
+
+def _mask_identity(maskname):
+    try:
+        return pc.identity(maskname)
+    except OSError:
+        return None
+
+@profiler.profile('cdo')
 def mask(name, realm):
-    out = 'netcdf/masked_' + split(name)
-    already_exists = already_calculated(out)
+    if realm == 'ocean':
+        warning = 'WARNING: Land data was not masked\n'
+    elif realm == 'land':
+        warning = 'WARNING: Ocean data was not masked\n'
+    else:
+        return name
+    maskname = _mask_name(realm)
+    key, out = pc.product(name, 'masked', realm, _mask_identity(maskname))
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
-    else:
-        if realm == 'ocean':
-            try:
-                cdo.ifthen(input='mask/ocean ' + name, output=out)
-            except:
-                with open('logs/log.txt', 'a') as outfile:
-                    outfile.write('WARNING: Land data was not masked\n')
-                silent_remove(out)
-                return name
-        elif realm == 'land':
-            try:
-                cdo.ifthen(input='mask/land ' + name, output=out) 
-            except:
-                with open('logs/log.txt', 'a') as outfile:
-                    outfile.write('WARNING: Ocean data was not masked\n')
-                silent_remove(out)
-                return name
-        else:
-            out = name
+    try:
+        cdo.ifthen(input=maskname + ' ' + name, output=out)
+    except:
+        yamllog.write(warning)
+        silent_remove(out)
+        pc.release(key)
+        return name
+    pc.register(key)
     return out
 
+@profiler.profile('cdo')
 def time_mean(name, time_average=False):
     if time_average:
        return name
-    out = 'netcdf/climate_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'climate')
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         cdo.timmean(input=name, output=out)
+        pc.register(key)
     return out  
 
+@profiler.profile('cdo')
 def trend(name):
-    out = 'netcdf/slope_' + split(name)
-    outintercept = 'netcdf/intercept_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'slope')
+    outintercept = pc.path(key, 'intercept')
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         cdo.trend(input=name, output=outintercept + ' ' + out)
+        pc.register(key)
     return out
 
+@profiler.profile('cdo')
 def detrend(name):
-    out = 'netcdf/detrend_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'detrend')
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         cdo.detrend(input=name, output=out)
+        pc.register(key)
     return out    
 
+@profiler.profile('cdo')
 def setc(name, realm='ocean'):
     if realm == 'atmos':
         return name
-    out = 'netcdf/setc_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'setc', 0)
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         cdo.setctomiss(0, input=name, output=out)
+        pc.register(key)
     return out
 
 def get_remap_function(remap):
@@ -425,39 +1310,78 @@ def get_remap_function(remap):
                 }[r]
     return cdoremap(remap)
 
-def remap(name, remapname, remapgrid):
-    out = 'netcdf/' + remapname + '-' + remapgrid + '_' + split(name)
-    already_exists = already_calculated(out)
+def _grid_identity(remapgrid):
+    """ Returns the key of a grid file, or the name of the grid
+        if it is not a file
+    """
+    if os.path.isfile(remapgrid):
+        return pc.identity(remapgrid)
+    return remapgrid
+
+@profiler.profile('cdo')
+def remap(name, remapname, remapgrid, var=None):
+    key, out = pc.product(name, remapname, _grid_identity(remapgrid))
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
-        remap = get_remap_function(remapname)
-        try:
-            remap(remapgrid, input=name, output=out)
-        except:
+        weights = remap_weights.find(_first(name), REMAP_OPERATORS.get(remapname, remapname),
+                                     remapgrid, _grid_identity(remapgrid), var)
+        if weights is not None:
             try:
-                os.remove(out)
+                cdo.remap(remapgrid + ',' + weights, input=name, output=out)
+                pc.register(key)
+                return out
             except:
-                pass
+                # the weights may not fit the file, remap it without them
+                silent_remove(out)
+        try:
+            get_remap_function(remapname)(remapgrid, input=name, output=out)
+        except:
+            silent_remove(out)
+            pc.release(key)
             return name
+        pc.register(key)
     return out
 
+@profiler.profile('cdo')
+def merge_time(name):
+    """ Merges the time slices in a list of files into one file
+    """
+    key, out = pc.product(name, 'mergetime')
+    already_exists = already_calculated(out, key)
+    if already_exists is not None:
+        return already_exists
+    else:
+        try:
+            cdo.mergetime(input=' '.join(name), output=out)
+        except:
+            silent_remove(out)
+            pc.release(key)
+            raise
+        pc.register(key)
+    return out
+
+@profiler.profile('cdo')
 def field_mean(name):
-    out = 'netcdf/fldmean_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'fldmean')
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         cdo.fldmean(input=name, output=out)
+        pc.register(key)
     return out
 
+@profiler.profile('cdo')
 def zonal_mean(name):
-    out = 'netcdf/zonmean_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'zonmean')
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         cdo.zonmean(input=name, output=out)
+        pc.register(key)
     return out
     
 def depthstring(depthlist):
@@ -467,82 +1391,100 @@ def depthstring(depthlist):
     return ','.join(depthneeded)
     
        
+@profiler.profile('cdo')
 def intlevel(name, depthlist):
-    if depthlist == None or depthlist == [] or depthlist == [""] or depthlist == [None]:
+    depthlist = _depth_list(depthlist)
+    if depthlist is None:
         return name
     depth = depthstring(depthlist)
-    depthname = depth.replace(' ', '')
-    if len(depthname) > 100:
-        depthname = depthname[:99]
-    out = 'netcdf/level-' + str(depthname) + '_' + split(name)
     if depth:
-        already_exists = already_calculated(out)
+        key, out = pc.product(name, 'level', depth)
+        already_exists = already_calculated(out, key)
         if already_exists is not None:
             return already_exists
         else:
             try:
                 cdo.intlevelx(str(depth), input=name, output=out)
             except:
+                pc.release(key)
                 return name
+            pc.register(key)
     else:
         return name
     return out        
    
+@profiler.profile('cdo')
 def season(name, seasonlist):
     if seasonlist == None or seasonlist == ['DJF', 'MAM', 'JJA', 'SON']:
         return name
     seasonstring = ','.join(seasonlist)
-    outputstring = ''.join(seasonlist)
-    out = 'netcdf/selseason-' + outputstring + '_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'selseason', seasonstring)
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         cdo.selseas(seasonstring, input=name, output=out)
+        pc.register(key)
     return out
 
+@profiler.profile('cdo')
 def cdos(name, string):
     if string:
-        out = 'netcdf/cdo_' + split(name)
-        if not os.path.isfile(out):
-            s = 'cdo ' + string + ' ' + name + ' ' + out
-            os.system(s)
+        key, out = pc.product(name, 'cdo', string)
+        already_exists = already_calculated(out, key)
+        if already_exists is not None:
+            return already_exists
+        s = 'cdo ' + string + ' ' + name + ' ' + out
+        if os.system(s) == 0:
+            pc.register(key)
+        else:
+            pc.release(key)
         return out
     return name
 
+@profiler.profile('cdo')
 def grid_weights(name):
-    out = 'netcdf/gridweights_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'gridweights')
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
          return already_exists
     else:
         cdo.gridweights(input=name, output=out)
+        pc.register(key)
     return out
 
+@profiler.profile('cdo')
 def year_mean(name):
-    out = 'netcdf/yearmean_' + split(name)
-    already_exists = already_calculated(out)
+    key, out = pc.product(name, 'yearmean')
+    already_exists = already_calculated(out, key)
     if already_exists is not None:
         return already_exists
     else:
         cdo.yearmean(input=name, output=out)
+        pc.register(key)
     return out
 
 
-def already_calculated(name):
-    if os.path.isfile(name):
+def already_calculated(name, key=None, claim=True):
+    """ Returns the name of the file if the product has already been made
+        in this or a previous run, otherwise returns None.
+        Products are found using their key in the manifest of the
+        product_cache. The products in processed_cmip5_root are found
+        by their legacy names with _precalculated() before the stages are run.
+        Unless claim is False, a product which has to be made is claimed
+        so that it is not made by another process at the same time.
+    """
+    if key is not None:
+        found = pc.lookup(key)
+        if found is not None:
+            return found
+    elif os.path.isfile(name):
         return name
-    try:
-        processed_root = constants.processed_cmip5_root
-    except:   
-        return None
-    
-    precalc = processed_root + '/' + split(name)
-    try:
-        if os.path.isfile(precalc):
-            return precalc
-    except:
-        return None
+
+    if key is not None and claim and not pc.claim(key):
+        # it was made by another process while waiting for it
+        return pc.lookup(key)
+    return None
     
 if __name__ == "__main__":
     pass
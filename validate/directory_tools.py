@@ -8,16 +8,44 @@ directories and gathering information from files.
 .. moduleauthor:: David Fallis
 """
 import os
+import sys
 from netCDF4 import Dataset, num2date, date2num
 import datetime
 import itertools
 import tarfile
+from multiprocessing.pool import ThreadPool
 import cmipdata as cd
+import data_loader as pl
+import product_cache
+import ensemble
+import file_index
+import obs_catalogue
+import yamllog
 import cdo
 cdo = cdo.Cdo()
 
 MEANDIR = None
 
+# True to make the cmip5 mean from the models when it is not in cmip5_means
+MAKE_CMIP_MEAN = False
+
+# True to find the files without running cdo, as done by validate-execute --plan.
+# The first realization stands in for the average of a model.
+DRY_RUN = False
+
+# (operation, output file, input files) of the files not made in a dry run
+SKIPPED = []
+
+# directories listed by scan() mapped to the files in them
+_trees = {}
+
+# (variable, model, experiment, frequency, cmip directory) mapped to the
+# files found by model_files() in this run, or None if none were found
+_models = {}
+
+# arguments of model_average() mapped to the mean made in this run
+_averages = {}
+
 def _variable_dictionary(plots):
     """ Creates a dictionary with the variable names as keys
         mapped to empty lists
@@ -38,9 +66,9 @@ def _variable_dictionary(plots):
     return variables
 
 
-def min_start_dates(plots):
-    """ Returns a dictionary which maps the variable names
-        to the earliest year needed for that variable in all of the plots
+def date_windows(plots):
+    """ Returns a dictionary which maps the variable names to the
+        date ranges needed for that variable by each of the plots
 
     Parameters
     ----------
@@ -48,54 +76,47 @@ def min_start_dates(plots):
 
     Returns
     -------
-    dictionary
+    dictionary mapping to a list of (start, end) tuples of (year, month, day)
     """
-    start_dates = _variable_dictionary(plots)
+    windows = _variable_dictionary(plots)
     for p in plots:
-        try:
-            start_dates[p['variable']].append(p['dates']['start_date'])
-        except: pass
-        try:
-            start_dates[p['variable']].append(p['comp_dates']['start_date'])
-        except: pass
-        
-    for var in start_dates:
-        start_dates[var] = [int(date[:4]) for date in start_dates[var]]
-        try:
-            start_dates[var] = min(start_dates[var])
-        except:
-            start_dates[var] = None
-    return start_dates
+        for var in [p['variable']] + list(p['extra_variables']):
+            for dates in ['dates', 'comp_dates']:
+                try:
+                    window = (pl.year_mon_day(p[dates]['start_date']),
+                              pl.year_mon_day(p[dates]['end_date']))
+                except:
+                    continue
+                if window not in windows[var]:
+                    windows[var].append(window)
+    return windows
 
 
-def max_end_dates(plots):
-    """ Returns a dictionary which maps the variable names
-        to the latest year needed for that variable in all of the plots
+def _overlaps(dates, windows):
+    """ Returns True if the dates of a file overlap any of the windows,
+        or if either of them is not known
+    """
+    if dates is None or dates[0] is None or not windows:
+        return True
+    start, end = dates
+    return any(start <= wend and end >= wstart for wstart, wend in windows)
 
-    Parameters
-    ----------
-    plots : list of dictionaries
 
-    Returns
-    -------
-    dictionary
+def _within_dates(files, windows):
+    """ Returns the files without those whose names show that they are
+        outside all of the date ranges needed for their variable, so that
+        they are never opened. All of the files of a variable are kept if
+        none of them are inside, so that the plots warn about the dates.
     """
-    end_dates = _variable_dictionary(plots)
-    for p in plots:
-        try:
-            end_dates[p['variable']].append(p['dates']['end_date'])
-        except: pass
-        try:
-            end_dates[p['variable']].append(p['comp_dates']['end_date'])
-        except: pass
-
-    for var in end_dates:
-        end_dates[var] = [int(date[:4]) for date in end_dates[var]]
-        try:
-            end_dates[var] = max(end_dates[var])
-        except:
-            end_dates[var] = None
-    return end_dates
+    byvariable = {}
+    for f in files:
+        byvariable.setdefault(getvariable(f), []).append(f)
+    keep = set()
+    for var, vfiles in byvariable.iteritems():
+        inside = [f for f in vfiles
+                  if _overlaps(file_index.name_dates(f), windows.get(var))]
+        keep.update(inside or vfiles)
+    return [f for f in files if f in keep]
 
 
 def traverse(root):
@@ -111,14 +132,85 @@ def traverse(root):
     -------
     list of strings
 
+    """
+    if root in _trees:
+        return list(_trees[root])
+    return _walk(root)
+
+
+def _walk(root):
+    """ Same as traverse(), but always lists the directory, with the
+        files in a fixed order
     """
     files = []
     for dirname, subdirlist, filelist in os.walk(root):
-        for f in filelist:
+        subdirlist.sort()
+        for f in sorted(filelist):
             files.append(dirname + '/' + f)
     return files
 
 
+def _top(root):
+    """ Returns the files and the subdirectories directly in a directory
+    """
+    files = []
+    subdirs = []
+    for name in sorted(os.listdir(root)):
+        if os.path.isdir(os.path.join(root, name)):
+            # named as os.walk names them
+            subdirs.append(os.path.join(root, name))
+        else:
+            files.append(root + '/' + name)
+    return files, subdirs
+
+
+def _roots(plots, directroot, root, run, experiment, meandir):
+    """ Returns the directories which will be traversed to find the files,
+        named as they are by the functions which traverse them. The
+        observations are listed by obs_catalogue.
+    """
+    roots = [directroot] if directroot else [root + '/' + experiment + '-' + run]
+    ids = sorted(set(i for p in plots for i in p['comp_ids']))
+    roots += [root + experiment + '-' + i for i in ids]
+    if meandir:
+        roots.append(meandir)
+    return [r for r in roots if os.path.isdir(r)]
+
+
+def scan(plots, directroot, root, run, experiment, meandir, jobs=8):
+    """ Lists the files of the model run, the runs compared to and
+        the cmip5 means at the same time with a pool of
+        jobs threads, and reads the headers of the files of the variables
+        plotted which may be inside the dates of the plots into the file
+        index. Later calls of traverse() on these
+        directories return the stored lists.
+
+    Returns
+    -------
+    int of the number of files listed
+    """
+    roots = _roots(plots, directroot, root, run, experiment, meandir)
+    pool = ThreadPool(max(jobs, 1))
+    try:
+        tops = pool.map(_top, roots)
+        # each of the subdirectories of every root is walked separately
+        subdirs = [d for _, dirs in tops for d in dirs]
+        walked = dict(zip(subdirs, pool.map(_walk, subdirs)))
+    finally:
+        pool.close()
+        pool.join()
+    for r, (files, dirs) in zip(roots, tops):
+        _trees[r] = files + [f for d in dirs for f in walked[d]]
+
+    variables = set()
+    for p in plots:
+        variables.add(p['variable'])
+        variables.update(p['extra_variables'])
+    wanted = [f for r in roots for f in _trees[r] if getvariable(f) in variables]
+    file_index.scan(_within_dates(wanted, date_windows(plots)), jobs)
+    return sum(len(_trees[r]) for r in roots)
+
+
 def _mkdir():
     """ Tries to make directories used to store processed *.nc files
     """
@@ -139,6 +231,7 @@ def _mkdir():
     mkthedir('plots')
     mkthedir('logs')
     mkthedir('netcdf')
+    mkthedir(product_cache.ROOT)
     mkthedir('cmipfiles')
 
 
@@ -192,18 +285,17 @@ def _load_masks(files):
 #    os.system('ln -s /raid/rc40/data/ncs/historical-' + run + '/fx/atmos/sftlf/r0i0p0/sftlf_fx_DevAM4-2_historical-edr_r0i0p0.nc ./mask/land')
 
 
-def _remove_files_out_of_date_range(filedict, start_dates, end_dates):
+def _remove_files_out_of_date_range(filedict, windows):
     """ Removes file names from a dictionary which will not be needed because
-        they are outside the date range
+        they are outside the date ranges of all of the plots
 
     Parameters
     ----------
     filedict : dictionary
                maps tuple to a list of file names
-    start_dates : dictionary
-                  maps variable name to ealiest year needed
-    end_dates : dictionary
-                maps variable name to latest year needed
+    windows : dictionary
+              maps variable name to the date ranges needed, as
+              returned by date_windows()
 
     Returns
     -------
@@ -211,23 +303,19 @@ def _remove_files_out_of_date_range(filedict, start_dates, end_dates):
     """
     for d in filedict:
         if len(filedict[d]) > 1:
-            for infile in filedict[d][:]:
-                sd, ed = getdates(infile)
-                if end_dates[d[1]]:
-                    if int(sd) > int(end_dates[d[1]]):
-                        filedict[d].remove(infile)
-                if start_dates[d[1]]:
-                    if int(ed) < int(start_dates[d[1]]):
-                        try:
-                            filedict[d].remove(infile)
-                        except:
-                            pass
+            inside = [f for f in filedict[d]
+                      if _overlaps(file_index.span(f), windows.get(d[1]))]
+            # keep the files if none are inside so that the plots warn about it
+            filedict[d] = inside or filedict[d]
     return filedict
 
 
 def _cat_file_slices(filedict):
-    """ Catenates the list of files under each key
-        the dictionary now maps to the new filename
+    """ Replaces the list of files under each key by the file if there
+        is only one, or by the list of time slices in order of time.
+        The slices are read as one file by data_loader, which only opens
+        the slices overlapping the dates of each plot, so they are never
+        merged into a new file.
 
     Parameters
     ----------
@@ -236,47 +324,18 @@ def _cat_file_slices(filedict):
 
     Returns
     -------
-    dictionary mapping to new file name
+    dictionary mapping to the file name or list of file names
     """
-    count = 0
     for d in filedict:
         if len(filedict[d]) > 1:
-            count += 1
-            outfile = 'ncstore/merged' + filedict[d][0].rsplit('/', 1)[1]
-            infiles = ' '.join(filedict[d])
-            os.system('cdo mergetime ' + infiles + ' ' + outfile)
-            filedict[d] = (outfile)
+            filedict[d] = sorted(filedict[d], key=_start)
         else:
             filedict[d] = filedict[d][0]
     return filedict
 
 
-def getdates(f):
-    """ Returns the years from a filename and directory path
-
-    Parameters
-    ----------
-    string : name of file including path
-
-    Returns
-    -------
-    string of start year
-    string of end year
-    """
-    nc = Dataset(f, 'r')
-    time = nc.variables['time_bnds'][:].squeeze()
-    nc_time = nc.variables['time']
-    try:
-        cal = nc_time.calendar
-    except:
-        cal = 'standard'
-    start = nc_time[:][0]
-    end = nc_time[:][-1]
-    start = num2date(start, nc_time.units, cal)
-    end = num2date(end, nc_time.units, cal)
-    start = start.year
-    end = end.year
-    return start, end
+def _start(f):
+    return file_index.span(f)[0], f
 
 
 def getvariable(f):
@@ -308,12 +367,10 @@ def getfrequency(f):
     -------
     string of frequency
     """
-    nc = Dataset(f, 'r')
-    return str(nc.__getattribute__('frequency'))
+    return _attribute(f, 'frequency')
 
 def getexperiment(f):
-    nc = Dataset(f, 'r')
-    return str(nc.__getattribute__('experiment'))    
+    return _attribute(f, 'experiment')
     
     
 def getrealization(f):
@@ -328,8 +385,20 @@ def getrealization(f):
     -------
     string of realization number
     """
-    nc = Dataset(f, 'r')
-    return str(nc.__getattribute__('realization'))
+    return _attribute(f, 'realization')
+
+
+def _attribute(f, name):
+    """ Returns the metadata of a file from the file index.
+        An AttributeError is raised if the file does not have it.
+    """
+    if isinstance(f, list):
+        # the time slices of a file all have the same attributes
+        f = f[0]
+    value = file_index.lookup(f)[name]
+    if value is None:
+        raise AttributeError(f + ' has no ' + name)
+    return str(value)
 
 
 def getrealm(f):
@@ -344,8 +413,7 @@ def getrealm(f):
     -------
     string of realm
     """
-    nc = Dataset(f, 'r')
-    realm = str(nc.__getattribute__('modeling_realm'))
+    realm = _attribute(f, 'realm')
     if 'seaIce' in realm:
         realm = 'seaIce'
     return realm
@@ -371,6 +439,22 @@ def getrealmcat(realm):
     return realm_cat
 
 
+def _group_files(files, wanted, windows):
+    """ Returns a dictionary mapping the (frequency, variable, realization)
+        of the files which are in the set wanted to the list of those files.
+        Files named with dates outside the windows are left out.
+    """
+    variables = set(key[1] for key in wanted)
+    # the variable and dates are in the file name, so other files are never opened
+    files = _within_dates([f for f in files if getvariable(f) in variables], windows)
+    vf = {}
+    for f in files:
+        key = (getfrequency(f), getvariable(f), getrealization(f))
+        if key in wanted:
+            vf.setdefault(key, []).append(f)
+    return vf
+
+
 def getfiles(plots, directroot, root, run, experiment):
     """ For every plot in the dictionary of plots
         maps the key 'ifile' to the name of the file
@@ -391,26 +475,17 @@ def getfiles(plots, directroot, root, run, experiment):
         files = traverse(root + '/' + experiment + '-' + run)
     _load_masks(files)
 
-    realms = {}
-    for f in files:
-        realms[getvariable(f)] = getrealm(f)
-
-    vf = {}
-    fvr = []
-    for f in files:
-        vf[(getfrequency(f), getvariable(f), getrealization(f))] = []
-    for f in files:
-        vf[(getfrequency(f), getvariable(f), getrealization(f))].append(f)
+    fvr = set()
     for p in plots:
-        fvr.append((p['frequency'], p['variable'], str(p['realization'])))
+        fvr.add((p['frequency'], p['variable'], str(p['realization'])))
         for evar in p['extra_variables']:
-            fvr.append((p['frequency'], evar, str(p['realization'])))
-    for key in vf.keys():
-        if key not in fvr:
-            del vf[key]
-    startdates = min_start_dates(plots)
-    enddates = max_end_dates(plots)
-    filedict = _remove_files_out_of_date_range(vf, startdates, enddates)
+            fvr.add((p['frequency'], evar, str(p['realization'])))
+    windows = date_windows(plots)
+    vf = _group_files(files, fvr, windows)
+    realms = {}
+    for key in vf:
+        realms[key[1]] = getrealm(vf[key][0])
+    filedict = _remove_files_out_of_date_range(vf, windows)
     filedict = _cat_file_slices(filedict)
     for p in plots:
         if 'ifile' not in p:
@@ -458,22 +533,12 @@ def getidfiles(plots, root, experiment):
             ids.extend(p['comp_ids'])
         p['id_file'] = {}
     ids = list(set(ids))
-    startdates = min_start_dates(plots)
-    enddates = max_end_dates(plots)
+    windows = date_windows(plots)
     for i in ids:
         files = traverse(root + experiment + '-' + i)
-        vf = {}
-        fvr = []
-        for f in files:
-            vf[(getfrequency(f), getvariable(f), getrealization(f))] = []
-        for f in files:
-            vf[(getfrequency(f), getvariable(f), getrealization(f))].append(f)
-        for p in plots:
-            fvr.append((p['frequency'], p['variable'], str(p['realization'])))
-        for key in vf.keys():
-            if key not in fvr:
-                del vf[key]
-        filedict = _remove_files_out_of_date_range(vf, startdates, enddates)
+        fvr = set((p['frequency'], p['variable'], str(p['realization'])) for p in plots)
+        vf = _group_files(files, fvr, windows)
+        filedict = _remove_files_out_of_date_range(vf, windows)
         filedict = _cat_file_slices(filedict)
         for p in plots:
             if i in p['comp_ids']:
@@ -491,12 +556,15 @@ def remfiles(del_mask=True, del_ncstore=True, del_netcdf=True, del_cmipfiles=Tru
     del_remapfiles : boolean
     del_trendfiles : boolean
     del_zonalfiles : boolean
+
+    The files kept in cache_root are not deleted.
     """
     if del_mask:
         os.system('rm -rf mask')
     if del_ncstore:
         os.system('rm -rf ncstore')
-    if del_netcdf:
+    keep_netcdf = product_cache.PERSISTENT and os.path.abspath(product_cache.ROOT) == os.path.abspath('netcdf')
+    if del_netcdf and not keep_netcdf:
         os.system('rm -rf netcdf')
     if del_cmipfiles:
         os.system('rm -rf cmipfiles')
@@ -504,9 +572,17 @@ def remfiles(del_mask=True, del_ncstore=True, del_netcdf=True, del_cmipfiles=Tru
 
 
 def getobsfiles(plots, obsroot):
-    obsdirectories = [o for o in os.listdir(obsroot) if os.path.isdir(os.path.join(obsroot,o))]
-    for o in obsdirectories:
-        getobs (plots, obsroot + o, o)
+    """ Finds the observations files of the datasets named in comp_obs
+        or extra_obs of the plots, using the observation catalogue
+    """
+    names = set()
+    for p in plots:
+        names.update(p['comp_obs'])
+        names.update(p['extra_obs'])
+    for o in sorted(names):
+        if os.path.isdir(os.path.join(obsroot, o)):
+            getobs(plots, obsroot + o, o)
+    obs_catalogue.save()
 
 
 def getobs(plots, obsroot, o):
@@ -522,18 +598,12 @@ def getobs(plots, obsroot, o):
     obsroot : string
               directory path to find observations
     """
-    obsfiles = traverse(obsroot)
-    variables = _variable_dictionary(plots)
-    for f in obsfiles:
-        var = getvariable(f)
-        if var in variables:
-            variables[var].append(f)
     for p in plots:
         if o in p['comp_obs']:
             if 'obs_file' not in p:
                 p['obs_file'] = {}
             try:
-                p['obs_file'][o] = variables[p['variable']][0]
+                p['obs_file'][o] = obs_catalogue.files(obsroot, p['variable'], p['frequency'])[0]
             except:
                 with open('logs/log.txt', 'a') as outfile:
                     outfile.write('No observations file was found for ' + p['variable'] + '\n\n')
@@ -545,7 +615,8 @@ def getobs(plots, obsroot, o):
             for i, name in enumerate(p['extra_obs'][:]):
                if name == o:
                    try:
-                       p['extra_obs_files'][p['extra_variables'][i]] = variables[p['extra_variables'][i]][0]
+                       p['extra_obs_files'][p['extra_variables'][i]] = obs_catalogue.files(
+                           obsroot, p['extra_variables'][i], p['frequency'])[0]
                    except:
                        with open('logs/log.txt', 'a') as outfile:
                            outfile.write('No observations file was found for ' + p['extra_variables'][i] + '\n\n')
@@ -561,30 +632,113 @@ def model_files(var, model, expname, frequency, cmipdir):
     prefix = cmipdir + '/' + var + '/'
     ensstring = prefix + var + '_*' + frequency + '_*' + model + '_' + expname + '_*.nc'
     ens = cd.mkensemble(ensstring, prefix=prefix)
-    ens = cd.cat_exp_slices(ens, delete=False, output_prefix='cmipfiles/')
-    mfiles = ens.lister('ncfile')
-    return mfiles, ens
+    return _realization_files(ens.lister('ncfile'))
 
-    
-def model_average(ens, var, model):
-    """ Creates and stores a netCDF file with the average data
-        across the realizations for a given variable, model, and experiment
-        Returns the name of the created file.
+
+def _model_files(key):
+    """ Returns the files of a model, or the error raised looking for
+        them so that found_model_files() can raise it again. cmipdata
+        finds no files without raising, so any error here is a real one.
     """
-    new = 'cmipfiles/' + var + '_' + model + '.nc'
-    
-    # skip if the new file was already made
-    if not os.path.isfile(new):
-        means, stdevs = cd.ens_stats(ens, var)
-        os.rename(means[0], new)
-        os.remove(stdevs[0])
+    try:
+        return model_files(*key)
+    except Exception:
+        return sys.exc_info()
+
+
+def find_models(keys, jobs=8):
+    """ Finds the files of each of the (variable, model, experiment,
+        frequency, cmip directory) not found yet in this run with a pool
+        of jobs threads, so that each model is only looked for once
+    """
+    todo = sorted(set(k for k in keys if k not in _models))
+    if not todo:
+        return
+    pool = ThreadPool(max(min(jobs, len(todo)), 1))
+    try:
+        found = pool.map(_model_files, todo)
+    finally:
+        pool.close()
+        pool.join()
+    _models.update(zip(todo, found))
+
+
+def found_model_files(var, model, expname, frequency, cmipdir):
+    """ Returns the files of a model found by find_models(), finding
+        them now if they were not looked for
+    """
+    key = (var, model, expname, frequency, cmipdir)
+    find_models([key])
+    if isinstance(_models[key], tuple):
+        # the error raised by model_files() with its traceback
+        raise _models[key][0], _models[key][1], _models[key][2]
+    if not _models[key]:
+        raise IOError('No cmip5 files were found for ' + var + ': ' + model)
+    return _models[key]
+
+
+def _model_error(var, model, error):
+    """ Returns the message logged when the cmip5 files of a model can not
+        be used, keeping the error if it was not that none were found
+    """
+    if isinstance(error, IOError):
+        return 'No cmip5 files were found for ' + var + ': ' + model
+    return ('The cmip5 files of ' + var + ': ' + model + ' could not be used: '
+            + type(error).__name__ + ': ' + str(error))
+
+
+def _realization_files(files):
+    """ Returns the file of each realization in a list of cmip files,
+        or the list of its time slices if it has more than one
+    """
+    realizations = {}
+    for f in sorted(files):
+        # the name without the date range
+        realizations.setdefault(f.rsplit('_', 1)[0], []).append(f)
+    realizations = _cat_file_slices(realizations)
+    return [realizations[name] for name in sorted(realizations)]
+
+
+def _ensemble_mean(files, var, expname, frequency, dates, remapf, remapgrid):
+    """ Returns the name of the mean of an ensemble made by ensemble.mean().
+        In a dry run the first member stands in for the mean.
+    """
+    if DRY_RUN:
+        key, new = ensemble.product(files, var, expname, frequency, dates, remapf, remapgrid)
+        if not product_cache.exists(key):
+            SKIPPED.append(('ensmean', new, files))
+        return files[0]
+    new = ensemble.mean(files, var, expname, frequency, dates, remapf, remapgrid)
+    if new is None:
+        raise IOError('None of the files of the ' + var + ' ensemble could be read')
     return new
 
 
+def model_average(files, var, expname, frequency, dates, remapf, remapgrid):
+    """ Returns the name of a netCDF file with the average data
+        across the realizations for a given variable, model, and experiment
+        over the dates and on the grid of a plot. The file is only made once.
+    """
+    key = (repr(files), var, expname, frequency, dates['start_date'], dates['end_date'],
+           remapf, remapgrid)
+    if key not in _averages:
+        try:
+            _averages[key] = _ensemble_mean(files, var, expname, frequency, dates, remapf, remapgrid)
+        except Exception as e:
+            _averages[key] = e
+    if isinstance(_averages[key], Exception):
+        raise _averages[key]
+    return _averages[key]
+
+
 def cmip_files(model_files):
     files = list(model_files.values())
-    allfiles = [item for sublist in files for item in sublist]
-    return list(set(allfiles))
+    allfiles = []
+    for f in [item for sublist in files for item in sublist]:
+        # lists of time slices can not be put in a set
+        if f not in allfiles:
+            allfiles.append(f)
+    return allfiles
 
 
 def get_cmip_average(plots, directory):
@@ -605,55 +759,20 @@ def get_cmip_average(plots, directory):
                 p['cmip5_file'] = None
 
     
-def cmip_average(var, frequency, files, sd, ed, expname):
-    """ Creates and stores a netCDF file with the average data
-        across all the models provided.
-        Returns the name of the created file.
+def cmip_average(var, frequency, files, dates, expname, remapf, remapgrid):
+    """ Returns the name of a netCDF file with the average data
+        across all the models provided over the dates and on the grid
+        of a plot. The file is only made once.
     """
-    averagefiles = traverse(MEANDIR)
-    
-    out = 'ENS-MEAN_cmipfiles/' + var + '_' + 'cmip5.nc'
-    # skip if the new file was already made
-    if not os.path.isfile(out):
-        newfilelist = []
-        newerfilelist = []
-        for f in files:
-            time = f.replace('.nc', '_time.nc')
-            # try to select the date range
-#            try:
-            os.system('cdo -L seldate,' + sd + ',' + ed + ' -selvar,' + var + ' ' + f + ' ' + time)
-#            cdo.seldate(sd+','+ed, options = '-L', input='-selvar,' + var + ' ' + f, output=time)
-#            except:
-                # don't append filename to the list if it was not in the date range
-#                pass
-#            else:
-            newfilelist.append(time)
-        for f in newfilelist:
-            remap = f.replace('.nc', '_remap.nc')
-            
-            # try to remap the files
-            try:
-                cdo.remapdis('r360x180', input=f, output=remap)
-            except:
-                # don't append the filename if it could not be remapped
-                pass
-            else:
-                newerfilelist.append(remap)
-
-        filestring = ' '.join(newerfilelist)
-        
-        # compute the mean across the models
-        cdo.ensmean(input=filestring, output=out)
-    return out
+    return _ensemble_mean(files, var, expname, frequency, dates, remapf, remapgrid)
 
-def getcmipfiles(plots, expname, cmipdir):
+def getcmipfiles(plots, expname, cmipdir, jobs=8):
     """ Loop through the plots and create the comparison files if cdo operations are needed 
         and map the keys in the compare dictionary to the correct file names.
+        The files of every model are found first with a pool of jobs threads.
     """
-    # get the date ranges need for each variable
-    startdates = min_start_dates(plots)
-    enddates = max_end_dates(plots)
-    cmip5_variables = {}  
+    find_models([(p['variable'], model, expname, p['frequency'], cmipdir)
+                 for p in plots for model in p['comp_models'] + p['comp_cmips']], jobs)
     for p in plots:
         p['model_files'] = {}
         p['model_file'] = {}
@@ -663,12 +782,15 @@ def getcmipfiles(plots, expname, cmipdir):
             # map the file names of the comparison files to the model names
             for model in p['comp_models'][:]:
                 try:
-                    p['model_files'][model], ens = model_files(p['variable'], model, expname, p['frequency'], cmipdir)
-                    p['model_file'][model] = model_average(ens, p['variable'], model)
-                except:
+                    p['model_files'][model] = found_model_files(p['variable'], model, expname, p['frequency'], cmipdir)
+                    p['model_file'][model] = model_average(p['model_files'][model], p['variable'],
+                                                           expname, p['frequency'], p['comp_dates'],
+                                                           p['remap'], p['remap_grid'])
+                except Exception as e:
+                    message = _model_error(p['variable'], model, e)
                     with open('logs/log.txt', 'a') as outfile:
-                        outfile.write('No cmip5 files were found for ' + p['variable'] + ': ' + model + '\n\n')
-                    print 'No cmip5 files were found for ' + p['variable'] + ': ' + model
+                        outfile.write(message + '\n\n')
+                    print message
                     p['comp_models'].remove(model)
                     try:
                          p['comp_cmips'].remove(model)
@@ -678,11 +800,12 @@ def getcmipfiles(plots, expname, cmipdir):
             for model in p['comp_cmips'][:]:
                 if model not in p['comp_models']:
                     try:
-                        p['model_files'][model], ens = model_files(p['variable'], model, expname, p['frequency'], cmipdir)
-                    except:
+                        p['model_files'][model] = found_model_files(p['variable'], model, expname, p['frequency'], cmipdir)
+                    except Exception as e:
+                        message = _model_error(p['variable'], model, e)
                         with open('logs/log.txt', 'a') as outfile:
-                            outfile.write('No cmip5 files were found for ' + p['variable'] + ': ' + model + '\n\n')
-                        print 'No cmip5 files were found for ' + p['variable'] + ': ' + model
+                            outfile.write(message + '\n\n')
+                        print message
                         # remove the model from the list if no comparison files were found
                         p['comp_cmips'].remove(model)
 
@@ -696,12 +819,21 @@ def getcmipfiles(plots, expname, cmipdir):
                 for f in p['comp_cmips']:
                     files[f] = p['model_files'][f]                         
                 p['cmip5_files'] = cmip_files(files)
-#                p['cmip5_file'] = cmip_average(p['variable'], p['frequency'], p['cmip5_files'], str(startdates[p['variable']]) + '-01', str(enddates[p['variable']]) + '-01', expname)
             except:
                 p['comp_cmips'] = []
+                continue
+            if p['cmip5_file'] is None and MAKE_CMIP_MEAN:
+                # no mean was found in cmip5_means
+                try:
+                    p['cmip5_file'] = cmip_average(p['variable'], p['frequency'], p['cmip5_files'],
+                                                   p['comp_dates'], expname, p['remap'], p['remap_grid'])
+                except Exception as e:
+                    yamllog.write('WARNING: The cmip5 mean could not be made for ' +
+                                  p['variable'] + ': ' + str(e) + '\n\n')
+                    print 'The cmip5 mean could not be made for ' + p['variable']
 
 
-def cmip(plots, cmipdir, cmipmeandir, expname):
+def cmip(plots, cmipdir, cmipmeandir, expname, jobs=8):
     """ Import the netCDF files if needed
         and call the functions to modify and map the cmip5 files
     """
@@ -709,7 +841,7 @@ def cmip(plots, cmipdir, cmipmeandir, expname):
     MEANDIR = cmipmeandir
     for p in plots:
         if p['comp_cmips'] or p['comp_models']:
-            getcmipfiles(plots, expname, cmipdir)
+            getcmipfiles(plots, expname, cmipdir, jobs)
             break
 
 
@@ -0,0 +1,277 @@
+"""
+dry_run
+===============
+
+This module estimates the work needed to make the plots without
+running cdo, for validate-execute --plan. The files are found with
+directory_tools in its dry run mode, the dataload requests of the plots
+are merged into the same graph of products used by scheduler, and
+the size of the data after every stage is worked out from the headers
+of the input files.
+
+The cost of a stage is the number of values it reads
+(grid points x timesteps x levels), which is only meant to compare
+the products with each other.
+
+.. moduleauthor:: David Fallis
+"""
+import os
+import re
+from netCDF4 import Dataset
+import data_loader as pl
+import numpy_engine as ne
+import directory_tools as dt
+import product_cache as pc
+import scheduler
+import yamllog
+import constants
+
+
+def _files(ifile):
+    """ Returns the time slices of a file, or the file itself
+    """
+    if isinstance(ifile, (list, tuple)):
+        return list(ifile)
+    return [ifile]
+
+
+def _bytes(ifile):
+    return sum(os.path.getsize(f) for f in _files(ifile))
+
+
+def _shape(ifile, var):
+    """ Returns a dictionary with the timesteps, number of levels,
+        horizontal grid size and bytes per value of a variable
+    """
+    times = []
+    for f in _files(ifile):
+        dataset = Dataset(f, 'r')
+        try:
+            ncvar = pl._ncvar(dataset, var)
+            taxis, zaxis = pl._axes(dataset, ncvar)
+            dims = list(ncvar.shape)
+            itemsize = ncvar.dtype.itemsize
+            nz = dims[zaxis] if zaxis is not None else 1
+            horizontal = [n for i, n in enumerate(dims) if i not in [taxis, zaxis]]
+            if taxis is not None:
+                times.extend(pl._timetuples(dataset) or [None] * dims[taxis])
+        finally:
+            dataset.close()
+    horizontal = [1, 1] + horizontal
+    return {'times': times or [None],
+            'nz': nz,
+            'ny': horizontal[-2],
+            'nx': horizontal[-1],
+            'itemsize': itemsize,
+            'files': 1,
+            }
+
+
+def values(shape):
+    """ Returns the number of values in the data
+    """
+    return len(shape['times']) * shape['nz'] * shape['ny'] * shape['nx']
+
+
+def nbytes(shape):
+    """ Returns the estimated number of bytes written for the data
+    """
+    return values(shape) * shape['itemsize'] * shape['files']
+
+
+def _grid_size(remapgrid):
+    """ Returns the number of latitudes and longitudes of the grid
+        the data is remapped to, or None if it is not known
+    """
+    match = re.match(r'^r(\d+)x(\d+)$', remapgrid)
+    if match:
+        return int(match.group(2)), int(match.group(1))
+    try:
+        dataset = Dataset(remapgrid, 'r')
+    except:
+        return None
+    try:
+        lon, lat = pl._lon_lat(dataset)
+    finally:
+        dataset.close()
+    if lon.ndim == 1:
+        return lat.size, lon.size
+    return lon.shape
+
+
+def _timesteps(times, operation, args):
+    """ Returns the timesteps left after a stage
+    """
+    if None in times:
+        return times[:1] if operation in ['climate', 'slope'] else times
+    if operation == 'selseason':
+        return [t for t, keep in zip(times, ne.season_index(times, args[0])) if keep]
+    if operation == 'seldate':
+        index = ne.date_index(times, pl.year_mon_day(args[0]), pl.year_mon_day(args[1]))
+        return [t for t, keep in zip(times, index) if keep]
+    if operation == 'yearmean':
+        years = []
+        for t in times:
+            if t[0] not in [y[0] for y in years]:
+                years.append(t)
+        return years
+    if operation in ['climate', 'slope']:
+        return times[:1]
+    return times
+
+
+def apply(shape, stage):
+    """ Returns the shape of the data after a stage
+    """
+    operation, args = stage
+    shape = dict(shape)
+    shape['times'] = _timesteps(shape['times'], operation, args)
+    if operation == 'remap':
+        grid = _grid_size(args[1])
+        if grid is not None:
+            shape['ny'], shape['nx'] = grid
+    elif operation == 'level':
+        shape['nz'] = len(args[0])
+    elif operation == 'zonmean':
+        shape['nx'] = 1
+    elif operation == 'fldmean':
+        shape['ny'] = 1
+        shape['nx'] = 1
+    # a trend writes the slope and the intercept
+    shape['files'] = 2 if operation == 'slope' else 1
+    return shape
+
+
+def _needed(nodes):
+    """ Returns the keys of the products which have to be computed and the
+        keys of the products which already exist and will be reused
+    """
+    computed = set()
+    reused = set()
+    for key in nodes:
+        if not nodes[key]['final']:
+            continue
+        while key is not None and key not in computed and key not in reused:
+            if pc.exists(key):
+                reused.add(key)
+                break
+            computed.add(key)
+            key = nodes[key]['parent']
+    return computed, reused
+
+
+def products(plots):
+    """ Returns a list with a dictionary for each of the products
+        the plots would make or reuse, giving its status, realm, variable,
+        operation, input and output bytes and cost
+    """
+    found = []
+    for operation, name, inputs in dt.SKIPPED:
+        shapes = [_shape(f, dt.getvariable(pl._first(f))) for f in inputs]
+        inbytes = sum(_bytes(f) for f in inputs)
+        found.append({'status': 'write',
+                      'realm': dt.getrealmcat(dt.getrealm(inputs[0])),
+                      'variable': dt.getvariable(pl._first(inputs[0])),
+                      'operation': operation,
+                      'file': name,
+                      'input_bytes': inbytes,
+                      'output_bytes': nbytes(shapes[0]),
+                      'cost': sum(values(s) for s in shapes),
+                      })
+
+    requests = scheduler.requests(plots)
+    nodes = scheduler.graph(requests)
+    computed, reused = _needed(nodes)
+    if getattr(constants, 'chain_cdo', True):
+        written = scheduler.targets(nodes)
+    else:
+        written = set(nodes)
+    shapes = {}
+    for key in sorted(nodes, key=lambda k: len(nodes[k]['stages'])):
+        node = nodes[key]
+        parent = node['parent']
+        if parent is None:
+            before = _shape(node['file'], node['var'])
+            inbytes = _bytes(node['file'])
+        else:
+            before = shapes[parent]
+            inbytes = nbytes(before)
+        shapes[key] = apply(before, node['stages'][-1])
+        if key not in computed and key not in reused:
+            continue
+        if key in reused:
+            status = 'reuse'
+        elif key in written:
+            status = 'write'
+        else:
+            status = 'chain'
+        found.append({'status': status,
+                      'realm': node['realm'],
+                      'variable': node['var'],
+                      'operation': pl._stage_operator(node['stages'][-1]) or node['stages'][-1][0],
+                      'file': pl.file_name(node['file']),
+                      'input_bytes': inbytes,
+                      'output_bytes': nbytes(shapes[key]) if status == 'write' else 0,
+                      'cost': values(before) if status != 'reuse' else 0,
+                      })
+    return found
+
+
+def totals(found, group):
+    """ Returns a dictionary mapping each value of the group ('realm' or
+        'variable') to the totals of its products
+    """
+    summed = {}
+    for p in found:
+        total = summed.setdefault(p[group], {'computed': 0,
+                                             'reused': 0,
+                                             'input_bytes': 0,
+                                             'output_bytes': 0,
+                                             'cost': 0,
+                                             })
+        if p['status'] == 'reuse':
+            total['reused'] += 1
+        else:
+            total['computed'] += 1
+        for k in ['input_bytes', 'output_bytes', 'cost']:
+            total[k] += p[k]
+    return summed
+
+
+def _mb(n):
+    return str(round(n / (1024. * 1024.), 1))
+
+
+def _table(summed, title):
+    lines = ['Totals per ' + title + ':']
+    for name in sorted(summed):
+        t = summed[name]
+        lines.append('    ' + name.ljust(12) + str(t['computed']).rjust(6) + ' computed' +
+                     str(t['reused']).rjust(6) + ' reused' +
+                     _mb(t['input_bytes']).rjust(12) + ' MB in' +
+                     _mb(t['output_bytes']).rjust(12) + ' MB out' +
+                     str(round(t['cost'] / 1e6, 1)).rjust(12) + ' Mvalues')
+    return '\n'.join(lines) + '\n'
+
+
+def report(plots):
+    """ Prints and logs the products the plots would make and reuse,
+        with totals per realm and per variable
+    """
+    found = products(plots)
+    lines = ['Dry run: ' + str(len(found)) + ' products']
+    for p in found:
+        lines.append('    ' + p['status'].ljust(6) + p['realm'].ljust(8) + p['variable'].ljust(10) +
+                     p['operation'].ljust(24) + _mb(p['input_bytes']).rjust(10) + ' MB in' +
+                     _mb(p['output_bytes']).rjust(10) + ' MB out' +
+                     str(round(p['cost'] / 1e6, 2)).rjust(10) + ' Mvalues  ' + p['file'])
+    text = '\n'.join(lines) + '\n\n'
+    text += _table(totals(found, 'realm'), 'realm') + '\n'
+    text += _table(totals(found, 'variable'), 'variable') + '\n'
+    print text
+    yamllog.write(text)
+    return found
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,250 @@
+"""
+ensemble
+===============
+
+This module makes the mean of an ensemble of files, such as the
+realizations of a model or the models of cmip5, without holding more
+than one member in memory. Every member is cut to the dates and
+remapped to the grid of the plots with the stages of data_loader,
+then added to running sums of the mean, variance, minimum and maximum
+of every point using Welford's method. The members can be split
+between several processes, whose sums are merged at the end.
+
+The result is written to a file holding the mean under the name of the
+variable, and the standard deviation, minimum and maximum under the
+name of the variable followed by '_std', '_min' and '_max'. It is kept in
+the product cache under a key made from the variable, experiment,
+frequency, dates, grid and members, so it is only made once.
+
+.. moduleauthor:: David Fallis
+"""
+import os
+import multiprocessing
+import numpy as np
+from netCDF4 import Dataset
+import data_loader as pl
+import product_cache as pc
+import profiler
+import yamllog
+
+# number of processes to reduce the members with
+jobs = 1
+
+STATISTICS = ['std', 'min', 'max']
+
+
+def add(sums, data):
+    """ Adds a member to the running sums of an ensemble
+
+    Parameters
+    ----------
+    sums : dictionary
+           as returned by add(), or None for the first member
+    data : numpy array
+           masked points are left out
+
+    Returns
+    -------
+    dictionary of the number of members 'n', 'mean', sum of the squared
+    differences from the mean 'm2', 'min' and 'max' of every point
+    """
+    data = np.ma.asarray(data)
+    valid = ~np.ma.getmaskarray(data)
+    values = np.ma.filled(data.astype(float), 0)
+    if sums is None:
+        sums = {'n': np.zeros(data.shape),
+                'mean': np.zeros(data.shape),
+                'm2': np.zeros(data.shape),
+                'min': np.full(data.shape, np.inf),
+                'max': np.full(data.shape, -np.inf),
+                }
+    sums['n'] += valid
+    delta = np.where(valid, values - sums['mean'], 0)
+    sums['mean'] += delta / np.maximum(sums['n'], 1)
+    sums['m2'] += np.where(valid, delta * (values - sums['mean']), 0)
+    sums['min'] = np.where(valid, np.minimum(sums['min'], values), sums['min'])
+    sums['max'] = np.where(valid, np.maximum(sums['max'], values), sums['max'])
+    return sums
+
+
+def merge(first, second):
+    """ Returns the running sums of two parts of an ensemble together
+    """
+    if first is None:
+        return second
+    if second is None:
+        return first
+    n = first['n'] + second['n']
+    delta = second['mean'] - first['mean']
+    share = second['n'] / np.maximum(n, 1)
+    return {'n': n,
+            'mean': first['mean'] + delta * share,
+            'm2': first['m2'] + second['m2'] + delta ** 2 * first['n'] * share,
+            'min': np.minimum(first['min'], second['min']),
+            'max': np.maximum(first['max'], second['max']),
+            }
+
+
+def statistics(sums):
+    """ Returns the mean, standard deviation, minimum and maximum of the
+        ensemble as masked arrays, masked where no member has data
+    """
+    empty = sums['n'] == 0
+    n = np.maximum(sums['n'], 1)
+    found = {'mean': sums['mean'],
+             'std': np.sqrt(sums['m2'] / n),
+             'min': sums['min'],
+             'max': sums['max'],
+             }
+    for k in found:
+        found[k] = np.ma.masked_where(empty, np.where(empty, 0, found[k]))
+    return found
+
+
+def _member(ifile, var, dates, remapf, remapgrid):
+    """ Returns the name of the file with the data of a member
+        in the dates and on the grid of the ensemble
+    """
+    ifile = pl.time_slices(ifile, dates)
+    stages = pl._stages(var, dates, 'atmos', remapf, remapgrid, None, 'full', None,
+                        False, False, None, False, None, {}, pl._check_dates(ifile, dates))
+    return pl.execute(ifile, pl._plan(ifile, var, stages), stages)
+
+
+def _read(name, var):
+    dataset = Dataset(name, 'r')
+    try:
+        return np.ma.asarray(pl._ncvar(dataset, var)[:])
+    finally:
+        dataset.close()
+
+
+def _reduce(job):
+    """ Adds up the members of one part of an ensemble, one at a time
+
+    Returns
+    -------
+    dictionary of the running sums, or None if no member could be read
+    string of the file of the first member, used as the template of the result
+    """
+    members, var, dates, remapf, remapgrid = job
+    sums = None
+    template = None
+    for ifile in members:
+        try:
+            name = _member(ifile, var, dates, remapf, remapgrid)
+            data = _read(name, var)
+        except Exception:
+            yamllog.write('WARNING: ' + pl.file_name(ifile) + ' was left out of the ensemble\n')
+            continue
+        if sums is not None and data.shape != sums['mean'].shape:
+            yamllog.write('WARNING: ' + pl.file_name(ifile) + ' does not have the shape of ' +
+                          'the ensemble and was left out\n')
+            continue
+        sums = add(sums, data)
+        template = template or name
+    return sums, template
+
+
+def _write(template, out, var, found):
+    """ Writes the statistics to a file with the dimensions, coordinates
+        and attributes of the template
+    """
+    source = Dataset(template, 'r')
+    target = Dataset(out, 'w', format=source.file_format)
+    try:
+        target.setncatts(dict((k, source.getncattr(k)) for k in source.ncattrs()))
+        for name, dimension in source.dimensions.iteritems():
+            target.createDimension(name, None if dimension.isunlimited() else len(dimension))
+        ncvar = pl._ncvar(source, var)
+        for name, variable in source.variables.iteritems():
+            if variable is ncvar or name == ncvar.name:
+                continue
+            copy = target.createVariable(name, variable.dtype, variable.dimensions)
+            copy.setncatts(dict((k, variable.getncattr(k)) for k in variable.ncattrs()))
+            copy[:] = variable[:]
+        attributes = dict((k, ncvar.getncattr(k)) for k in ncvar.ncattrs() if k != '_FillValue')
+        for statistic in ['mean'] + STATISTICS:
+            name = var if statistic == 'mean' else var + '_' + statistic
+            result = target.createVariable(name, 'f4', ncvar.dimensions, fill_value=1e20)
+            result.setncatts(attributes)
+            result[:] = found[statistic].reshape(ncvar.shape)
+    finally:
+        source.close()
+        target.close()
+
+
+def product(members, var, experiment, frequency, dates, remapf, remapgrid):
+    """ Returns the key and file name of the mean of an ensemble
+    """
+    return pc.product(list(members), 'ensmean', var, experiment, frequency,
+                      dates['start_date'], dates['end_date'], remapf,
+                      pl._grid_identity(remapgrid))
+
+
+@profiler.profile('cdo')
+def mean(members, var, experiment, frequency, dates, remapf='remapdis', remapgrid='r360x180'):
+    """ Makes the mean of an ensemble, unless it was already made
+
+    Parameters
+    ----------
+    members : list
+              file names, or lists of the time slices of a file
+    var : string
+          variable name
+    experiment : string
+    frequency : string
+    dates : dictionary
+            with the start_date and end_date of the mean
+    remapf : string
+             name of the cdo remapping
+    remapgrid : string
+                grid of the mean
+
+    Returns
+    -------
+    string of the file name of the mean, or None if no member could be read
+    """
+    key, out = product(members, var, experiment, frequency, dates, remapf, remapgrid)
+    found = pl.already_calculated(out, key)
+    if found is not None:
+        return found
+    count = max(min(jobs, len(members)), 1)
+    parts = [(members[i::count], var, dates, remapf, remapgrid) for i in xrange(count)]
+    if count > 1:
+        pool = multiprocessing.Pool(count)
+        try:
+            results = pool.map(_reduce, parts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_reduce(parts[0])]
+    sums = None
+    template = None
+    for part, first in results:
+        if part is None:
+            continue
+        if sums is not None and part['mean'].shape != sums['mean'].shape:
+            yamllog.write('WARNING: Some members of the ' + var + ' ensemble do not have the ' +
+                          'same shape and were left out\n')
+            continue
+        sums = merge(sums, part)
+        template = template or first
+    if sums is None:
+        pc.release(key)
+        return None
+    tmp = out + '.' + str(os.getpid()) + '.tmp'
+    try:
+        _write(template, tmp, var, statistics(sums))
+    except Exception:
+        pl.silent_remove(tmp)
+        pc.release(key)
+        raise
+    os.rename(tmp, out)
+    pc.register(key)
+    return out
+
+
+if __name__ == "__main__":
+    pass
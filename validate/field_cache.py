@@ -0,0 +1,137 @@
+"""
+field_cache
+===============
+
+This module keeps the fields returned by data_loader.dataload
+in memory, so that a field used by several comparisons or depths
+of a plot is only loaded once. The least recently used fields are
+dropped when the total size goes over the budget given by
+'field_cache_size' in conf.yaml (in megabytes).
+
+The cached arrays are shared between the callers and must not
+be modified in place.
+
+"""
+from collections import OrderedDict
+import numpy as np
+import constants
+import yamllog
+
+_fields = OrderedDict()
+_sizes = {}
+stats = {'hits': 0,
+         'misses': 0,
+         'evictions': 0,
+         }
+
+
+def _budget():
+    """ Returns the maximum number of bytes to keep in memory
+    """
+    return int(getattr(constants, 'field_cache_size', 1024) * 1024 * 1024)
+
+
+def _freeze(value):
+    """ Converts a value to something that can be used as a dictionary key
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return tuple(value.tolist())
+    return value
+
+
+def make_key(*args, **kwargs):
+    """ Returns a key made from all of the arguments
+    """
+    return _freeze(args) + _freeze(kwargs)
+
+
+def nbytes(value):
+    """ Returns the number of bytes used by the arrays in a value
+    """
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(v) for v in value)
+    if isinstance(value, np.ma.MaskedArray):
+        return value.data.nbytes + np.ma.getmaskarray(value).nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
+
+
+def size():
+    """ Returns the number of bytes held in the cache
+    """
+    return sum(_sizes.values())
+
+
+def get(key):
+    """ Returns the value stored with the key, or None if it is not stored
+    """
+    try:
+        value = _fields.pop(key)
+    except KeyError:
+        stats['misses'] += 1
+        return None
+    # put the field back as the most recently used
+    _fields[key] = value
+    stats['hits'] += 1
+    return value
+
+
+def put(key, value):
+    """ Stores a value, dropping the least recently used values
+        if the cache would be over budget
+    """
+    budget = _budget()
+    valuesize = nbytes(value)
+    if valuesize > budget:
+        return
+    total = size()
+    while _fields and total + valuesize > budget:
+        oldkey, _ = _fields.popitem(last=False)
+        total -= _sizes.pop(oldkey)
+        stats['evictions'] += 1
+    _fields[key] = value
+    _sizes[key] = valuesize
+
+
+def memoize(key, func, *args, **kwargs):
+    """ Returns the value stored with the key, or calls the function
+        with the arguments and stores the result
+    """
+    value = get(key)
+    if value is None:
+        value = func(*args, **kwargs)
+        put(key, value)
+    return value
+
+
+def clear():
+    _fields.clear()
+    _sizes.clear()
+
+
+def report():
+    """ Returns a summary of the use of the cache
+    """
+    requests = stats['hits'] + stats['misses']
+    if requests:
+        rate = 100. * stats['hits'] / requests
+    else:
+        rate = 0.
+    return ('Field cache: ' + str(stats['hits']) + ' hits, ' + str(stats['misses']) +
+            ' misses (' + str(round(rate, 1)) + '% hit rate), ' + str(stats['evictions']) +
+            ' evictions, ' + str(size() / (1024 * 1024)) + ' MB held\n')
+
+
+def log():
+    """ Writes the summary of the use of the cache to the log
+    """
+    yamllog.write(report())
+
+
+if __name__ == "__main__":
+    pass
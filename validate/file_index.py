@@ -0,0 +1,295 @@
+"""
+file_index
+===============
+
+This module keeps the metadata that directory_tools reads from the
+netCDF files, so that each file is only opened once. Every file is
+listed under its absolute path with the size and modification time it
+had when it was read, and is read again only when either of them has
+changed. The entry holds the variable, frequency, realization, realm,
+experiment, calendar, first and last time and an id of the horizontal
+grid of the file. The dates of files named with a CMIP date range,
+such as _185001-200512.nc, are taken from the name without opening them.
+
+The index is kept between runs in a json file, set with 'index_file'
+in conf.yaml or placed in cache_root. Without either it is only kept in
+memory for the run.
+
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from netCDF4 import Dataset, num2date
+
+# name of the json file the index is kept in, None to keep it in memory
+INDEX = None
+
+# the date range at the end of a CMIP file name, as YYYY[MM[DD[hh[mm]]]]
+_DATES = re.compile(r'_(\d{4,12})-(\d{4,12})\.nc$')
+
+_entries = {}
+_loaded = None
+_changed = False
+_lock = threading.Lock()
+
+stats = {'read': 0,
+         'reused': 0,
+         }
+
+
+def set_file(name):
+    """ Keeps the index in a file between runs
+    """
+    global INDEX
+    INDEX = name
+
+
+def from_json(value):
+    """ Returns a value read from json with its unicode strings made str,
+        so that the names and attributes read from the file are the same
+        type as those read in the run
+    """
+    if isinstance(value, dict):
+        return dict((from_json(k), from_json(v)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [from_json(v) for v in value]
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def load():
+    """ Reads the index file if it has not been read yet
+    """
+    global _loaded
+    if _loaded == INDEX:
+        return
+    _loaded = INDEX
+    _entries.clear()
+    if INDEX is None:
+        return
+    try:
+        with open(INDEX, 'r') as f:
+            _entries.update(from_json(json.load(f)))
+    except (IOError, ValueError):
+        pass
+
+
+def save():
+    """ Writes the index file if any of the entries changed
+    """
+    global _changed
+    if INDEX is None or not _changed:
+        return
+    directory = os.path.dirname(INDEX)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = INDEX + '.tmp'
+    with _lock:
+        with open(tmp, 'w') as outfile:
+            json.dump(_entries, outfile)
+        _changed = False
+    # replace the file at once so that other runs never read half of it
+    os.rename(tmp, INDEX)
+
+
+def _attribute(nc, name):
+    try:
+        return str(nc.getncattr(name))
+    except AttributeError:
+        return None
+
+
+def _date(value, nc_time, calendar):
+    date = num2date(value, nc_time.units, calendar)
+    return [date.year, date.month, date.day]
+
+
+def _grid(nc):
+    """ Returns an id of the horizontal grid made from the shape and the
+        first and last values of its coordinates, so that only the header
+        and two values of each coordinate are read
+    """
+    h = hashlib.sha1()
+    for names in [('lon', 'x'), ('lat', 'y')]:
+        for name in names:
+            if name in nc.variables:
+                coordinate = nc.variables[name]
+                h.update(str(coordinate.shape))
+                if coordinate.size:
+                    h.update(str(coordinate[(0,) * coordinate.ndim]))
+                    h.update(str(coordinate[(-1,) * coordinate.ndim]))
+                break
+    return h.hexdigest()[:16]
+
+
+def read(name):
+    """ Returns the metadata of a file, read from its header and
+        the ends of its coordinates
+    """
+    nc = Dataset(name, 'r')
+    try:
+        entry = {'variable': os.path.basename(name).split('_', 1)[0],
+                 'frequency': _attribute(nc, 'frequency'),
+                 'realization': _attribute(nc, 'realization'),
+                 'realm': _attribute(nc, 'modeling_realm'),
+                 'experiment': _attribute(nc, 'experiment'),
+                 'calendar': None,
+                 'start': None,
+                 'end': None,
+                 'grid': _grid(nc),
+                 }
+        if 'time' in nc.variables and len(nc.variables['time']) > 0:
+            nc_time = nc.variables['time']
+            try:
+                calendar = nc_time.calendar
+            except AttributeError:
+                calendar = 'standard'
+            entry['calendar'] = calendar
+            entry['start'] = _date(nc_time[0], nc_time, calendar)
+            entry['end'] = _date(nc_time[-1], nc_time, calendar)
+    finally:
+        nc.close()
+    return entry
+
+
+def lookup(name):
+    """ Returns the metadata of a file, reading the file only if it is not
+        in the index or has changed since it was read
+    """
+    load()
+    path = os.path.abspath(name)
+    st = os.stat(path)
+    entry = _entries.get(path)
+    if _current(entry, st):
+        stats['reused'] += 1
+        return entry
+    return _store(path, st, read(path))
+
+
+def _current(entry, st):
+    return entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime
+
+
+def _store(path, st, entry):
+    global _changed
+    entry['size'] = st.st_size
+    entry['mtime'] = st.st_mtime
+    with _lock:
+        _entries[path] = entry
+        _changed = True
+    stats['read'] += 1
+    return entry
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _read(path):
+    """ Same as read(), but returns None for a file that can not be read
+    """
+    try:
+        return read(path)
+    except Exception:
+        return None
+
+
+def scan(names, jobs=8):
+    """ Adds the files which are not in the index, or have changed, to the
+        index. The files are checked by a pool of jobs threads and the
+        headers are read by a pool of jobs processes, since the netCDF
+        library can not read files from several threads at once.
+        Files which can not be read are left out, so that lookup()
+        raises the same error as before.
+
+    Returns
+    -------
+    int of the number of files read
+    """
+    load()
+    jobs = max(jobs, 1)
+    paths = [os.path.abspath(name) for name in names]
+    threads = ThreadPool(jobs)
+    try:
+        found = threads.map(_stat, paths)
+    finally:
+        threads.close()
+        threads.join()
+    stale = [(path, st) for path, st in zip(paths, found)
+             if st is not None and not _current(_entries.get(path), st)]
+    if jobs > 1 and len(stale) > 1:
+        processes = multiprocessing.Pool(min(jobs, len(stale)))
+        try:
+            entries = processes.map(_read, [path for path, _ in stale])
+        finally:
+            processes.close()
+            processes.join()
+    else:
+        entries = [_read(path) for path, _ in stale]
+    # stored in the order of the files so that the index is the same every time
+    count = 0
+    for (path, st), entry in zip(stale, entries):
+        if entry is not None:
+            _store(path, st, entry)
+            count += 1
+    return count
+
+
+def _stamp(text, end):
+    """ Returns the (year, month, day) of a date in a file name. The parts
+        which are left out are the first or the last of the year or month.
+    """
+    if len(text) % 2:
+        raise ValueError(text)
+    year = int(text[:4])
+    month = int(text[4:6]) if len(text) >= 6 else (12 if end else 1)
+    day = int(text[6:8]) if len(text) >= 8 else (31 if end else 1)
+    if not 1 <= month <= 12 or not 1 <= day <= 31:
+        raise ValueError(text)
+    return year, month, day
+
+
+def name_dates(name):
+    """ Returns the (year, month, day) of the start and end of the date range
+        in the name of a file, or None if the name does not have one
+    """
+    match = _DATES.search(os.path.basename(name))
+    if match is None:
+        return None
+    try:
+        return _stamp(match.group(1), False), _stamp(match.group(2), True)
+    except ValueError:
+        return None
+
+
+def span(name):
+    """ Returns the (year, month, day) of the first and last times of a file,
+        from its name if it has a date range, otherwise from the index.
+        The dates are None if the file has no time axis.
+    """
+    dates = name_dates(name)
+    if dates is not None:
+        return dates
+    entry = lookup(name)
+    if entry['start'] is None:
+        return None, None
+    return tuple(entry['start']), tuple(entry['end'])
+
+
+def report():
+    """ Returns a summary of the use of the index
+    """
+    return ('File index: ' + str(stats['read']) + ' files read, ' +
+            str(stats['reused']) + ' found in the index\n')
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,210 @@
+"""
+numpy_engine
+===============
+
+This module contains numpy versions of the cdo operations used
+by data_loader. They work on arrays which are already in memory
+so that no intermediate netCDF files have to be written. The
+first axis of the arrays is always the time axis.
+
+"""
+
+import datetime
+import numpy as np
+
+SEASON_LETTERS = 'JFMAMJJASOND'
+
+
+def season_months(season):
+    """ Returns the list of month numbers in a season named by the
+        first letters of consecutive months, ex. 'DJF' or 'JJAS'
+    """
+    if season == 'ANN':
+        return range(1, 13)
+    letters = SEASON_LETTERS + SEASON_LETTERS
+    start = letters.find(season)
+    if start < 0:
+        raise ValueError(season + ' is not a valid season')
+    return [(start + i) % 12 + 1 for i in xrange(len(season))]
+
+
+def season_index(timetuples, seasonlist):
+    """ Returns a boolean array which is True for the timesteps
+        that fall within any of the seasons
+    """
+    months = []
+    for s in seasonlist:
+        months.extend(season_months(s))
+    return np.array([t[1] in months for t in timetuples], dtype=bool)
+
+
+def date_index(timetuples, start, end):
+    """ Returns a boolean array which is True for the timesteps between
+        the start and end date. The end date is inclusive of the whole
+        day, which matches the behaviour of cdo seldate.
+
+    Parameters
+    ----------
+    timetuples : list of tuples
+                 (year, month, day, hour, minute, second) of each timestep
+    start : tuple
+            (year, month, day)
+    end : tuple
+          (year, month, day)
+    """
+    start = tuple(start) + (0, 0, 0)
+    end = tuple(end) + (23, 59, 59)
+    return np.array([start <= tuple(t) <= end for t in timetuples], dtype=bool)
+
+
+def time_mean(data):
+    """ Returns the mean over the time axis keeping the time axis
+    """
+    return np.ma.mean(data, axis=0)[np.newaxis, ...]
+
+
+def year_mean(data, timetuples):
+    """ Returns the annual means of the data and the time tuple
+        of the first timestep in each year
+    """
+    years = np.array([t[0] for t in timetuples])
+    means = []
+    times = []
+    for year in np.unique(years):
+        ind = np.where(years == year)[0]
+        means.append(np.ma.mean(data[ind], axis=0))
+        times.append(timetuples[ind[0]])
+    return np.ma.array(means), times
+
+
+def _ols(data):
+    """ Returns the slope and intercept of an ordinary least squares fit
+        against the timestep index, ignoring masked values in each cell.
+    """
+    data = np.ma.masked_invalid(data)
+    nt = data.shape[0]
+    t = np.arange(nt, dtype=float).reshape((nt,) + (1,) * (data.ndim - 1))
+    valid = (~np.ma.getmaskarray(data)).astype(float)
+    y = data.filled(0.)
+    n = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tbar = (valid * t).sum(axis=0) / n
+        ybar = (valid * y).sum(axis=0) / n
+        tanom = valid * (t - tbar)
+        slope = (tanom * (y - ybar)).sum(axis=0) / (tanom * tanom).sum(axis=0)
+    intercept = ybar - slope * tbar
+    slope = np.ma.masked_invalid(slope)
+    intercept = np.ma.masked_invalid(intercept)
+    return slope, intercept
+
+
+def trend(data):
+    """ Returns the slope per timestep of the data keeping the time axis
+    """
+    slope, _ = _ols(data)
+    return slope[np.newaxis, ...]
+
+
+def detrend(data):
+    """ Returns the residuals of the data from its linear trend
+    """
+    _, _, residuals = trend_fit(data)
+    return residuals
+
+
+def trend_fit(data):
+    """ Returns the slope per timestep, the intercept and the residuals
+        of a linear fit to the data along the time axis
+    """
+    slope, intercept = _ols(data)
+    nt = data.shape[0]
+    t = np.arange(nt, dtype=float).reshape((nt,) + (1,) * (data.ndim - 1))
+    return slope, intercept, data - (intercept + slope * t)
+
+
+def intlevel(data, levels, zaxis, newlevels):
+    """ Linearly interpolates the data to new levels along the z axis.
+        Values outside of the original levels are set to those of the
+        nearest level.
+
+    Parameters
+    ----------
+    data : numpy array
+    levels : numpy array
+             the levels of the z axis of the data
+    zaxis : int
+            index of the z axis
+    newlevels : list of floats
+
+    Returns
+    -------
+    numpy array
+    """
+    levels = np.asarray(levels, dtype=float)
+    newlevels = np.asarray(newlevels, dtype=float)
+    order = np.argsort(levels)
+    levels = levels[order]
+    data = np.ma.take(data, order, axis=zaxis)
+    if len(levels) == 1:
+        return np.ma.take(data, np.zeros(len(newlevels), dtype=int), axis=zaxis)
+    clipped = np.clip(newlevels, levels[0], levels[-1])
+    upper = np.clip(np.searchsorted(levels, clipped), 1, len(levels) - 1)
+    lower = upper - 1
+    weight = (clipped - levels[lower]) / (levels[upper] - levels[lower])
+    shape = [1] * data.ndim
+    shape[zaxis] = len(newlevels)
+    weight = weight.reshape(shape)
+    below = np.ma.take(data, lower, axis=zaxis)
+    above = np.ma.take(data, upper, axis=zaxis)
+    return below * (1 - weight) + above * weight
+
+
+def zonal_mean(data):
+    """ Returns the mean over the longitude (last) axis keeping the axis
+    """
+    return np.ma.mean(data, axis=-1)[..., np.newaxis]
+
+
+def grid_weights(lon, lat):
+    """ Returns the area weights of a regular longitude-latitude grid
+        normalized to sum to one, as given by cdo gridweights.
+    """
+    lon = np.atleast_1d(lon)
+    lat = np.atleast_1d(lat)
+    if lat.ndim > 1:
+        weights = np.cos(np.deg2rad(lat))
+        return weights / weights.sum()
+    if lat.size > 1:
+        edges = np.concatenate(([lat[0] - (lat[1] - lat[0]) / 2.],
+                                (lat[1:] + lat[:-1]) / 2.,
+                                [lat[-1] + (lat[-1] - lat[-2]) / 2.]))
+        edges = np.clip(edges, -90, 90)
+        latweights = np.abs(np.diff(np.sin(np.deg2rad(edges))))
+    else:
+        latweights = np.ones(1)
+    weights = latweights[:, np.newaxis] * np.ones(lon.size)[np.newaxis, :]
+    return weights / weights.sum()
+
+
+def field_mean(data, weights):
+    """ Returns the area weighted mean over the last two axes
+        keeping the axes
+    """
+    data = np.ma.asarray(data)
+    weights = np.broadcast_to(weights, data.shape)
+    valid = ~np.ma.getmaskarray(data)
+    total = (data.filled(0.) * weights * valid).sum(axis=(-2, -1))
+    norm = (weights * valid).sum(axis=(-2, -1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.ma.masked_invalid(total / norm)
+    return mean[..., np.newaxis, np.newaxis]
+
+
+def to_datetimes(timetuples):
+    """ Converts a list of time tuples to an array of datetime objects
+    """
+    return np.array([datetime.datetime(*t[:6]) for t in timetuples])
+
+
+if __name__ == "__main__":
+    pass
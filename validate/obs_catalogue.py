@@ -0,0 +1,178 @@
+"""
+obs_catalogue
+===============
+
+This module keeps a catalogue of the observations, so that the
+observations directory does not have to be walked in every run. Each
+dataset (a directory of observations_root) is listed with the
+modification times of its directories and its files grouped by the
+variable in their names. A dataset is only listed again when one of
+its directories has changed, and only the datasets named in
+'comp_obs' or 'extra_obs' of a plot are looked at.
+
+The frequency, time coverage and grid of the files are read through
+file_index, only for the variables asked for.
+
+The catalogue is kept between runs in a json file, set with
+'catalogue_file' in conf.yaml or placed in cache_root. Without either
+it is only kept in memory for the run.
+
+.. moduleauthor:: David Fallis
+"""
+import os
+import json
+import threading
+import file_index
+
+# name of the json file the catalogue is kept in, None to keep it in memory
+CATALOGUE = None
+
+_datasets = {}
+_loaded = None
+_changed = False
+_lock = threading.Lock()
+
+stats = {'listed': 0,
+         'reused': 0,
+         }
+
+
+def set_file(name):
+    """ Keeps the catalogue in a file between runs
+    """
+    global CATALOGUE
+    CATALOGUE = name
+
+
+def load():
+    """ Reads the catalogue file if it has not been read yet
+    """
+    global _loaded
+    if _loaded == CATALOGUE:
+        return
+    _loaded = CATALOGUE
+    _datasets.clear()
+    if CATALOGUE is None:
+        return
+    try:
+        with open(CATALOGUE, 'r') as f:
+            _datasets.update(file_index.from_json(json.load(f)))
+    except (IOError, ValueError):
+        pass
+
+
+def save():
+    """ Writes the catalogue file if any of the datasets were listed again
+    """
+    global _changed
+    if CATALOGUE is None or not _changed:
+        return
+    directory = os.path.dirname(CATALOGUE)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = CATALOGUE + '.tmp'
+    with _lock:
+        with open(tmp, 'w') as outfile:
+            json.dump(_datasets, outfile)
+        _changed = False
+    os.rename(tmp, CATALOGUE)
+
+
+def _list(root):
+    """ Returns the modification times of a directory and its
+        subdirectories, and its files grouped by variable in the
+        order they are walked
+    """
+    directories = {}
+    files = {}
+    for dirname, subdirlist, filelist in os.walk(root):
+        subdirlist.sort()
+        directories[dirname] = os.stat(dirname).st_mtime
+        for f in sorted(filelist):
+            files.setdefault(f.split('_', 1)[0], []).append(dirname + '/' + f)
+    return {'directories': directories, 'files': files}
+
+
+def _current(entry):
+    """ Returns True if none of the directories of a dataset have changed.
+        Adding or removing a file changes the directory it is in.
+    """
+    for name, mtime in entry['directories'].iteritems():
+        try:
+            if os.stat(name).st_mtime != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def dataset(root):
+    """ Returns the files of a dataset grouped by variable, listing
+        the directory only if it is new or has changed
+
+    Parameters
+    ----------
+    root : string
+           directory of the dataset
+
+    Returns
+    -------
+    dictionary mapping the variable names to lists of files
+    """
+    global _changed
+    load()
+    path = os.path.abspath(root)
+    entry = _datasets.get(path)
+    if entry is not None and _current(entry):
+        stats['reused'] += 1
+        return entry['files']
+    # named the same as traverse() would name them
+    entry = _list(root)
+    with _lock:
+        _datasets[path] = entry
+        _changed = True
+    stats['listed'] += 1
+    return entry['files']
+
+
+def entries(root, variable):
+    """ Returns the file, frequency, time coverage and grid of each of the
+        files of a variable in a dataset
+    """
+    found = []
+    for name in dataset(root).get(variable, []):
+        try:
+            entry = file_index.lookup(name)
+            start, end = file_index.span(name)
+        except Exception:
+            entry, start, end = {}, None, None
+        found.append({'file': name,
+                      'frequency': entry.get('frequency'),
+                      'start': start,
+                      'end': end,
+                      'grid': entry.get('grid'),
+                      })
+    return found
+
+
+def files(root, variable, frequency=None):
+    """ Returns the files of a variable in a dataset in the order they
+        are listed, with the files of the frequency first. The files are
+        only opened if there is more than one to choose from.
+    """
+    names = dataset(root).get(variable, [])
+    if frequency is None or len(names) < 2:
+        return list(names)
+    same = [e['file'] for e in entries(root, variable) if e['frequency'] == frequency]
+    return same + [name for name in names if name not in same]
+
+
+def report():
+    """ Returns a summary of the use of the catalogue
+    """
+    return ('Observation catalogue: ' + str(stats['listed']) + ' datasets listed, ' +
+            str(stats['reused']) + ' found in the catalogue\n')
+
+
+if __name__ == "__main__":
+    pass
@@ -8,8 +8,10 @@ in an organized and labelled format specific to model plots.
 """
 import subprocess
 import os
+import profiler
 
 
+@profiler.profile('output')
 def arrange(plotnames):
     """ Outputs a pdf named plots/joined.pdf with all of the plots
         organized and bookmarked
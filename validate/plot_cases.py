@@ -11,6 +11,10 @@ to the correct plot.
 """
 
 import data_loader as pl
+import numpy_engine as ne
+import field_cache as fc
+import yamllog
+import profiler
 import projections as pr
 import numpy as np
 from numpy import mean, sqrt, square
@@ -69,12 +73,13 @@ def _depth_data(data, depth, plot):
         plot['plot_depth'] = None
     return data
 
-def _full_depth_data(data, depth, plot):
-    if data.ndim > 3:
-        depth_ind = np.where(np.round(depth) == np.round(plot['plot_depth']))[0][0]
-        data = data[:, depth_ind, :, :]
-    return data
-
+def _plot_levels(plot):
+    """ Returns the list of depths to read for a plot at a single depth,
+        or None if all of the depths are needed
+    """
+    if plot.get('is_depth') and plot.get('depth') not in [None, ""]:
+        return [plot['depth']]
+    return None
 
 def _section_data(data, plot):
     """ Averages the data for each latitude
@@ -97,7 +102,7 @@ def _section_data(data, plot):
         elif data.ndim == 2:
             zonmean = data.mean(axis=1)
     except:
-        print 'proc_plot cannot zonal mean for section ' + plot['ifile'] + ' ' + plot['variable']
+        print 'proc_plot cannot zonal mean for section ' + pl.file_name(plot['ifile']) + ' ' + plot['variable']
         return data
     return zonmean
 
@@ -159,6 +164,7 @@ def _fill_colormap(plot):
     except KeyError:
         pass   
 
+@profiler.profile('output')
 def savefigures(plotname, png=False, pdf=False, **kwargs):
     pdfname = plotname + '.pdf'
     pngname = plotname + '.png'
@@ -224,6 +230,7 @@ def stats(plot, data, weights=None, rmse=False):
     label = '  '.join(val)
     return label
     
+@profiler.profile('plot')
 def colormap(plot):
     """ Loads and plots the data for a time averaged map
 
@@ -238,15 +245,20 @@ def colormap(plot):
     """
     print 'plotting map of ' + plot['variable']
     # load data from netcdf file
-    data, lon, lat, depth, units, _, weights = pl.dataload(plot['ifile'], plot['variable'], 
-                                          plot['dates'], realm=plot['realm_cat'], 
-                                          scale=plot['scale'], shift=plot['shift'], 
-                                          remapf=plot['remap'], remapgrid=plot['remap_grid'], 
-                                          seasons=plot['seasons'], datatype=plot['data_type'],
-                                          cdostring=plot['cdostring'],
-                                          gridweights = True,
-                                          external_function=plot['external_function'],
-                                          external_function_args=plot['external_function_args'])
+    if plot['sigma'] and plot['data_type'] == 'trends':
+        data, _, siggrid, lon, lat, depth, units, weights = trend_product(plot, plot['ifile'],
+                                          plot['dates'], plot['scale'], plot['shift'], plot['seasons'])
+    else:
+        data, lon, lat, depth, units, _, weights = pl.dataload(plot['ifile'], plot['variable'], 
+                                              plot['dates'], realm=plot['realm_cat'], 
+                                              scale=plot['scale'], shift=plot['shift'], 
+                                              remapf=plot['remap'], remapgrid=plot['remap_grid'], 
+                                              seasons=plot['seasons'], datatype=plot['data_type'],
+                                              cdostring=plot['cdostring'],
+                                              gridweights = True,
+                                              external_function=plot['external_function'],
+                                              external_function_args=plot['external_function_args'],
+                                              levels=_plot_levels(plot))
 
     if plot['data_type'] == 'trends':
         data, units = _trend_units(data, units, plot)
@@ -256,13 +268,7 @@ def colormap(plot):
     data = _depth_data(data, depth, plot)
 
     if plot['sigma'] and plot['data_type'] == 'trends':
-        detrenddata, _, _, _, _, _, _ = pl.dataload(plot['ifile'], plot['variable'],
-                                         plot['dates'], realm=plot['realm_cat'],
-                                         scale=plot['scale'], shift=plot['shift'],
-                                         remapf=plot['remap'], remapgrid=plot['remap_grid'],
-                                         seasons=plot['seasons'], datatype='detrend')
-        detrenddata = _full_depth_data(detrenddata, depth, plot)
-        siggrid = trend_significance(detrenddata, plot['sigma'])
+        siggrid = _depth_data(siggrid, depth, plot)
         cvalues, _ = _trend_units(siggrid, units, plot)
     else:
         cvalues = None 
@@ -289,10 +295,10 @@ def ttest(data1, data2):
         t, p = sp.stats.ttest_ind(data1, data2, axis=0, equal_var=False)
         return p
     else:
-        with open('logs/log.txt', 'a') as outfile:
-            outfile.write('Significance could not be calculated.\n')        
+        yamllog.write('Significance could not be calculated.\n')
     return None
 
+@profiler.profile('plot')
 def colormap_comparison(plot):
     """ Loads and plots the data for a time averaged map.
         Loads and plots the data for comparison and plots the
@@ -308,26 +314,37 @@ def colormap_comparison(plot):
     string : name of the plot
     """
     print 'plotting comparison map of ' + plot['variable']
+    significance = plot['sigma'] and plot['data_type'] == 'trends'
     # load data from netcdf file
-    data, lon, lat, depth, units, _, weights = pl.dataload(plot['ifile'], plot['variable'], 
-                                          plot['dates'], realm=plot['realm_cat'], 
-                                          scale=plot['scale'], shift=plot['shift'], 
-                                          remapf=plot['remap'], remapgrid=plot['remap_grid'], 
-                                          seasons=plot['seasons'], datatype=plot['data_type'],
-                                          cdostring=plot['cdostring'], gridweights=True,
-                                          external_function=plot['external_function'],
-                                          external_function_args=plot['external_function_args'])
+    if significance:
+        data, _, siggrid, lon, lat, depth, units, weights = trend_product(plot, plot['ifile'],
+                                          plot['dates'], plot['scale'], plot['shift'], plot['seasons'])
+    else:
+        data, lon, lat, depth, units, _, weights = pl.dataload(plot['ifile'], plot['variable'], 
+                                              plot['dates'], realm=plot['realm_cat'], 
+                                              scale=plot['scale'], shift=plot['shift'], 
+                                              remapf=plot['remap'], remapgrid=plot['remap_grid'], 
+                                              seasons=plot['seasons'], datatype=plot['data_type'],
+                                              cdostring=plot['cdostring'], gridweights=True,
+                                              external_function=plot['external_function'],
+                                              external_function_args=plot['external_function_args'],
+                                              levels=_plot_levels(plot))
     data = _depth_data(data, depth, plot)
 
-    data2, _, _, _, _, _, _ = pl.dataload(plot['comp_file'], plot['variable'], 
-                                        plot['comp_dates'], realm=plot['realm_cat'], 
-                                        scale=plot['comp_scale'], shift=plot['comp_shift'], 
-                                        remapf=plot['remap'], remapgrid=plot['remap_grid'], 
-                                        seasons=plot['comp_seasons'], datatype=plot['data_type'],
-                                        cdostring=plot['cdostring'],
-                                        external_function=plot['external_function'],
-                                        external_function_args=plot['external_function_args'],
-                                        depthneeded=[plot['plot_depth']])
+    if significance:
+        data2, _, sig2grid, _, _, _, _, _ = trend_product(plot, plot['comp_file'], plot['comp_dates'],
+                                          plot['comp_scale'], plot['comp_shift'], plot['comp_seasons'],
+                                          depthneeded=[plot['plot_depth']])
+    else:
+        data2, _, _, _, _, _, _ = pl.dataload(plot['comp_file'], plot['variable'], 
+                                            plot['comp_dates'], realm=plot['realm_cat'], 
+                                            scale=plot['comp_scale'], shift=plot['comp_shift'], 
+                                            remapf=plot['remap'], remapgrid=plot['remap_grid'], 
+                                            seasons=plot['comp_seasons'], datatype=plot['data_type'],
+                                            cdostring=plot['cdostring'],
+                                            external_function=plot['external_function'],
+                                            external_function_args=plot['external_function_args'],
+                                            depthneeded=[plot['plot_depth']])
     
     if plot['data_type'] == 'trends':
         data, units = _trend_units(data, units, plot)
@@ -351,23 +368,10 @@ def colormap_comparison(plot):
     else:
         pvalues = None
     
-    if plot['sigma'] and plot['data_type'] == 'trends':
-        detrenddata, _, _, _, _, _, _ = pl.dataload(plot['ifile'], plot['variable'],
-                                         plot['dates'], realm=plot['realm_cat'],
-                                         scale=plot['scale'], shift=plot['shift'],
-                                         remapf=plot['remap'], remapgrid=plot['remap_grid'],
-                                         seasons=plot['seasons'], datatype='detrend')
-        detrenddata = _full_depth_data(detrenddata, depth, plot)
-        siggrid = trend_significance(detrenddata, plot['sigma'])
+    if significance:
+        siggrid = _depth_data(siggrid, depth, plot)
         cvalues, _ = _trend_units(siggrid, units, plot)
-        detrenddata, _, _, _, _, _, _ = pl.dataload(plot['comp_file'], plot['variable'],
-                                         plot['comp_dates'], realm=plot['realm_cat'],
-                                         scale=plot['comp_scale'], shift=plot['comp_shift'],
-                                         remapf=plot['remap'], remapgrid=plot['remap_grid'],
-                                         seasons=plot['comp_seasons'], datatype='detrend')
-        detrenddata = _full_depth_data(detrenddata, depth, plot)
-        siggrid = trend_significance(detrenddata, plot['sigma'])
-        c2values, _ = _trend_units(siggrid, units, plot)        
+        c2values, _ = _trend_units(sig2grid, units, plot)
     else:
         cvalues = None 
         c2values = None
@@ -405,6 +409,7 @@ def colormap_comparison(plot):
     return plot_name
 
 
+@profiler.profile('plot')
 def section(plot):
     """ Loads and plots the data for a time average section map.
 
@@ -450,6 +455,7 @@ def section(plot):
     return plot_name
 
 
+@profiler.profile('plot')
 def section_comparison(plot):
     """ Loads and plots the data for a time averaged section map.
         Loads and plots the data for comparison and plots the
@@ -521,7 +527,8 @@ def section_comparison(plot):
          pcolor_args=plot['data2']['pcolor_args'], cblabel=units, cbaxis=plt.subplot(gs[1, 1]))
     pr.section(lat, depth, compdata, anom=True, rmse=True, pvalues=pvalues, 
          alpha=plot['alpha'], plot=plot, ax=plt.subplot(gs[2, 0]), ax_args=plot['comp']['ax_args'],
-         pcolor_args=plot['comp']['pcolor_args'], cblabel=units, cbaxis=plt.subplot(gs[2, 1]))
+         pcolor_args=plot['comp']['pcolor_args'], cblabel=units, cbaxis=plt.subplot(gs[2, 1]),
+         stipple_density=plot['plot_args'].get('stipple_density', (1, 4)))
 
     plt.tight_layout()
     plot_name = plotname(plot)
@@ -555,35 +562,115 @@ def _trend_units(data, units, plot):
     units = units + '/decade'
     return data, units
 
-def trend_significance(residuals, sigma=0.05):
-    nt = len(residuals)
-    count = 0
-    x = len(residuals[0, :, 0])
-    y = len(residuals[0, 0, :])
-    rcorrs = np.empty(shape=[x, y])
-    for (i,j), value in np.ndenumerate(rcorrs):
-        count += 1
-        r_corr,_ = sp.stats.pearsonr(residuals[: -1, i, j], residuals[1:, i, j])
-        if r_corr < 0:
-            r_corr = 0
-        rcorrs[i][j] = r_corr
-    
-    cs = np.empty(shape=[x, y])    
-    for (i,j), rcor in np.ndenumerate(rcorrs):
-        neff = float(nt * (1-rcor) / (1 + rcor))
-        #neff = nt
-        a = residuals[:,i,j]
-        b = a * a
-        d = sum(b)
-        se = np.sqrt( d / ( neff - 2 ) )
-        sb = se / np.sqrt( sum( ( np.arange(nt) - np.mean( np.arange(nt) ) )**2 ) )
+def trend_product(plot, ifile, dates, scale, shift, seasons, depthneeded=None):
+    """ Returns the trend of a field, its intercept, and the smallest
+        significant trend at each grid cell from a single load of the
+        time series. The result is kept in the field cache.
+
+    Parameters
+    ----------
+    plot : dictionary
+    ifile : string
+            name of the file
+    dates : dictionary
+    scale : float
+    shift : float
+    seasons : list of strings
+    depthneeded : list of floats
+                  depths to interpolate the data to. If it is None
+                  only the depth of the plot is read.
 
-        tcrit = sp.stats.t.isf(sigma/2.0, nt - 2 )
+    Returns
+    -------
+    numpy array of the slope per timestep
+    numpy array of the intercept
+    numpy array of the significance grid
+    numpy array of longitudes
+    numpy array of latitudes
+    numpy array of depths
+    string of the units
+    numpy array of the area weights
+    """
+    levels = _plot_levels(plot) if depthneeded is None else None
+    key = fc.make_key('trend', ifile, plot['variable'], dates, plot['realm_cat'], scale, shift,
+                      plot['remap'], plot['remap_grid'], seasons, plot['cdostring'],
+                      plot['external_function'], plot['external_function_args'],
+                      depthneeded, levels, plot['sigma'])
+    return fc.memoize(key, _trend_product, plot, ifile, dates, scale, shift, seasons,
+                      depthneeded, levels)
+
+def _trend_product(plot, ifile, dates, scale, shift, seasons, depthneeded, levels):
+    data, lon, lat, depth, units, _, weights = pl.dataload(ifile, plot['variable'],
+                                          dates, realm=plot['realm_cat'],
+                                          scale=scale, shift=shift,
+                                          remapf=plot['remap'], remapgrid=plot['remap_grid'],
+                                          seasons=seasons, datatype='full',
+                                          cdostring=plot['cdostring'], gridweights=True,
+                                          external_function=plot['external_function'],
+                                          external_function_args=plot['external_function_args'],
+                                          depthneeded=depthneeded, levels=levels,
+                                          cache=False)
+    # the full series is only needed here, so it is not kept in the field cache
+    slope, intercept, residuals = ne.trend_fit(data)
+    del data
+    siggrid = trend_significance(residuals, plot['sigma'])
+    del residuals
+    return slope, intercept, siggrid, lon, lat, depth, units, weights
+
+def _lag1_autocorrelation(residuals):
+    """ Returns the correlation of each series along the first axis with
+        itself one timestep later, using only the pairs where both
+        values are valid
+    """
+    x = residuals[:-1]
+    y = residuals[1:]
+    valid = ~(np.ma.getmaskarray(x) | np.ma.getmaskarray(y))
+    n = valid.sum(axis=0)
+    x = np.where(valid, x.filled(0.), 0.)
+    y = np.where(valid, y.filled(0.), 0.)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xanom = np.where(valid, x - x.sum(axis=0) / n, 0.)
+        yanom = np.where(valid, y - y.sum(axis=0) / n, 0.)
+        r = (xanom * yanom).sum(axis=0) / np.sqrt((xanom ** 2).sum(axis=0) * (yanom ** 2).sum(axis=0))
+    return np.ma.masked_invalid(r)
+
+def trend_significance(residuals, sigma=0.05, chunk=None):
+    """ Returns the smallest trend that is significant at each grid cell,
+        given the residuals from the trend. The number of degrees of freedom
+        is reduced by the lag-1 autocorrelation of the residuals.
 
-        c = tcrit * sb
+    Parameters
+    ----------
+    residuals : numpy array
+                detrended data with time as the first axis
+    sigma : float
+            significance level
+    chunk : int
+            number of rows of the grid to work on at once to limit
+            the memory used. None works on the whole grid.
 
-        cs[i][j] = c
-    return cs
+    Returns
+    -------
+    numpy masked array
+    """
+    residuals = np.ma.masked_invalid(residuals)
+    if chunk and residuals.ndim > 1 and residuals.shape[1] > chunk:
+        return np.ma.concatenate([trend_significance(residuals[:, i:i + chunk], sigma)
+                                  for i in xrange(0, residuals.shape[1], chunk)], axis=0)
+    nt = residuals.shape[0]
+    tcrit = sp.stats.t.isf(sigma / 2.0, nt - 2)
+
+    rcorrs = np.ma.maximum(_lag1_autocorrelation(residuals), 0)
+    valid = ~np.ma.getmaskarray(residuals)
+    n = valid.sum(axis=0)
+    neff = n * (1 - rcorrs) / (1 + rcorrs)
+
+    t = np.arange(nt, dtype=float).reshape((nt,) + (1,) * (residuals.ndim - 1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tanom = np.where(valid, t - (valid * t).sum(axis=0) / n, 0.)
+        se = np.ma.sqrt((residuals.filled(0.) ** 2).sum(axis=0) / (neff - 2))
+        sb = se / np.sqrt((tanom ** 2).sum(axis=0))
+    return np.ma.masked_invalid(tcrit * sb)
 
 def _histogram_data(plot, compfile):
     data, _, _, _, _, _, _ = pl.dataload(compfile, plot['variable'], 
@@ -599,6 +686,7 @@ def _histogram_data(plot, compfile):
     data, _ = _trend_units(data, '', plot)
     return data
 
+@profiler.profile('plot')
 def histogram(plot):
     values = {}
     data, _, _, depth, units, _, _ = pl.dataload(plot['ifile'], plot['variable'], 
@@ -669,6 +757,7 @@ def _timeseries_data(plot, compfile):
     return data, time
 
 
+@profiler.profile('plot')
 def timeseries(plot):
     print 'plotting timeseries comparison of ' + plot['variable']
 
@@ -756,6 +845,7 @@ def zonalmeandata(plot, compfile):
                                   depthneeded=[plot['plot_depth']])
     return data
 
+@profiler.profile('plot')
 def zonalmean(plot):
     """ Loads and plots a time average of the zonal means
         for each latitude. Loads and plots the data for comparison.
@@ -903,6 +993,7 @@ def taylor_load(plot, compfile, depth, i, color, refdata, weights):
             'zorder': 2}
 
 def stats_dictionary(plot, filename, depth, sd, nsd, corrcoef):
+    filename = pl.file_name(filename)
     if filename not in plot['stats']:
         plot['stats'][filename] = {}
 
@@ -917,6 +1008,7 @@ def stats_dictionary(plot, filename, depth, sd, nsd, corrcoef):
                                       
 #    plot['stats'] = {'obserations': {'standard deviation': float(refstd)}}
           
+@profiler.profile('plot')
 def taylor(plot):
     labelled_stats = []
     unlabelled_stats = []
@@ -993,6 +1085,7 @@ def taylor(plot):
     plot['comp_file'] = plot['obs_file']
     return plot_name
 
+@profiler.profile('plot')
 def multivariable_taylor(plot):
     if 'depth' not in plot:
         plot['depth'] = 0
@@ -1070,6 +1163,7 @@ def multivariable_taylor(plot):
     plot['comp_file'] = plot['obs_file']
     return plot_name
     
+@profiler.profile('plot')
 def scatter(plot):
     print 'plotting scatter map of ' + plot['variable'] + ' and ' + plot['extra_variables'][0]
     # load data from netcdf file
@@ -1080,7 +1174,8 @@ def scatter(plot):
                                           seasons=plot['seasons'], datatype=plot['data_type'],
                                           cdostring=plot['cdostring'],
                                           external_function=plot['external_function'],
-                                          external_function_args=plot['external_function_args'])
+                                          external_function_args=plot['external_function_args'],
+                                          levels=_plot_levels(plot))
     # get data at correct depth
     data = _depth_data(data, depth, plot)
     data2, _, _, _, units2, _, _ = pl.dataload(plot['extra_ifiles'][plot['extra_variables'][0]], 
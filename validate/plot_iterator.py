@@ -5,14 +5,24 @@ plot_iterator
 This module contains functions needed to efficiently loop
 through all of the specified plots that will be produced.
 
+With more than one job, every plot, depth and comparison is made
+as a separate job in a pool of worker processes. The workers return
+their plot names and log records, which are kept in the same order
+as they would be in a serial run.
+
 .. moduleauthor:: David Fallis
 """
 import os
 import glob
+import multiprocessing
 
 import defaults as dft
 import plot_cases as pc
+import field_cache
+import product_cache
 import matplotlib.pyplot as plt
+import yamllog
+import profiler
 from yamllog import log
 from copy import deepcopy
 
@@ -70,8 +80,7 @@ def makeplot(p, plotnames, func):
     try:
         plot_name = func(p)
     except:
-        with open('logs/log.txt', 'a') as outfile:
-            outfile.write('Failed to plot ' + p['variable'] + ', ' + p['plot_projection'] + ', ' + p['data_type'] + ', ' + p['comp_model'] + '\n\n')
+        yamllog.write('Failed to plot ' + p['variable'] + ', ' + p['plot_projection'] + ', ' + p['data_type'] + ', ' + p['comp_model'] + '\n\n')
     else:
         p['plot_name'] = plot_name + '.pdf'
         p['png_name'] = plot_name + '.png'
@@ -81,8 +90,7 @@ def makeplot(p, plotnames, func):
         if p['png']:
             p['plot_name'] = p['png_name']
             log(p)
-        with open('logs/log.txt', 'a') as outfile:
-            outfile.write('Successfully plotted ' + p['variable'] + ', ' + p['plot_projection'] + ', ' + p['plot_type'] + ', ' + p['comp_model'] + '\n\n')
+        yamllog.write('Successfully plotted ' + p['variable'] + ', ' + p['plot_projection'] + ', ' + p['plot_type'] + ', ' + p['comp_model'] + '\n\n')
 
 
 def makeplot_without_catching(p, plotnames, func):
@@ -109,45 +117,118 @@ def calltheplot(plot, plotnames, ptype):
         makeplot(plot, plotnames, funcs[ptype])
 
 
-def comp_loop(plot, plotnames, ptype):
+def queue(plot, jobs, ptype):
+    """ Adds a copy of the plot to the list of jobs instead of plotting it
+    """
+    jobs.append((deepcopy(plot), ptype))
+
+
+def comp_loop(plot, plotnames, ptype, call=calltheplot):
     plot['comp_flag'] = 'obs'
     for o in plot['comp_obs']:
         plot['comp_model'] = o
         plot['comp_file'] = plot['obs_file'][o]
-        calltheplot(plot, plotnames, ptype)
+        call(plot, plotnames, ptype)
     plot['comp_flag'] = 'cmip5'
     if plot['comp_cmips']:
         plot['comp_model'] = 'cmip5'
         plot['comp_file'] = plot['cmip5_file']
-        calltheplot(plot, plotnames, ptype)
+        call(plot, plotnames, ptype)
     plot['comp_flag'] = 'model'
     for model in plot['comp_models']:
         plot['comp_model'] = model
         plot['comp_file'] = plot['model_file'][model]
-        calltheplot(plot, plotnames, ptype)
+        call(plot, plotnames, ptype)
     plot['comp_flag'] = 'runid'
     for i in plot['id_file']:
         plot['comp_model'] = i
         plot['comp_file'] = plot['id_file'][i]
-        calltheplot(plot, plotnames, ptype)
+        call(plot, plotnames, ptype)
 
 
-def loop_plot_types(plot, plotnames):
+def loop_plot_types(plot, plotnames, call=calltheplot):
     if plot['plot_projection'] == 'time_series' or plot['plot_projection'] == 'zonal_mean' or plot['plot_projection'] == 'taylor' or plot['plot_projection'] == 'histogram' or plot['plot_projection'] == 'scatter' or plot['plot_projection'] == 'multivariable_taylor':
         plot['comp_model'] = 'Model'
-        calltheplot(plot, plotnames, 'compare')    
+        call(plot, plotnames, 'compare')    
     else:
         plot['comp_model'] = 'Model'
-        calltheplot(plot, plotnames, 'single')
-        comp_loop(plot, plotnames, 'compare')
+        call(plot, plotnames, 'single')
+        comp_loop(plot, plotnames, 'compare', call)
+
 
-def loop(plots, debug):
+def _cache_stats():
+    """ Returns the cache statistics of this process and starts them again
+    """
+    stats = {'field_cache': dict(field_cache.stats),
+             'product_cache': dict(product_cache.stats)}
+    for cache in [field_cache.stats, product_cache.stats]:
+        for key in cache:
+            cache[key] = 0
+    return stats
+
+
+def _add_cache_stats(stats):
+    for name, cache in [('field_cache', field_cache.stats), ('product_cache', product_cache.stats)]:
+        for key in stats[name]:
+            cache[key] += stats[name][key]
+
+
+def run_job(job):
+    """ Makes the plot of a job in a worker process
+
+    Returns
+    -------
+    list of the plot dictionaries made
+    list of the log records
+    dictionary of the cache statistics
+    list of the profiler records
+    """
+    plot, ptype = job
+    plotnames = []
+    yamllog.buffer()
+    try:
+        calltheplot(plot, plotnames, ptype)
+    finally:
+        plt.close('all')
+        product_cache.release_all()
+        records = yamllog.unbuffer()
+    return plotnames, records, _cache_stats(), profiler.take()
+
+
+def _start_worker():
+    """ Clears the statistics and profiler records copied from the parent
+    """
+    _cache_stats()
+    profiler.take()
+
+
+def run_jobs(jobs, processes):
+    """ Makes the plots of the jobs in a pool of processes and
+        returns the plot dictionaries in the order of the jobs
+    """
+    plotnames = []
+    pool = multiprocessing.Pool(processes, initializer=_start_worker)
+    try:
+        for names, records, stats, profile in pool.imap(run_job, jobs):
+            yamllog.write_records(records)
+            _add_cache_stats(stats)
+            profiler.add(profile)
+            plotnames.extend(names)
+    finally:
+        pool.close()
+        pool.join()
+    return plotnames
+
+def loop(plots, debug, jobs=1):
     """ Loops though the list of plots and the depths within
         the plots and outputs each to a pdf
 
     Parameters
     ----------
     plots : list of dictionaries
+    debug : boolean
+    jobs : int
+           number of processes to make the plots with
 
     Returns
     -------
@@ -159,6 +240,10 @@ def loop(plots, debug):
     # Remove old plots
     _remove_plots()
 
+    if jobs > 1:
+        call = queue
+    else:
+        call = calltheplot
     plotnames = []
     for p in plots:
         if p['depths'] == [""]:
@@ -166,14 +251,17 @@ def loop(plots, debug):
         else:
             p['is_depth'] = True
         if p['plot_projection'] == 'taylor':
-            loop_plot_types(p, plotnames)
+            loop_plot_types(p, plotnames, call)
             continue
         for d in p['depths']:
             try:
                 p['depth'] = int(d)
             except: pass
-            loop_plot_types(p, plotnames)
+            loop_plot_types(p, plotnames, call)
         plt.close('all')
+    if jobs > 1:
+        # plotnames holds the jobs
+        plotnames = run_jobs(plotnames, jobs)
     return plotnames
 
 
@@ -0,0 +1,403 @@
+"""
+product_cache
+===============
+
+This module names and keeps track of the netCDF files produced
+by the cdo operations in data_loader. Every product is named by
+a hash of the identity of the original input file (path, size and
+modification time) and the full chain of operations and parameters
+used to make it, so that it can be safely reused by other plots and
+by later runs. The products are listed in a manifest file stored
+with them.
+
+ROOT can be set to a directory which is kept between runs with
+'cache_root' in conf.yaml. The least recently used products are then
+removed by prune() when the directory grows over its size budget, and
+the number of products reused and made is kept in a statistics file.
+
+Processes sharing ROOT claim() a product before making it, so that the
+same file is never written by two processes at once.
+
+"""
+import os
+import time
+import glob
+import hashlib
+import threading
+import yaml
+
+ROOT = 'netcdf'
+MANIFEST = 'manifest.yml'
+STATS = 'stats.yml'
+
+# True if ROOT is kept between runs
+PERSISTENT = False
+
+_entries = {}
+_files = {}
+_pending = {}
+_offset = 0
+# keys claimed by this process mapped to the thread which claimed them
+_claimed = {}
+_lock = threading.Lock()
+
+# products reused and made during this run
+stats = {'hits': 0,
+         'misses': 0,
+         'bytes_saved': 0,
+         }
+
+
+def set_root(root):
+    """ Stores the products in a directory which is kept between runs
+    """
+    global ROOT, PERSISTENT, _offset
+    ROOT = root
+    PERSISTENT = True
+    _entries.clear()
+    _files.clear()
+    _offset = 0
+
+
+def _hash(items):
+    return hashlib.sha1('\n'.join([str(item) for item in items])).hexdigest()
+
+
+def _manifest_name():
+    return os.path.join(ROOT, MANIFEST)
+
+
+def _refresh():
+    """ Reads the entries added to the manifest since it was last read,
+        including those written by other processes
+    """
+    with _lock:
+        _read_manifest()
+
+
+def _read_manifest():
+    global _offset
+    try:
+        with open(_manifest_name(), 'r') as f:
+            f.seek(0, 2)
+            if f.tell() < _offset:
+                # the manifest was removed and started again
+                _entries.clear()
+                _files.clear()
+                _offset = 0
+            f.seek(_offset)
+            text = f.read()
+    except IOError:
+        return
+    # only use complete lines in case another process is still writing
+    end = text.rfind('\n') + 1
+    new = yaml.safe_load(text[:end]) or {}
+    _offset += end
+    for key in new:
+        _entries[key] = new[key]
+        _files[new[key]['file']] = key
+
+
+def manifest():
+    """ Returns the dictionary mapping keys to the products in the manifest
+    """
+    _refresh()
+    return _entries
+
+
+def identity(name):
+    """ Returns the key of a file. Products in the manifest are identified
+        by the key they were made with, any other file by its path, size
+        and modification time. A list of the time slices of a file is
+        identified by the keys of the slices.
+    """
+    if isinstance(name, (list, tuple)):
+        return _hash(['files'] + [identity(n) for n in name])
+    if name not in _files:
+        # the product may have been made by another process
+        _refresh()
+    if name in _files:
+        return _files[name]
+    st = os.stat(name)
+    return _hash(['file', os.path.abspath(name), st.st_size, st.st_mtime])
+
+
+def chain(parent, operation, *params):
+    """ Returns the key of the product of an operation on the product
+        or file with the key parent
+    """
+    return _hash([parent, operation] + list(params))
+
+
+def key(name, operation, *params):
+    """ Returns the key of the product of an operation on a file
+    """
+    return chain(identity(name), operation, *params)
+
+
+def path(key, operation):
+    """ Returns the file name of a product
+    """
+    return os.path.join(ROOT, operation + '_' + key + '.nc')
+
+
+def product(name, operation, *params):
+    """ Returns the key and file name of the product of an operation on a file.
+        The product is listed in the manifest once register() is called.
+
+    Parameters
+    ----------
+    name : string
+           name of the input file
+    operation : string
+                name of the operation
+    params : strings
+             parameters which change the result of the operation
+
+    Returns
+    -------
+    string of the key
+    string of the output file name
+    """
+    return derive(identity(name), name, operation, *params)
+
+
+def derive(parent, name, operation, *params):
+    """ Same as product(), but the key of the input is given by parent.
+        This is used when name is the file that the operations leading
+        to parent are applied to in a single chained command.
+    """
+    k = chain(parent, operation, *params)
+    out = path(k, operation)
+    _pending[k] = {'file': out,
+                   'operation': operation,
+                   'params': [str(p) for p in params],
+                   'parent': parent,
+                   'input': name,
+                   }
+    return k, out
+
+
+def lookup(key):
+    """ Returns the file name of a product if it has already been made,
+        otherwise returns None
+    """
+    entry = _entries.get(key)
+    if entry is None:
+        entry = manifest().get(key)
+    if entry is not None and os.path.isfile(entry['file']):
+        _touch(entry['file'])
+        stats['hits'] += 1
+        stats['bytes_saved'] += os.path.getsize(entry['file'])
+        return entry['file']
+    return None
+
+
+def _touch(name):
+    """ Marks a product as used so that it is kept longer by prune()
+    """
+    try:
+        os.utime(name, None)
+    except OSError:
+        pass
+
+
+def register(key):
+    """ Adds a product to the manifest after it has been written
+    """
+    entry = _pending.pop(key)
+    line = key + ': ' + yaml.safe_dump(entry, default_flow_style=True, width=float('inf'))
+    with open(_manifest_name(), 'a') as outfile:
+        outfile.write(line)
+    stats['misses'] += 1
+    release(key)
+
+
+def _lock_name(key):
+    return os.path.join(ROOT, key + '.lock')
+
+
+def _holder_alive(lock):
+    """ Returns False if the process which wrote the lock file has stopped
+    """
+    try:
+        with open(lock, 'r') as f:
+            pid = f.read()
+        os.kill(int(pid), 0)
+    except (IOError, ValueError):
+        # the lock is being written or was just released
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def exists(key):
+    """ Returns True if a product has been made, without marking it as used
+    """
+    _refresh()
+    entry = _entries.get(key)
+    return entry is not None and os.path.isfile(entry['file'])
+
+
+def claim(key, wait=0.2):
+    """ Claims the right to make a product. If another process is making it
+        this waits until it has finished.
+
+    Returns
+    -------
+    True if this process should make the product, False if it
+    was made by another process while waiting
+    """
+    thread = threading.current_thread().ident
+    if _claimed.get(key) == thread:
+        return True
+    lock = _lock_name(key)
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            if exists(key):
+                return False
+            if not _holder_alive(lock):
+                try:
+                    os.remove(lock)
+                except OSError:
+                    pass
+                continue
+            time.sleep(wait)
+            continue
+        os.write(fd, str(os.getpid()))
+        os.close(fd)
+        _claimed[key] = thread
+        if exists(key):
+            # finished by another process just before the lock was taken
+            release(key)
+            return False
+        return True
+
+
+def release(key):
+    """ Lets other processes make a product claimed by this process
+    """
+    if key in _claimed:
+        del _claimed[key]
+        try:
+            os.remove(_lock_name(key))
+        except OSError:
+            pass
+
+
+def release_all():
+    """ Releases all of the products claimed by this process, for example
+        after an error stopped them from being made
+    """
+    for key in list(_claimed):
+        release(key)
+
+
+def products():
+    """ Returns a list of (file name, manifest entry, bytes, last used time)
+        of the products in ROOT, with the least recently used first.
+        The entry is None for files not listed in the manifest.
+    """
+    _refresh()
+    entries = dict((_entries[k]['file'], _entries[k]) for k in _entries)
+    found = []
+    for name in glob.glob(os.path.join(ROOT, '*.nc')):
+        try:
+            st = os.stat(name)
+        except OSError:
+            continue
+        found.append((name, entries.get(name), st.st_size, st.st_mtime))
+    return sorted(found, key=lambda p: p[3])
+
+
+def _compact():
+    """ Rewrites the manifest without the products that no longer exist
+    """
+    global _offset
+    _refresh()
+    lines = []
+    for k in sorted(_entries):
+        if os.path.isfile(_entries[k]['file']):
+            lines.append(k + ': ' + yaml.safe_dump(_entries[k], default_flow_style=True,
+                                                    width=float('inf')))
+    tmp = _manifest_name() + '.tmp'
+    with open(tmp, 'w') as outfile:
+        outfile.write(''.join(lines))
+    os.rename(tmp, _manifest_name())
+    _entries.clear()
+    _files.clear()
+    _offset = 0
+    _refresh()
+
+
+def prune(size=None, days=None):
+    """ Removes the least recently used products until the products in
+        ROOT take up less than size bytes, and removes the products that
+        have not been used in the last number of days.
+
+    Parameters
+    ----------
+    size : int
+           maximum number of bytes to keep, None for no limit
+    days : float
+           maximum number of days since a product was last used,
+           None for no limit
+
+    Returns
+    -------
+    int of the number of files removed
+    int of the number of bytes removed
+    """
+    found = products()
+    total = sum(p[2] for p in found)
+    oldest = None
+    if days is not None:
+        oldest = time.time() - days * 86400
+    removed = 0
+    removedbytes = 0
+    for name, entry, nbytes, used in found:
+        if (size is None or total <= size) and (oldest is None or used >= oldest):
+            continue
+        try:
+            os.remove(name)
+        except OSError:
+            continue
+        total -= nbytes
+        removed += 1
+        removedbytes += nbytes
+    if removed:
+        _compact()
+    return removed, removedbytes
+
+
+def _stats_name():
+    return os.path.join(ROOT, STATS)
+
+
+def read_stats():
+    """ Returns the statistics of all of the runs which used ROOT
+    """
+    try:
+        with open(_stats_name(), 'r') as f:
+            return yaml.safe_load(f) or {}
+    except IOError:
+        return {}
+
+
+def save_stats():
+    """ Adds the statistics of this run to the statistics file in ROOT
+    """
+    totals = read_stats()
+    for k in stats:
+        totals[k] = totals.get(k, 0) + stats[k]
+    totals['runs'] = totals.get('runs', 0) + 1
+    totals['last_run'] = dict(stats)
+    with open(_stats_name(), 'w') as outfile:
+        yaml.safe_dump(totals, outfile, default_flow_style=False)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,178 @@
+"""
+profiler
+===============
+
+This module records how long the stages of a run take. Every record
+holds the wall time, the CPU time, the bytes read and written and the
+peak resident memory of the process, including the cdo commands it ran.
+The records are written to logs/profile.yml, with a summary for each
+name, and to logs/profile.json in the Chrome trace event format, which
+can be opened with chrome://tracing or Perfetto to see the stages of
+every process and thread on a timeline.
+
+The resource usage is measured for the whole process, so the CPU time
+and bytes of stages run at the same time in several threads overlap.
+
+.. moduleauthor:: David Fallis
+"""
+import os
+import time
+import threading
+import functools
+import json
+import resource
+from contextlib import contextmanager
+import yaml
+
+PROFILE = 'logs/profile.yml'
+TRACE = 'logs/profile.json'
+
+# False to stop recording
+enabled = True
+
+_records = []
+_start = time.time()
+
+
+def _usage():
+    """ Returns the CPU seconds, bytes read, bytes written and peak
+        resident kilobytes of this process and the processes it waited for
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    # the block counts are in units of 512 bytes
+    read = (own.ru_inblock + children.ru_inblock) * 512
+    written = (own.ru_oublock + children.ru_oublock) * 512
+    return cpu, read, written, max(own.ru_maxrss, children.ru_maxrss)
+
+
+@contextmanager
+def timed(name, category='run', **args):
+    """ Records the resources used by the code run in the with block
+
+    Parameters
+    ----------
+    name : string
+           name of the record
+    category : string
+               'control', 'cdo', 'dataload', 'plot' or 'output'
+    args : strings
+           details shown with the record, such as the file name
+    """
+    if not enabled:
+        yield
+        return
+    cpu, read, written, _ = _usage()
+    start = time.time()
+    try:
+        yield
+    finally:
+        end = time.time()
+        endcpu, endread, endwritten, rss = _usage()
+        _records.append({'name': name,
+                         'category': category,
+                         'start': start - _start,
+                         'wall': end - start,
+                         'cpu': endcpu - cpu,
+                         'bytes_read': endread - read,
+                         'bytes_written': endwritten - written,
+                         'peak_rss': rss * 1024,
+                         'pid': os.getpid(),
+                         'thread': threading.current_thread().name,
+                         'args': dict((k, str(v)) for k, v in args.iteritems()),
+                         })
+
+
+def profile(category):
+    """ Returns a decorator which records every call of a function
+        under its name. The first argument is shown with the record
+        if it is a file name or a list of time slices.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            details = {}
+            if args and isinstance(args[0], basestring):
+                details['file'] = args[0]
+            elif args and isinstance(args[0], list):
+                details['file'] = ','.join(str(a) for a in args[0])
+            with timed(func.__name__, category, **details):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def take():
+    """ Returns the records made so far and removes them, so that the
+        records of a worker process can be passed to the parent
+    """
+    records = list(_records)
+    del _records[:]
+    return records
+
+
+def add(records):
+    """ Adds records made by another process
+    """
+    _records.extend(records)
+
+
+def summary():
+    """ Returns a dictionary mapping the name of each record to the
+        number of calls and their total wall and CPU time
+    """
+    totals = {}
+    for r in _records:
+        total = totals.setdefault(r['name'], {'category': r['category'],
+                                              'calls': 0,
+                                              'wall': 0.,
+                                              'cpu': 0.,
+                                              'bytes_read': 0,
+                                              'bytes_written': 0,
+                                              })
+        total['calls'] += 1
+        for k in ['wall', 'cpu', 'bytes_read', 'bytes_written']:
+            total[k] += r[k]
+    return totals
+
+
+def trace():
+    """ Returns the records as Chrome trace events
+    """
+    threads = {}
+    events = []
+    for r in _records:
+        tid = threads.setdefault((r['pid'], r['thread']), len(threads))
+        args = dict(r['args'])
+        for k in ['cpu', 'bytes_read', 'bytes_written', 'peak_rss']:
+            args[k] = r[k]
+        events.append({'name': r['name'],
+                       'cat': r['category'],
+                       'ph': 'X',
+                       'ts': int(r['start'] * 1e6),
+                       'dur': int(r['wall'] * 1e6),
+                       'pid': r['pid'],
+                       'tid': tid,
+                       'args': args,
+                       })
+    for (pid, thread), tid in threads.iteritems():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                       'args': {'name': thread}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write(profile=PROFILE, tracefile=TRACE):
+    """ Writes the records to the profile and the trace files
+    """
+    if not enabled:
+        return
+    with open(profile, 'w') as outfile:
+        yaml.safe_dump({'summary': summary(), 'records': _records}, outfile,
+                       default_flow_style=False)
+    with open(tracefile, 'w') as outfile:
+        json.dump(trace(), outfile)
+
+
+if __name__ == "__main__":
+    pass
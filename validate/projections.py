@@ -94,26 +94,23 @@ def anom_cmap():
     cmap_anom = discrete_cmap(ncols, cmap_anom)
     return cmap_anom
 
-def draw_stipple(pvalues, lon, lat, m, alpha):
-        slons = []
-        slats = []
-        for index, value in np.ndenumerate(pvalues):
-            if index[1]%4 == 0 and index[0]%2 == 0:
-                if value < alpha:    
-                    slons.append(lon[index[1]])
-                    slats.append(lat[index[0]])
-        a,b = m(slons, slats)
+def stipple_points(significant, density=(2, 4)):
+    """ Returns the row and column indices of the significant cells
+        on every density[0]th row and density[1]th column of the grid
+    """
+    rowstep, colstep = density
+    significant = np.ma.filled(significant, False)[::rowstep, ::colstep]
+    rows, cols = np.nonzero(significant)
+    return rows * rowstep, cols * colstep
+
+def draw_stipple(pvalues, lon, lat, m, alpha, density=(2, 4)):
+        rows, cols = stipple_points(np.ma.masked_invalid(pvalues) < alpha, density)
+        a,b = m(np.asarray(lon)[cols], np.asarray(lat)[rows])
         m.plot(a,b, '.', markersize=0.3, color='k', zorder=1)
 
-def draw_trend_stipple(data, cvalues, lon, lat, m):        
-        slons = []
-        slats = []
-        for index, value in np.ndenumerate(cvalues):
-            if index[1]%4 == 0 and index[0]%2 == 0:
-                if abs(value) < data[index[0]][index[1]]:             
-                    slons.append(lon[index[1]])
-                    slats.append(lat[index[0]])
-        a,b = m(slons, slats)
+def draw_trend_stipple(data, cvalues, lon, lat, m, density=(2, 4)):        
+        rows, cols = stipple_points(np.ma.abs(cvalues) < data, density)
+        a,b = m(np.asarray(lon)[cols], np.asarray(lat)[rows])
         m.plot(a,b, '.', markersize=0.3, color='k', zorder=1)      
 
 
@@ -122,7 +119,7 @@ def worldmap(projection, lon, lat, data, pvalues=None, cvalues=None, alpha=None,
               latmin=-80, latmax=80, lonmin=0, lonmax=360, lon_0=180, draw_contour=False,
               label=None,
               fill_continents=False, draw_parallels=True, draw_meridians=False,
-              plot={}):
+              stipple_density=(2, 4), plot={}):
     if not ax:
         fig, ax = plt.subplots(1, 1, figsize=(8, 8))
     else:
@@ -184,17 +181,17 @@ def worldmap(projection, lon, lat, data, pvalues=None, cvalues=None, alpha=None,
         m.drawmeridians(np.arange(0, 360, 90), labels=meridian_labels, yoffset=0.5e6, ax=ax, fontsize=9)
 
     if pvalues is not None:
-        draw_stipple(pvalues, lon, lat, m, alpha)
+        draw_stipple(pvalues, lon, lat, m, alpha, stipple_density)
 
     if cvalues is not None:
-        draw_trend_stipple(data, cvalues, lon, lat, m)
+        draw_trend_stipple(data, cvalues, lon, lat, m, stipple_density)
 
     cbar = m.colorbar(mappable=cot, location='right', label=cblabel)
     cbar.solids.set_edgecolor("face") 
     if label is not None:
         ax.text(a, b, label, fontsize=7)
 
-def section(x, z, data, ax=None, rmse=False, pvalues=None, alpha=None, ax_args=None, pcolor_args=None, plot={}, cblabel='', anom=False, cbaxis=None):
+def section(x, z, data, ax=None, rmse=False, pvalues=None, alpha=None, ax_args=None, pcolor_args=None, plot={}, cblabel='', anom=False, cbaxis=None, stipple_density=(1, 4)):
     """Pcolor a var in a section, using ax if supplied"""
     if not ax:
         fig, ax = plt.subplots(1, 1, figsize=(8, 8))
@@ -228,14 +225,8 @@ def section(x, z, data, ax=None, rmse=False, pvalues=None, alpha=None, ax_args=N
         plt.setp(ax, **ax_args)
 
     if pvalues is not None:
-        slons = []
-        sdepths = []
-        for index, value in np.ndenumerate(pvalues):
-            if index[1]%4 == 0:
-                if value < alpha:
-                    slons.append(x[index[1]])
-                    sdepths.append(z[index[0]])
-        ax.plot(slons, sdepths, '.', markersize=0.2, color='k')
+        rows, cols = stipple_points(np.ma.masked_invalid(pvalues) < alpha, stipple_density)
+        ax.plot(np.asarray(x)[cols], np.asarray(z)[rows], '.', markersize=0.2, color='k')
 
     box = ax.get_position()
     if cbaxis:
@@ -0,0 +1,114 @@
+"""
+regrid
+===============
+
+This module remaps data held in memory with the weight files made by
+cdo and kept by remap_weights, so that the numpy engine does not have
+to write a remapped file. A weight file in the SCRIP format is read
+once into a scipy.sparse CSR matrix, and all of the timesteps and
+levels of a field are then remapped with one sparse matrix product.
+The weights of masked source points are left out and the remaining
+weights of every target point are renormalized, so that points next
+to a coastline only use the valid points around them.
+
+.. moduleauthor:: David Fallis
+"""
+import threading
+import numpy as np
+from scipy import sparse
+from netCDF4 import Dataset
+
+# weight files read so far mapped to their matrices
+_weights = {}
+_lock = threading.Lock()
+
+
+def _degrees(ncvar):
+    values = np.asarray(ncvar[:], dtype=float)
+    if 'rad' in getattr(ncvar, 'units', 'degrees'):
+        values = np.degrees(values)
+    return values
+
+
+def read(name):
+    """ Reads a weight file made by a cdo gen* operator
+
+    Returns
+    -------
+    dictionary with the CSR 'matrix' mapping the source points to the
+    target points, the 'source' and 'target' shapes of the grids and
+    the 'lon' and 'lat' of the target grid
+    """
+    nc = Dataset(name, 'r')
+    try:
+        # the addresses count from 1
+        rows = nc.variables['dst_address'][:].astype(int) - 1
+        columns = nc.variables['src_address'][:].astype(int) - 1
+        values = np.asarray(nc.variables['remap_matrix'][:], dtype=float)
+        if values.ndim > 1:
+            values = values[:, 0]
+        nsource = len(nc.dimensions['src_grid_size'])
+        ntarget = len(nc.dimensions['dst_grid_size'])
+        # the dimensions are stored with the fastest varying first
+        source = tuple(int(n) for n in nc.variables['src_grid_dims'][:][::-1])
+        target = tuple(int(n) for n in nc.variables['dst_grid_dims'][:][::-1])
+        lon = _degrees(nc.variables['dst_grid_center_lon']).reshape(target)
+        lat = _degrees(nc.variables['dst_grid_center_lat']).reshape(target)
+    finally:
+        nc.close()
+    matrix = sparse.csr_matrix((values, (rows, columns)), shape=(ntarget, nsource))
+    if len(target) == 2 and (lon == lon[:1]).all() and (lat == lat[:, :1]).all():
+        # a regular grid is given by one row and one column
+        lon = lon[0]
+        lat = lat[:, 0]
+    return {'matrix': matrix,
+            'source': source,
+            'target': target,
+            'lon': lon,
+            'lat': lat,
+            }
+
+
+def load(name):
+    """ Returns the weights of a weight file, reading it only once
+    """
+    with _lock:
+        if name not in _weights:
+            _weights[name] = read(name)
+        return _weights[name]
+
+
+def apply(weights, data):
+    """ Remaps every timestep and level of the data with one sparse
+        matrix product
+
+    Parameters
+    ----------
+    weights : dictionary
+              as returned by load()
+    data : numpy array
+           with the horizontal axes of the source grid last
+
+    Returns
+    -------
+    masked numpy array with the horizontal axes of the target grid last.
+    Target points without any valid source points are masked.
+    """
+    ndims = len(weights['source'])
+    horizontal = data.shape[-ndims:]
+    if int(np.prod(horizontal)) != weights['matrix'].shape[1]:
+        raise ValueError('The data is not on the source grid of the weights')
+    leading = data.shape[:-ndims]
+    data = np.ma.asarray(data)
+    fields = np.ma.filled(data, 0).astype(float).reshape(-1, weights['matrix'].shape[1])
+    valid = (~np.ma.getmaskarray(data)).reshape(fields.shape).astype(float)
+    matrix = weights['matrix']
+    total = matrix.dot(fields.T).T
+    cover = matrix.dot(valid.T).T
+    empty = cover <= 1e-12
+    remapped = np.ma.masked_where(empty, total / np.where(empty, 1, cover))
+    return remapped.reshape(leading + weights['target'])
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,193 @@
+"""
+remap_weights
+===============
+
+This module keeps the interpolation weights used by cdo to remap the
+data. The weights for a pair of grids are made once with the cdo
+gen* operator of the remap method and used by 'remap,grid,weights'
+for every file on the same grid after that, so that they are not
+worked out again for every file.
+
+The weights are made from the first timestep of the variable being
+remapped, and named by a hash of the coordinates and bounds of the
+grid of that variable, the target grid and the method. They are stored in the
+weights directory of product_cache.ROOT, so that they are kept
+between runs when 'cache_root' is set in conf.yaml.
+
+.. moduleauthor:: David Fallis
+"""
+import os
+import hashlib
+import threading
+import numpy as np
+from netCDF4 import Dataset
+import product_cache as pc
+import profiler
+
+# False to remap without weight files
+enabled = True
+
+# names of the coordinates used to recognize the horizontal grid
+COORDINATES = ['lon', 'lat', 'longitude', 'latitude', 'nav_lon', 'nav_lat']
+
+_fingerprints = {}
+_failed = set()
+_locks = {}
+_lock = threading.Lock()
+# the netCDF library can not be used by several threads at once
+_netcdf_lock = threading.Lock()
+
+
+def directory():
+    """ Returns the directory the weight files are kept in
+    """
+    return os.path.join(pc.ROOT, 'weights')
+
+
+def _generator(method):
+    """ Returns the cdo operator which makes the weights of a remap method
+    """
+    return 'gen' + method[len('remap'):]
+
+
+def _coordinates(nc, var=None):
+    """ Returns the names of the horizontal coordinates of a file and
+        of their bounds. If the variable is in the file, only the
+        coordinates of its grid are returned.
+    """
+    names = []
+    candidates = sorted(nc.variables)
+    if var in nc.variables:
+        ncvar = nc.variables[var]
+        own = set(ncvar.dimensions) | set(getattr(ncvar, 'coordinates', '').split())
+        candidates = [name for name in candidates if name in own]
+    for name in candidates:
+        ncvar = nc.variables[name]
+        standard_name = getattr(ncvar, 'standard_name', None)
+        if name in COORDINATES or standard_name in ['longitude', 'latitude']:
+            names.append(name)
+            bounds = getattr(ncvar, 'bounds', None)
+            if bounds in nc.variables:
+                names.append(bounds)
+    return names
+
+
+def fingerprint(name, var=None):
+    """ Returns a hash of the coordinates and bounds of the horizontal
+        grid of a variable in a file, or of the file if the variable is
+        not given, or None if they can not be found
+    """
+    st = os.stat(name)
+    stamp = (os.path.abspath(name), st.st_size, st.st_mtime, var)
+    if stamp in _fingerprints:
+        return _fingerprints[stamp]
+    h = hashlib.sha1()
+    with _netcdf_lock:
+        nc = Dataset(name, 'r')
+        try:
+            names = _coordinates(nc, var)
+            for n in names:
+                values = np.ascontiguousarray(nc.variables[n][:], dtype='f8')
+                h.update(n + str(values.shape))
+                h.update(values)
+        finally:
+            nc.close()
+    found = h.hexdigest() if names else None
+    _fingerprints[stamp] = found
+    return found
+
+
+def key(name, method, target, var=None):
+    """ Returns the key of the weights for remapping the grid of a
+        variable in a file to the target grid, or None if the grid is
+        not recognized
+    """
+    source = fingerprint(name, var)
+    if source is None:
+        return None
+    return pc._hash(['weights', source, target, method])
+
+
+def path(k, method):
+    """ Returns the name of a weight file
+    """
+    return os.path.join(directory(), method + '_' + k + '.nc')
+
+
+def _key_lock(k):
+    with _lock:
+        return _locks.setdefault(k, threading.Lock())
+
+
+@profiler.profile('cdo')
+def gen_weights(name, method, remapgrid, out, var=None):
+    """ Makes the weights for remapping the grid of a variable in a file
+        to remapgrid. They are written to a temporary file first so that
+        other processes never read part of it.
+    """
+    if not os.path.isdir(directory()):
+        try:
+            os.makedirs(directory())
+        except OSError:
+            pass
+    tmp = out + '.' + str(os.getpid()) + '.tmp'
+    # the first timestep of the variable, so that the weights are made for
+    # its grid and not for the first grid of the file
+    select = ' -seltimestep,1'
+    if var is not None:
+        select += ' -selvar,' + var
+    command = ('cdo -s ' + _generator(method) + ',' + remapgrid + select + ' ' +
+               name + ' ' + tmp)
+    if os.system(command) != 0:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    os.rename(tmp, out)
+    return True
+
+
+def find(name, method, remapgrid, target, var=None):
+    """ Returns the name of the weight file for remapping the grid of a
+        variable in a file with a cdo remap method, making it if it does
+        not exist yet.
+
+    Parameters
+    ----------
+    name : string
+           name of a file on the source grid
+    method : string
+             cdo remap operator, for example 'remapcon'
+    remapgrid : string
+                grid to remap the data to
+    target : string
+             identity of remapgrid, which changes if the grid file changes
+    var : string
+          variable to be remapped, by default the first grid of the file
+
+    Returns
+    -------
+    string of the weight file, or None if the file should be remapped
+    without weights
+    """
+    if not enabled:
+        return None
+    try:
+        k = key(name, method, target, var)
+    except (OSError, IOError, RuntimeError):
+        return None
+    if k is None or k in _failed:
+        return None
+    out = path(k, method)
+    with _key_lock(k):
+        if os.path.isfile(out):
+            return out
+        if gen_weights(name, method, remapgrid, out, var):
+            return out
+    _failed.add(k)
+    return None
+
+
+if __name__ == "__main__":
+    pass
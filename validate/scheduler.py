@@ -0,0 +1,296 @@
+"""
+scheduler
+===============
+
+This module makes the processed files needed by the plots before
+any of the plots are made. The dataload requests of every plot are
+listed and split into the stages data_loader would run for them.
+The stages of all of the requests are merged into a graph in which
+every product appears once, named by the same chained keys used by
+data_loader. The products are then made in waves by a pool of threads,
+each wave only needing the products of the waves before it, so that a
+product used by several plots is made once and the plots only have to
+read finished files.
+
+Requests which depend on the data of another request, and the plots
+not listed in REQUESTS, make their files when they are plotted.
+
+.. moduleauthor:: David Fallis
+"""
+from multiprocessing.pool import ThreadPool
+from copy import deepcopy
+from netCDF4 import Dataset
+import data_loader as pl
+import yamllog
+
+
+def _levels(ifile, var):
+    """ Returns the rounded levels of the z axis of a variable,
+        or None if it does not have a z axis
+    """
+    try:
+        dataset = Dataset(pl._first(ifile), 'r')
+    except:
+        return None
+    try:
+        ncvar = pl._ncvar(dataset, var)
+        _, zaxis = pl._axes(dataset, ncvar)
+        if zaxis is None:
+            return None
+        return list(pl._depth(dataset, ncvar))
+    except:
+        return None
+    finally:
+        dataset.close()
+
+
+def _plot_depth(plot, ifile):
+    """ Returns the depth the plot will be made at, as found by
+        plot_cases from the data of the file
+    """
+    levels = _levels(ifile, plot['variable'])
+    if levels is None or plot.get('depth') in [None, ""]:
+        return None
+    return min(levels, key=lambda x: abs(x - plot['depth']))
+
+
+def _request(plot, ifile, comp=False, **kwargs):
+    """ Returns the arguments of a dataload request for a file
+    """
+    prefix = 'comp_' if comp else ''
+    request = {'ifile': ifile,
+               'var': plot['variable'],
+               'dates': plot[prefix + 'dates'],
+               'realm': plot['realm_cat'],
+               'remapf': plot['remap'],
+               'remapgrid': plot['remap_grid'],
+               'seasons': plot[prefix + 'seasons'],
+               'external_function': plot['external_function'],
+               'external_function_args': plot['external_function_args'],
+               }
+    request.update(kwargs)
+    return request
+
+
+def _map_requests(plot, ptype):
+    trends = plot['sigma'] and plot['data_type'] == 'trends'
+    datatype = 'full' if trends else plot['data_type']
+    requests = [_request(plot, plot['ifile'], datatype=datatype, cdostring=plot['cdostring'])]
+    if ptype == 'single':
+        return requests
+    depth = _plot_depth(plot, plot['ifile'])
+    requests.append(_request(plot, plot['comp_file'], True, datatype=datatype,
+                             cdostring=plot['cdostring'], depthneeded=[depth]))
+    if plot['alpha'] and plot['data_type'] == 'climatology':
+        requests.append(_request(plot, plot['ifile'], depthneeded=[depth]))
+        requests.append(_request(plot, plot['comp_file'], True, depthneeded=[depth]))
+    return requests
+
+
+def _section_requests(plot, ptype):
+    options = {'datatype': plot['data_type'], 'section': True, 'cdostring': plot['cdostring']}
+    if ptype == 'single':
+        return [_request(plot, plot['ifile'], **options)]
+    depth = _levels(plot['comp_file'], plot['variable'])
+    requests = [_request(plot, plot['comp_file'], True, **options),
+                _request(plot, plot['ifile'], depthneeded=depth, **options)]
+    if plot['alpha'] and plot['data_type'] == 'climatology':
+        requests.append(_request(plot, plot['ifile'], depthneeded=depth, section=True))
+        requests.append(_request(plot, plot['comp_file'], True, depthneeded=depth, section=True))
+    return requests
+
+
+def _timeseries_requests(plot, ptype):
+    options = {'fieldmean': True, 'yearmean': plot['yearmean'], 'cdostring': plot['cdostring']}
+    requests = [_request(plot, plot['ifile'], **options)]
+    depth = _plot_depth(plot, plot['ifile'])
+    files = [plot['obs_file'][o] for o in plot['comp_obs']]
+    files += [plot['model_file'][m] for m in plot['comp_models']]
+    files += [plot['cmip5_file']] if plot['cmip5_file'] else []
+    files += plot['cmip5_files']
+    for f in files:
+        requests.append(_request(plot, f, True, depthneeded=[depth], **options))
+    return requests
+
+
+def _zonalmean_requests(plot, ptype):
+    options = {'datatype': plot['data_type'], 'section': True}
+    requests = [_request(plot, plot['ifile'], **options)]
+    depth = _plot_depth(plot, plot['ifile'])
+    files = [plot['obs_file'][o] for o in plot['comp_obs']]
+    files += [plot['model_file'][m] for m in plot['comp_models']]
+    files += [plot['id_file'][i] for i in plot['comp_ids']]
+    files += [plot['cmip5_file']] if plot['cmip5_file'] else []
+    for f in files:
+        requests.append(_request(plot, f, True, depthneeded=[depth], **options))
+    return requests
+
+
+def _histogram_requests(plot, ptype):
+    options = {'datatype': plot['data_type'], 'yearmean': plot['yearmean'],
+               'fieldmean': True, 'cdostring': plot['cdostring']}
+    requests = [_request(plot, plot['ifile'], True, **options)]
+    files = [plot['obs_file'][o] for o in plot['comp_obs']]
+    files += [plot['id_file'][i] for i in plot['comp_ids']]
+    files += [plot['model_file'][m] for m in plot['comp_models']]
+    files += plot['cmip5_files']
+    for f in files:
+        requests.append(_request(plot, f, True, **options))
+    return requests
+
+
+REQUESTS = {'global_map': _map_requests,
+            'polar_map': _map_requests,
+            'polar_map_south': _map_requests,
+            'mercator': _map_requests,
+            'section': _section_requests,
+            'time_series': _timeseries_requests,
+            'zonal_mean': _zonalmean_requests,
+            'histogram': _histogram_requests,
+            }
+
+# projections which are only made as a comparison
+COMPARE_ONLY = ['time_series', 'zonal_mean', 'histogram']
+
+
+def _comparison_files(plot):
+    """ Returns the files compared to in the same order as plot_iterator.comp_loop
+    """
+    files = [plot['obs_file'][o] for o in plot['comp_obs']]
+    if plot['comp_cmips']:
+        files.append(plot['cmip5_file'])
+    files += [plot['model_file'][m] for m in plot['comp_models']]
+    files += [plot['id_file'][i] for i in plot['id_file']]
+    return files
+
+
+def requests(plots):
+    """ Returns the list of the dataload requests made by the plots
+    """
+    found = []
+    for p in plots:
+        func = REQUESTS.get(p['plot_projection'])
+        if func is None:
+            continue
+        for d in p['depths']:
+            plot = deepcopy(p)
+            try:
+                plot['depth'] = int(d)
+            except:
+                plot['depth'] = None
+            try:
+                if p['plot_projection'] in COMPARE_ONLY:
+                    found.extend(func(plot, 'compare'))
+                    continue
+                found.extend(func(plot, 'single'))
+                for f in _comparison_files(plot):
+                    plot['comp_file'] = f
+                    found.extend(func(plot, 'compare'))
+            except (KeyError, TypeError):
+                # the files of the plot were not all found
+                continue
+    return found
+
+
+def graph(requests):
+    """ Merges the stages of the requests into a graph of products
+
+    Returns
+    -------
+    dictionary mapping the key of each product to a dictionary with the
+    input file, variable and realm, the stages leading to it, the stages
+    of the request before they were planned, the key of the product it is
+    made from, the number of products made from it and whether it is
+    the final product of a request
+    """
+    nodes = {}
+    for request in requests:
+        if request.get('external_function') is not None:
+            continue
+        try:
+            # the same time slices as dataload reads, so that the keys match
+            ifile = pl.time_slices(request['ifile'], request['dates'])
+            requested = pl.requested_stages(**request)
+            stages = pl._plan(ifile, request['var'], requested)
+        except:
+            continue
+        if not stages:
+            continue
+        keys = pl.chain_keys(ifile, stages)
+        parent = None
+        for i, key in enumerate(keys):
+            if key not in nodes:
+                nodes[key] = {'file': ifile,
+                              'var': request['var'],
+                              'realm': request['realm'],
+                              'stages': stages[:i + 1],
+                              'requested': requested,
+                              'parent': parent,
+                              'children': set(),
+                              'final': False,
+                              }
+                if parent is not None:
+                    nodes[parent]['children'].add(key)
+            parent = key
+        nodes[parent]['final'] = True
+    return nodes
+
+
+def targets(nodes):
+    """ Returns the keys of the products which have to be written to disk.
+        These are the final products of the requests and the products
+        needed by more than one other product.
+    """
+    return set(key for key in nodes
+               if nodes[key]['final'] or len(nodes[key]['children']) > 1)
+
+
+def waves(nodes, keys):
+    """ Splits the products into lists which only depend on the
+        products in the lists before them
+    """
+    depth = {}
+    for key in keys:
+        n = 0
+        parent = nodes[key]['parent']
+        while parent is not None:
+            if parent in keys:
+                n += 1
+            parent = nodes[parent]['parent']
+        depth[key] = n
+    return [sorted(k for k in keys if depth[k] == n)
+            for n in xrange(max(depth.values()) + 1)] if depth else []
+
+
+def _make(node):
+    try:
+        pl.execute(node['file'], node['stages'], node['requested'])
+    except:
+        return 'Failed to prepare ' + pl.file_name(node['file']) + ' for ' + node['stages'][0][1][0] + '\n'
+    return None
+
+
+def run(plots, jobs=1):
+    """ Makes the processed files needed by the plots with a pool of
+        jobs threads
+    """
+    nodes = graph(requests(plots))
+    keys = targets(nodes)
+    for key in keys:
+        if nodes[key]['children']:
+            pl.share(key)
+    pool = ThreadPool(max(jobs, 1))
+    try:
+        for wave in waves(nodes, keys):
+            for message in pool.map(_make, [nodes[key] for key in wave]):
+                if message is not None:
+                    yamllog.write(message)
+    finally:
+        pool.close()
+        pool.join()
+    yamllog.write('Prepared ' + str(len(keys)) + ' products from ' + str(len(nodes)) +
+                  ' stages before plotting\n\n')
+
+
+if __name__ == "__main__":
+    pass
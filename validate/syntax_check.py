@@ -141,23 +141,42 @@ def check_scale(scale):
         raise TypeError("'scale' must be 'int' or 'float' type")
 
 
+def check_stipple_density(density):
+    """ Raises TypeError if the argument is not a list of two integers.
+        Raises ValueError if the integers are not positive.
+    """
+    if type(density) is not list and type(density) is not tuple:
+        raise TypeError("'stipple_density' must be 'list' type")
+    if len(density) != 2:
+        raise TypeError("'stipple_density' must be [rows, columns]")
+    for step in density:
+        if type(step) is not int:
+            raise TypeError("the rows and columns in 'stipple_density' must be 'int' type")
+        if step < 1:
+            raise ValueError("the rows and columns in 'stipple_density' must be positive")
+
+
 def check_plot_args(pargs):
     """ Raises TypeError if the argument is not a dictionary.
         Raises TypeError if the keys in the dictionary are not strings.
         Raises ValueError if the keys are not in the list of 
         possible values.
+        Raises exception if 'stipple_density' is not valid.
     """
     if type(pargs) is not dict:
         raise TypeError("'plot_args' must be 'dict' type")
     possible_keys = ['fill_continents',
                      'draw_parallels',
                      'draw_meridians',
+                     'stipple_density',
                      ]
     for key in pargs:
         if type(key) is not str:
             raise TypeError("Keys in 'plot_args' must be 'str' type")
         if key not in possible_keys:
-            raise ValueError("Keys in 'plot_args' must be one of 'fill_continents', 'draw_parallels', or 'draw_meridians'")
+            raise ValueError("Keys in 'plot_args' must be one of 'fill_continents', 'draw_parallels', 'draw_meridians', or 'stipple_density'")
+    if 'stipple_density' in pargs:
+        check_stipple_density(pargs['stipple_density'])
 
 
 def check_dict(dargs, data):
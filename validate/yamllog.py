@@ -2,11 +2,22 @@
 yamllog
 ===============
 
+This module writes the records of the plots to logs/log.yml and
+the messages of a run to logs/log.txt. While buffer() is in effect
+the records are kept in memory instead, so that plots made in
+worker processes can be logged by the parent in a fixed order.
+
 .. moduleauthor:: David Fallis
 """
 
 import yaml
 
+LOGFILE = 'logs/log.txt'
+YAMLFILE = 'logs/log.yml'
+
+# list of (file name, text) records while buffering, otherwise None
+_records = None
+
 OUTPUT_ORDER = ['plot_name',
                 'variable',
                 'depth',
@@ -49,13 +60,44 @@ def convert(plot):
     return yamplot
 
 
+def write(text, name=LOGFILE):
+    """ Appends text to a log file, or keeps it if buffering
+    """
+    if _records is not None:
+        _records.append((name, text))
+    else:
+        with open(name, 'a') as outfile:
+            outfile.write(text)
+
+
+def buffer():
+    """ Starts keeping the log records in memory
+    """
+    global _records
+    _records = []
+
+
+def unbuffer():
+    """ Stops keeping the log records in memory and returns them
+    """
+    global _records
+    records = _records or []
+    _records = None
+    return records
+
+
+def write_records(records):
+    """ Writes the records returned by unbuffer()
+    """
+    for name, text in records:
+        write(text, name)
+
+
 def output(yamplot):
-    with open('logs/log.yml', 'a') as outfile:
-        outfile.write('\n-----\n\n')
+    write('\n-----\n\n', YAMLFILE)
     for name in OUTPUT_ORDER:
         printer = {name: yamplot[name]}
-        with open('logs/log.yml', 'a') as outfile:
-            outfile.write(yaml.dump(printer, default_flow_style=False))
+        write(yaml.dump(printer, default_flow_style=False), YAMLFILE)
 
 
 def log(plot):